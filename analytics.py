@@ -0,0 +1,101 @@
+# analytics.py
+"""
+血壓統計（向量化）：以本地日（utils.TZ）resample 一次，再對所有時間窗做 time-based rolling。
+- 7 / 30 / 90 日滾動平均（收縮壓、舒張壓、心跳；以讀值筆數加權）
+- 晨間 vs 晚間平均（本地時間 MORNING_HOURS / EVENING_HOURS）
+- 日間變異：每日平均的標準差（SD）、相鄰量測日差值絕對值平均（ARV）
+- 趨勢斜率：每日平均對日期的最小平方斜率（mmHg / 週）
+- 達標率：收縮壓、舒張壓皆低於目標的讀值比例
+結果是「每個本地日 × 每個時間窗」的表，任何截止日都只是查表；快取見 cache.analytics。
+"""
+from __future__ import annotations
+from typing import Dict, Optional, Sequence, TYPE_CHECKING
+
+from utils import TZ
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+WINDOWS = (7, 30, 90)
+MORNING_HOURS = (4, 12)    # [04:00, 12:00)
+EVENING_HOURS = (18, 24)   # [18:00, 24:00)
+
+# summary() 的欄位順序
+METRICS = [
+    "n", "sys_mean", "dia_mean", "pulse_mean", "hit_rate",
+    "sys_am", "dia_am", "sys_pm", "dia_pm",
+    "sys_sd", "dia_sd", "sys_arv", "dia_arv", "sys_slope", "dia_slope",
+]
+
+
+def _empty(windows: Sequence[int]) -> "pd.DataFrame":
+    import pandas as pd
+    return pd.DataFrame(columns=[f"{m}_{w}" for w in windows for m in METRICS],
+                        index=pd.DatetimeIndex([], name="day"), dtype=float)
+
+
+def rolling_daily(df: "pd.DataFrame", target_sys: float, target_dia: float,
+                  windows: Sequence[int] = WINDOWS) -> "pd.DataFrame":
+    """
+    df 為 enrich_bp 的輸出（datetime 為 tz-aware）。回傳以本地日為索引（naive、逐日連續）的表，
+    欄名為 {指標}_{天數}，例如 sys_mean_7、hit_rate_30、sys_slope_90；該窗內無資料為 NaN。
+    """
+    import numpy as np
+    import pandas as pd
+    if df is None or df.empty:
+        return _empty(windows)
+
+    local = df["datetime"].dt.tz_convert(TZ)
+    hour = local.dt.hour.to_numpy()
+    am = (hour >= MORNING_HOURS[0]) & (hour < MORNING_HOURS[1])
+    pm = (hour >= EVENING_HOURS[0]) & (hour < EVENING_HOURS[1])
+    sys_ = df["systolic"].to_numpy(dtype=float)
+    dia = df["diastolic"].to_numpy(dtype=float)
+    hit = np.where(np.isnan(sys_) | np.isnan(dia), np.nan, (sys_ < target_sys) & (dia < target_dia))
+
+    # 一次 resample：各欄逐日加總與筆數（NaN 不計）
+    x = pd.DataFrame({
+        "sys": sys_, "dia": dia, "pulse": df["pulse"].to_numpy(dtype=float), "hit": hit,
+        "sys_am": np.where(am, sys_, np.nan), "dia_am": np.where(am, dia, np.nan),
+        "sys_pm": np.where(pm, sys_, np.nan), "dia_pm": np.where(pm, dia, np.nan),
+    }, index=pd.DatetimeIndex(local.dt.tz_localize(None).dt.normalize(), name="day"))
+    g = x.resample("D")
+    sums, counts = g.sum(), g.count()
+    daily = sums / counts.where(counts > 0)                 # 每日平均（無資料日為 NaN）
+
+    # 斜率用的日序（相對於第一天，避免大數相減失去精度）
+    t = pd.Series(np.arange(len(daily), dtype=float), index=daily.index)
+    out = {}
+    for w in windows:
+        span = f"{w}D"
+        s_sum, s_cnt = sums.rolling(span).sum(), counts.rolling(span).sum()
+        mean = s_sum / s_cnt.where(s_cnt > 0)
+        out[f"n_{w}"] = s_cnt["sys"]
+        out[f"sys_mean_{w}"], out[f"dia_mean_{w}"], out[f"pulse_mean_{w}"] = mean["sys"], mean["dia"], mean["pulse"]
+        out[f"hit_rate_{w}"] = 100.0 * mean["hit"]
+        for c in ("sys_am", "dia_am", "sys_pm", "dia_pm"):
+            out[f"{c}_{w}"] = mean[c]
+        for c in ("sys", "dia"):
+            y = daily[c]
+            out[f"{c}_sd_{w}"] = y.rolling(span, min_periods=2).std()
+            # ARV：相鄰「有量測」日的差值絕對值，落在窗內者取平均
+            out[f"{c}_arv_{w}"] = y.dropna().diff().abs().reindex(y.index).rolling(span).mean()
+            # 最小平方斜率：以滾動加總求 (nΣxy − ΣxΣy) / (nΣx² − (Σx)²)，換算成每週
+            valid = y.notna().astype(float)
+            tx, ty = t * valid, y.fillna(0.0)
+            n = valid.rolling(span).sum()
+            sx, sy = tx.rolling(span).sum(), ty.rolling(span).sum()
+            sxy, sxx = (tx * ty).rolling(span).sum(), (tx * tx).rolling(span).sum()
+            den = n * sxx - sx * sx
+            out[f"{c}_slope_{w}"] = 7.0 * (n * sxy - sx * sy) / den.where((n >= 2) & (den > 0))
+    return pd.DataFrame(out, index=daily.index)[[f"{m}_{w}" for w in windows for m in METRICS]]
+
+
+def summary(rolled: "pd.DataFrame", day, windows: Optional[Sequence[int]] = None) -> "pd.DataFrame":
+    """取 rolling_daily 在本地日 day（date / ISO 字串）的值：列 = 時間窗（天），欄 = METRICS。"""
+    import pandas as pd
+    windows = list(windows or WINDOWS)
+    key = pd.Timestamp(day)
+    row = rolled.loc[key] if key in rolled.index else pd.Series(dtype=float)
+    data: Dict[str, list] = {m: [row.get(f"{m}_{w}", float("nan")) for w in windows] for m in METRICS}
+    return pd.DataFrame(data, index=pd.Index(windows, name="days"))
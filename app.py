@@ -24,6 +24,8 @@ except Exception:
 
 try:
     import db  # SQLite + Argon2
+    import instrument
+    from hashing import HashingBusy, HashingTimeout
 except Exception:
     st.error("系統載入失敗，請稍後再試。")
     if DEBUG:
@@ -32,8 +34,12 @@ except Exception:
 
 # ---------------- 基本設定 ----------------
 st.set_page_config(page_title=t("app.title"), page_icon="💚", layout="wide")
+instrument.begin_rerun("app", enabled=DEBUG)  # DEBUG 時記錄本次 rerun 的查詢 / 雜湊耗時
 init_state()
 db.init_db()  # 確保 DB schema 存在
+if st.secrets.get("BACKUP_INTERVAL_HOURS", 0):
+    import backup
+    backup.start_scheduler(float(st.secrets["BACKUP_INTERVAL_HOURS"]))  # 每個行程只啟動一次
 
 # ---------------- 語言處理（URL 參數 & 側欄選擇） ----------------
 qp = st.query_params
@@ -61,39 +67,45 @@ with st.sidebar:
 def logged_in() -> bool:
     return "user" in st.session_state and st.session_state["user"] is not None
 
-# ---------------- 簡易登入速率限制 ----------------
-from datetime import datetime, timedelta
+# ---------------- 登入速率限制（存於 SQLite，跨 session 共用） ----------------
+# 依 email 與來源端各自計數；被鎖定時在驗證密碼（Argon2）之前就拒絕。
+# 來源端無法可靠判定時不建立 client 計數：共用一個桶會讓任何人的失敗鎖住全站登入。
+CLIENT_MAX_FAIL = 20
+# 反向代理的 IP（secrets 的 TRUSTED_PROXIES）；只有直接連線端是這些位址時才採用 X-Forwarded-For
+TRUSTED_PROXIES = frozenset(st.secrets.get("TRUSTED_PROXIES", []))
 
-def _rl_key(email: str) -> str:
-    return f"rl::{(email or '').strip().lower()}"
+def _client_id():
+    """
+    來源端 IP；無法判定時回傳 None。
+    X-Forwarded-For 可由用戶端任意填寫：只在直接連線端為受信任代理時採用，
+    並由右往左略過受信任代理，取第一個不受信任的位址（最左邊的值不可信）。
+    """
+    ctx = getattr(st, "context", None)
+    ip = getattr(ctx, "ip_address", None) if ctx else None
+    if not ip or ip not in TRUSTED_PROXIES:
+        return ip or None
+    xff = (getattr(ctx, "headers", None) or {}).get("X-Forwarded-For", "")
+    hops = [h.strip() for h in xff.split(",") if h.strip()]
+    while hops and hops[-1] in TRUSTED_PROXIES:
+        hops.pop()
+    return hops[-1] if hops else None  # 代理本身的 IP 不當成來源端
+
+def _rl_keys(email: str) -> list:
+    keys = [f"email:{(email or '').strip().lower()}"]
+    client = _client_id()
+    if client:
+        keys.append(f"client:{client}")
+    return keys
 
 def check_rate_limit(email: str) -> bool:
     """回傳 True 表示允許嘗試；False 表示被鎖定"""
-    now = datetime.utcnow()
-    rl = st.session_state.get(_rl_key(email), {"count": 0, "until": None})
-    until = rl.get("until")
-    if until and now < until:
-        return False
-    return True
+    return db.throttle_allowed(_rl_keys(email))
 
 def register_fail(email: str, max_fail=5, window_min=5, lock_min=15):
-    now = datetime.utcnow()
-    key = _rl_key(email)
-    rl = st.session_state.get(key, {"count": 0, "first": now, "until": None})
-    until = rl.get("until")
-    # 若解鎖時間已過，重置
-    if until and now >= until:
-        rl = {"count": 0, "first": now, "until": None}
-    # 視窗重置
-    first = rl.get("first", now)
-    if now - first > timedelta(minutes=window_min):
-        rl = {"count": 0, "first": now, "until": None}
-    rl["count"] = rl.get("count", 0) + 1
-    if rl["count"] >= max_fail:
-        rl["until"] = now + timedelta(minutes=lock_min)
-        rl["count"] = 0
-        rl["first"] = now
-    st.session_state[key] = rl
+    email_key, *client_key = _rl_keys(email)
+    db.throttle_fail(email_key, max_fail, window_min * 60, lock_min * 60)
+    for key in client_key:
+        db.throttle_fail(key, CLIENT_MAX_FAIL, window_min * 60, lock_min * 60)
 
 # ---------------- 側邊欄：帳號登入/註冊 ----------------
 with st.sidebar:
@@ -117,10 +129,15 @@ with st.sidebar:
                     st.error("嘗試過多，請稍後再試。")
                 else:
                     user = db.get_user_by_email(email)
-                    ok = False
-                    if user and db.verify_password(pwd, user["password_hash"]):
-                        ok = True
-                    if ok:
+                    ok = busy = False
+                    try:
+                        if user and db.verify_password(pwd, user["password_hash"]):
+                            ok = True
+                    except (HashingBusy, HashingTimeout):
+                        busy = True  # 雜湊池滿載：快速拒絕，不計入失敗次數
+                    if busy:
+                        st.error("系統忙碌中，請稍後再試。")
+                    elif ok:
                         # 自動升級舊雜湊到 Argon2（如果需要）
                         db.maybe_upgrade_password(user["id"], pwd, user["password_hash"])
                         st.session_state["user"] = {
@@ -150,6 +167,8 @@ with st.sidebar:
                     try:
                         uid = db.create_user(email2, name2 or email2.split("@")[0], pwd2)
                         st.success("Account created. Please login.")
+                    except (HashingBusy, HashingTimeout):
+                        st.error("系統忙碌中，請稍後再試。")
                     except Exception:
                         # 不回傳具體錯誤，避免 email 枚舉
                         st.error("Sign up failed. Please check your info or try again later.")
@@ -157,6 +176,7 @@ with st.sidebar:
 # ---------------- 首頁內容 ----------------
 st.title("💚 " + t("app.title"))
 st.caption(t("app.subtitle"))
+instrument.sidebar_panel()
 
 if not logged_in():
     st.info("請先在左側完成登入或註冊；登入後即可管理你的血壓紀錄。")
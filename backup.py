@@ -0,0 +1,292 @@
+# backup.py
+"""
+線上備份 / 還原（整個 healthhub.db，含 users）：不需停站。
+- 備份：sqlite3.Connection.backup 每步只複製 BACKUP_PAGES 頁、步與步之間 sleep，讓出 CPU 與 I/O；
+  WAL 模式下備份只持有讀取快照，不阻擋寫入。備份期間若有其他連線寫入，SQLite 會從頭重來；
+  重來超過 MAX_RESTARTS 次就改為單一步驟複製整個快照（仍只是讀取交易）
+- WAL checkpoint 策略：備份前後各做一次 PASSIVE（不等待、不阻擋）；WAL 超過 WAL_TRUNCATE_BYTES 時
+  備份後改做 TRUNCATE 把 WAL 檔縮回 0
+- 輸出：先 integrity_check，再以 gzip 壓縮為 healthhub-<UTC 時間>.db.gz，旁邊的 .json 清單記錄
+  壓縮檔與原始檔的 SHA-256、schema 版本、各表筆數
+- 保留：最近 KEEP_LAST 份 + 近 KEEP_DAILY 天每天最新一份，其餘刪除
+- 還原：先完整驗證（checksum、integrity_check、筆數），再經單一寫入執行緒（writer.call_exclusive：
+  先寫完已排隊的寫入、還原期間不處理新寫入）以 backup API 整份寫回使用中的資料庫，
+  並抬高每位使用者的同步序號 floor，讓所有快取 / 鏡像全量重載
+排程：start_scheduler(interval_hours) 啟動背景執行緒定期備份（每個行程一條）。
+"""
+from __future__ import annotations
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import db
+import writer
+
+BACKUP_PAGES = 256            # 每步複製頁數（預設頁大小 4 KiB → 1 MiB）
+BACKUP_SLEEP = 0.005          # 每步之間暫停秒數
+MAX_RESTARTS = 3              # 被寫入打斷重來的次數上限，超過改單一步驟
+WAL_TRUNCATE_BYTES = 64 * 1024 * 1024
+KEEP_LAST = 7
+KEEP_DAILY = 14
+CHUNK = 1024 * 1024
+
+
+class BackupError(RuntimeError):
+    """備份檔驗證失敗（checksum 不符、integrity_check 失敗或筆數不符）。"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def backup_dir() -> Path:
+    """備份目錄：環境變數 HEALTHHUB_BACKUP_DIR，預設為資料庫旁的 backups/。"""
+    return Path(os.environ.get("HEALTHHUB_BACKUP_DIR") or Path(db.DB_PATH).resolve().parent / "backups")
+
+
+# ---------- WAL checkpoint ----------
+def checkpoint(mode: str = "PASSIVE") -> Dict[str, int]:
+    """執行 wal_checkpoint(mode)；回傳 busy / WAL 頁數 / 已寫回頁數。"""
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"unsupported checkpoint mode: {mode}")
+    with db.connection() as conn:
+        busy, log, done = conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+    return {"busy": busy, "wal_pages": log, "checkpointed": done}
+
+
+def _wal_bytes() -> int:
+    wal = Path(str(db.DB_PATH) + "-wal")
+    return wal.stat().st_size if wal.exists() else 0
+
+
+# ---------- 備份 ----------
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _table_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    names = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()]
+    return {n: conn.execute(f'SELECT COUNT(*) FROM "{n}"').fetchone()[0] for n in names}
+
+
+def _check_integrity(conn: sqlite3.Connection) -> None:
+    rows = [r[0] for r in conn.execute("PRAGMA integrity_check;").fetchall()]
+    if rows != ["ok"]:
+        raise BackupError("integrity_check failed: " + "; ".join(rows[:5]))
+
+
+def _copy(src: sqlite3.Connection, dest: Path, pages: int, sleep: float) -> Dict[str, int]:
+    """分步複製；被其他連線的寫入打斷超過 MAX_RESTARTS 次時改單一步驟。回傳步數與重來次數。"""
+    state = {"steps": 0, "restarts": 0, "last": None}
+
+    def progress(status, remaining, total):
+        state["steps"] += 1
+        if state["last"] is not None and remaining > state["last"]:
+            state["restarts"] += 1
+            if state["restarts"] > MAX_RESTARTS:
+                raise _Restarted()
+        state["last"] = remaining
+
+    out = sqlite3.connect(dest)
+    try:
+        try:
+            src.backup(out, pages=pages, progress=progress, sleep=sleep)
+        except _Restarted:
+            src.backup(out, pages=-1)
+            state["steps"] += 1
+    finally:
+        out.close()
+    return {"steps": state["steps"], "restarts": state["restarts"]}
+
+
+def create_backup(dest_dir: Optional[Path] = None, pages: int = BACKUP_PAGES, sleep: float = BACKUP_SLEEP,
+                  rotate_after: bool = True) -> Dict[str, Any]:
+    """建立一份壓縮備份並寫出清單；回傳清單內容（含 path）。"""
+    db.init_db()
+    dest_dir = Path(dest_dir or backup_dir())
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    created = datetime.now(timezone.utc)
+    name = f"healthhub-{created.strftime('%Y%m%dT%H%M%S%fZ')}.db.gz"
+    started = time.perf_counter()
+
+    checkpoint("PASSIVE")
+    with tempfile.TemporaryDirectory(dir=dest_dir) as tmp:
+        raw = Path(tmp) / "snapshot.db"
+        src = db.get_conn()
+        try:
+            copy = _copy(src, raw, pages, sleep)
+        finally:
+            src.close()
+        # 先算 checksum、壓縮，再開檔檢查（開啟 WAL 格式的檔案可能留下 -wal / -shm，不影響已壓縮的內容）
+        raw_sha256 = _sha256(raw)
+        gz_tmp = Path(tmp) / name
+        with open(raw, "rb") as f, gzip.open(gz_tmp, "wb", compresslevel=6) as g:
+            shutil.copyfileobj(f, g, CHUNK)
+        with closing(sqlite3.connect(raw)) as snap:
+            _check_integrity(snap)
+            counts = _table_counts(snap)
+            version = snap.execute("PRAGMA user_version;").fetchone()[0]
+        manifest = {
+            "file": name,
+            "created": created.isoformat(),
+            "sha256": _sha256(gz_tmp),
+            "raw_sha256": raw_sha256,
+            "raw_bytes": raw.stat().st_size,
+            "bytes": gz_tmp.stat().st_size,
+            "schema_version": version,
+            "tables": counts,
+            **copy,
+        }
+        os.replace(gz_tmp, dest_dir / name)
+    (dest_dir / (name + ".json")).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    checkpoint("TRUNCATE" if _wal_bytes() > WAL_TRUNCATE_BYTES else "PASSIVE")
+    manifest["seconds"] = round(time.perf_counter() - started, 3)
+    manifest["path"] = str(dest_dir / name)
+    if rotate_after:
+        rotate(dest_dir)
+    return manifest
+
+
+def list_backups(dest_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """目錄中有清單的備份（新 → 舊）。"""
+    dest_dir = Path(dest_dir or backup_dir())
+    out = []
+    for m in dest_dir.glob("healthhub-*.db.gz.json"):
+        info = json.loads(m.read_text(encoding="utf-8"))
+        info["path"] = str(m.with_suffix(""))
+        out.append(info)
+    return sorted(out, key=lambda i: i["created"], reverse=True)
+
+
+def rotate(dest_dir: Optional[Path] = None, keep_last: int = KEEP_LAST, keep_daily: int = KEEP_DAILY) -> List[str]:
+    """保留最近 keep_last 份，以及最近 keep_daily 個 UTC 日各自最新的一份；回傳刪除的檔名。"""
+    backups = list_backups(dest_dir)
+    keep = {b["file"] for b in backups[:keep_last]}
+    days: List[str] = []
+    for b in backups:
+        day = b["created"][:10]
+        if day not in days:
+            days.append(day)
+            if len(days) <= keep_daily:
+                keep.add(b["file"])
+    removed = []
+    for b in backups:
+        if b["file"] not in keep:
+            p = Path(b["path"])
+            p.unlink(missing_ok=True)
+            Path(str(p) + ".json").unlink(missing_ok=True)
+            removed.append(b["file"])
+    return removed
+
+
+# ---------- 驗證 / 還原 ----------
+def _manifest(path: Path) -> Dict[str, Any]:
+    m = Path(str(path) + ".json")
+    if not m.exists():
+        raise BackupError(f"manifest not found: {m.name}")
+    return json.loads(m.read_text(encoding="utf-8"))
+
+
+def _unpack_verified(path: Path, dest: Path) -> Dict[str, Any]:
+    """驗證壓縮檔 checksum → 解壓到 dest → 驗證原始檔 checksum、integrity_check 與各表筆數。"""
+    manifest = _manifest(path)
+    if _sha256(path) != manifest["sha256"]:
+        raise BackupError(f"checksum mismatch: {path.name}")
+    with gzip.open(path, "rb") as g, open(dest, "wb") as f:
+        shutil.copyfileobj(g, f, CHUNK)
+    if _sha256(dest) != manifest["raw_sha256"]:
+        raise BackupError(f"decompressed checksum mismatch: {path.name}")
+    with closing(sqlite3.connect(dest)) as conn:
+        _check_integrity(conn)
+        if _table_counts(conn) != manifest["tables"]:
+            raise BackupError(f"table counts differ from manifest: {path.name}")
+    return manifest
+
+
+def verify_backup(path) -> Dict[str, Any]:
+    """完整驗證一份備份（不動使用中的資料庫）；失敗丟 BackupError，成功回傳清單。"""
+    path = Path(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        return _unpack_verified(path, Path(tmp) / "verify.db")
+
+
+def _write_back(staged: Path, manifest: Dict[str, Any]) -> None:
+    """在寫入執行緒上獨占執行：以還原當下的序號推進 staged 的 bp_sync，再整份寫回使用中的資料庫。"""
+    with db.connection() as live:
+        live_seq = dict(live.execute("SELECT user_id, seq FROM bp_sync").fetchall())
+    with closing(sqlite3.connect(staged)) as conn:
+        if "bp_sync" in manifest["tables"]:
+            restored = dict(conn.execute("SELECT user_id, seq FROM bp_sync").fetchall())
+            for uid in set(live_seq) | set(restored):
+                seq = max(live_seq.get(uid, 0), restored.get(uid, 0)) + 1
+                conn.execute("""
+                    INSERT INTO bp_sync (user_id, seq, floor_seq) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq, floor_seq = excluded.floor_seq
+                """, (uid, seq, seq))
+            conn.execute("DELETE FROM bp_tombstones")
+            conn.commit()
+        dst = db.get_conn()
+        try:
+            conn.backup(dst, pages=-1)
+        finally:
+            dst.close()
+    db.reset_after_restore()
+
+
+def restore_backup(path) -> Dict[str, Any]:
+    """
+    驗證後把備份整份寫回 db.DB_PATH（線上）。驗證與解壓在呼叫端執行緒完成；寫回經 writer.call_exclusive，
+    排在已送出的寫入之後、期間其他寫入在佇列等候，不會與寫入執行緒的交易交錯。
+    還原後每位使用者的 bp_sync 序號與 floor 都推進到比還原前更大，快取與 Parquet 鏡像一律全量重載。
+    """
+    path = Path(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        staged = Path(tmp) / "restore.db"
+        manifest = _unpack_verified(path, staged)
+        writer.call_exclusive(_write_back, staged, manifest)
+    return manifest
+
+
+# ---------- 排程 ----------
+_scheduler: Optional[threading.Thread] = None
+_scheduler_lock = threading.Lock()
+last_result: Dict[str, Any] = {}
+
+
+def _loop(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            last_result.clear()
+            last_result.update(create_backup())
+        except Exception as e:  # 排程不可因單次失敗而停止
+            last_result.clear()
+            last_result.update({"error": repr(e), "created": datetime.now(timezone.utc).isoformat()})
+
+
+def start_scheduler(interval_hours: float) -> bool:
+    """每 interval_hours 小時備份一次（每個行程只啟動一次；<= 0 不啟動）。回傳是否已在執行。"""
+    global _scheduler
+    if interval_hours <= 0:
+        return False
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_loop, args=(interval_hours * 3600.0,),
+                                          name="db-backup", daemon=True)
+            _scheduler.start()
+    return True
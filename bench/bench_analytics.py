@@ -0,0 +1,99 @@
+# bench/bench_analytics.py
+"""
+analytics.rolling_daily 效能：一次 resample + rolling 算出「每個本地日 × 7/30/90 日窗」的全部指標，
+對照舊寫法（每個窗、每個截止日各自以布林遮罩重新篩選 view）。
+
+    python bench/bench_analytics.py             # 100k / 1M
+    python bench/bench_analytics.py 300000      # 自訂筆數
+
+同時在數個截止日以逐窗篩選的直接算法核對平均、晨晚平均、達標率、SD、ARV 與斜率。
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import analytics  # noqa: E402
+from utils import TZ, enrich_bp  # noqa: E402
+
+TARGETS = (130.0, 80.0)
+CHECK_DAYS = 5
+
+
+def make_frame(n: int, seed: int = 42) -> pd.DataFrame:
+    """每日約 4 筆（歷史最長 20 年，筆數更多時每日加密）；收縮壓帶緩慢趨勢，1% 缺值。"""
+    rng = np.random.default_rng(seed)
+    days = min(max(n // 4, 1), 20 * 365)
+    start = pd.Timestamp("2015-01-01", tz="UTC").value // 10**9
+    ts = start + np.sort(rng.integers(0, days * 86400, n))
+    trend = np.linspace(0, 10, n)
+    sys_ = (rng.normal(128, 12, n) + trend).round()
+    dia = rng.normal(82, 8, n).round()
+    sys_[rng.random(n) < 0.01] = np.nan
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1), "datetime": pd.to_datetime(ts, unit="s", utc=True),
+        "systolic": sys_, "diastolic": dia, "pulse": rng.normal(72, 8, n).round(),
+        "meds": "", "note": "",
+    })
+
+
+def direct(df: pd.DataFrame, day: pd.Timestamp, w: int) -> dict:
+    """逐窗遮罩篩選的直接算法（舊頁面寫法的延伸），作為正確性對照。"""
+    local = df["datetime"].dt.tz_convert(TZ)
+    d = local.dt.tz_localize(None).dt.normalize()
+    sub = df[(d > day - pd.Timedelta(days=w)) & (d <= day)]
+    sd = d[sub.index]
+    h = local[sub.index].dt.hour
+    s, a = sub["systolic"].astype(float), sub["diastolic"].astype(float)  # enrich_bp 存 float32；統計與 analytics 同樣以 float64 計算
+    ok = s.notna() & a.notna()
+    daily = s.groupby(sd).mean().dropna()
+    x = (daily.index - daily.index[0]).days.to_numpy(dtype=float)
+    return {
+        "sys_mean": s.mean(), "dia_mean": a.mean(),
+        "hit_rate": 100.0 * ((s[ok] < TARGETS[0]) & (a[ok] < TARGETS[1])).mean(),
+        "sys_am": s[(h >= 4) & (h < 12)].mean(), "sys_pm": s[h >= 18].mean(),
+        "sys_sd": daily.std(), "sys_slope": 7.0 * np.polyfit(x, daily.to_numpy(), 1)[0] if len(daily) > 1 else np.nan,
+    }
+
+
+def legacy(df: pd.DataFrame, days: list) -> None:
+    """舊寫法的成本：每個截止日、每個時間窗重新篩選一次。"""
+    local_day = df["datetime"].dt.tz_convert(TZ).dt.date
+    for day in days:
+        for w in analytics.WINDOWS:
+            lo = day - pd.Timedelta(days=w - 1)
+            sub = df[(local_day >= lo.date()) & (local_day <= day.date())]
+            sub["systolic"].mean(), sub["diastolic"].mean(), sub["pulse"].mean()
+
+
+def run(n: int) -> None:
+    df = enrich_bp(make_frame(n))
+
+    t0 = time.perf_counter()
+    rolled = analytics.rolling_daily(df, *TARGETS)
+    t_new = time.perf_counter() - t0
+
+    anchors = list(rolled.index[-CHECK_DAYS:])
+    t0 = time.perf_counter()
+    legacy(df, anchors)
+    t_old = (time.perf_counter() - t0) / len(anchors)
+
+    for day in anchors:
+        got = analytics.summary(rolled, day)
+        for w in analytics.WINDOWS:
+            for k, v in direct(df, day, w).items():
+                # 斜率由滾動加總相減求得，容許較大的浮點誤差
+                tol = 1e-6 if k.endswith("slope") else 1e-9
+                assert np.isclose(got.at[w, k], v, rtol=tol, atol=tol, equal_nan=True), (day, w, k, got.at[w, k], v)
+
+    print(f"{n:>9,} rows  {len(rolled):>6,} days  rolling_daily {t_new:7.3f}s (all days × {len(analytics.WINDOWS)} windows)"
+          f"  legacy mask filter {t_old:7.3f}s per anchor day (means only)")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [100_000, 1_000_000]
+    for n in sizes:
+        run(n)
@@ -0,0 +1,68 @@
+# bench/bench_enrich_bp.py
+"""
+enrich_bp 分類效能：逐列 apply（舊版）vs 向量化 classify_bp。
+
+    python bench/bench_enrich_bp.py            # 10k / 100k / 1M
+    python bench/bench_enrich_bp.py 50000      # 自訂筆數
+
+同時比對兩者結果（含缺值 → Unknown/99）必須完全一致。
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils import classify_bp  # noqa: E402
+
+
+def _legacy_category(s, d):
+    if pd.isna(s) or pd.isna(d):
+        return ("Unknown", 99)
+    if s < 120 and d < 80:
+        return ("Normal", 0)
+    if 120 <= s < 130 and d < 80:
+        return ("Elevated", 1)
+    if (130 <= s < 140) or (80 <= d < 90):
+        return ("Hypertension Stage 1", 2)
+    if (s >= 140) or (d >= 90):
+        return ("Hypertension Stage 2", 3)
+    return ("Unknown", 99)
+
+
+def legacy_classify(df: pd.DataFrame):
+    cats = df.apply(lambda r: _legacy_category(r.get("systolic"), r.get("diastolic")), axis=1, result_type="expand")
+    return cats[0], pd.to_numeric(cats[1], errors="coerce")
+
+
+def make_frame(n: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    sys_ = rng.normal(128, 15, n).round()
+    dia = rng.normal(82, 10, n).round()
+    sys_[rng.random(n) < 0.01] = np.nan
+    dia[rng.random(n) < 0.01] = np.nan
+    return pd.DataFrame({"systolic": sys_, "diastolic": dia})
+
+
+def run(n: int) -> None:
+    df = make_frame(n)
+
+    t0 = time.perf_counter()
+    cat_new, lvl_new = classify_bp(df["systolic"], df["diastolic"])
+    t_new = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    cat_old, lvl_old = legacy_classify(df)
+    t_old = time.perf_counter() - t0
+
+    assert (cat_old.to_numpy() == cat_new).all(), "category mismatch"
+    assert (lvl_old.to_numpy() == lvl_new).all(), "cat_level mismatch"
+    print(f"{n:>9,} rows  apply {t_old:8.3f}s  vectorized {t_new:8.4f}s  speedup x{t_old / max(t_new, 1e-9):,.0f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n in sizes:
+        run(n)
@@ -0,0 +1,123 @@
+# bench/bench_export_memory.py
+"""
+匯出峰值記憶體：list_bp + to_csv（舊作法）vs export 串流（csv / csv.gz / parquet / arrow）。
+
+    python bench/bench_export_memory.py               # 100k、1M 筆
+    python bench/bench_export_memory.py 200000
+
+每種作法在獨立子行程執行，背景執行緒取樣 RSS，回報「已匯入模組」之後的增量峰值；
+資料寫在暫存目錄的 healthhub.db，不影響正式資料庫。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def _rss_mb() -> float:
+    """目前 RSS（MiB）；需要 /proc（Linux）。"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class PeakRSS:
+    """背景每 2 ms 取樣一次 RSS，記錄最大值。"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = _rss_mb()
+        self._stop = threading.Event()
+        self._t = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self) -> "PeakRSS":
+        self._t.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._t.join()
+        self.peak = max(self.peak, _rss_mb())
+
+
+def populate(db_path: Path, n: int) -> int:
+    import numpy as np
+    import pandas as pd
+    import db
+
+    db.configure_pool(path=db_path)
+    db.init_db()
+    with db.connection() as conn:
+        uid = conn.execute(
+            "INSERT INTO users (email, name, password_hash) VALUES ('bench@example.com', 'bench', 'x')"
+        ).lastrowid
+    rng = np.random.default_rng(1)
+    dt = pd.Timestamp("2015-01-01", tz="UTC") + pd.to_timedelta(np.sort(rng.uniform(0, 10 * 365 * 86400, n)), unit="s")
+    frame = pd.DataFrame({
+        "datetime": dt,
+        "systolic": rng.normal(128, 12, n).round(),
+        "diastolic": rng.normal(82, 8, n).round(),
+        "pulse": rng.normal(72, 8, n).round(),
+        "meds": np.where(rng.random(n) < 0.3, "amlodipine 5mg", ""),
+        "note": np.where(rng.random(n) < 0.1, "after coffee", ""),
+    })
+    db.add_bp_many(uid, frame)
+    return uid
+
+
+def child(mode: str, db_path: str, uid: int) -> None:
+    import db
+    import export
+    import pandas as pd  # noqa: F401  基準值包含 pandas，與舊作法公平比較
+    if mode in ("parquet", "arrow"):
+        import pyarrow.parquet  # noqa: F401
+    db.configure_pool(path=Path(db_path))
+    base = _rss_mb()
+    t0 = time.perf_counter()
+    with PeakRSS() as peak, tempfile.TemporaryFile() as f:
+        if mode == "list_bp+to_csv":
+            f.write(db.list_bp(uid).to_csv(index=False).encode("utf-8"))
+        else:
+            export.write_export(uid, mode, f)
+        size = f.tell()
+    dt = time.perf_counter() - t0
+    print(f"{mode:<16} peak +{peak.peak - base:8.1f} MiB  {size / 1e6:8.1f} MB  {dt:6.2f}s")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("rows", nargs="*", type=int, default=[100_000, 1_000_000])
+    ap.add_argument("--child", nargs=3, metavar=("MODE", "DB", "UID"))
+    args = ap.parse_args()
+    if args.child:
+        mode, db_path, uid = args.child
+        child(mode, db_path, int(uid))
+        return
+
+    import export
+    modes = ["list_bp+to_csv", *export.available_formats()]
+    for n in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "healthhub.db"
+            uid = populate(db_path, n)
+            print(f"--- {n:,} rows")
+            for mode in modes:
+                subprocess.run(
+                    [sys.executable, __file__, "--child", mode, str(db_path), str(uid)],
+                    check=True, cwd=ROOT, env={**os.environ, "PYTHONPATH": str(ROOT)},
+                )
+
+
+if __name__ == "__main__":
+    main()
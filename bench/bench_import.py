@@ -0,0 +1,95 @@
+# bench/bench_import.py
+"""
+冪等匯入基準：資料表已有 N 筆時匯入一份 M 筆（一半與既有紀錄重疊、部分備註不同、含檔內重複）的檔案，比較
+- pandas：list_bp 讀出整位使用者的紀錄，merge 比對自然鍵後 add_bp_many 新列、update_bp_many 備註變更
+- import_bp：暫存表 + 一次 JOIN 分類 + INSERT ... ON CONFLICT DO UPDATE（集合運算，不讀回整張表）
+兩者都匯入兩次（第二次應全部略過），並確認結果筆數、計數與彙總表一致。
+
+    python bench/bench_import.py                        # 表 1M 筆、檔案 100k 筆
+    python bench/bench_import.py --rows 200000 --file 50000
+
+每種作法使用獨立暫存資料庫。
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import db  # noqa: E402
+
+KEY = ["datetime", "systolic", "diastolic", "pulse"]
+
+
+def history(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(3)
+    return pd.DataFrame({
+        "datetime": pd.Timestamp("2005-01-01", tz="UTC") + pd.to_timedelta(np.arange(n) * 600, unit="s"),
+        "systolic": rng.normal(128, 12, n).round(), "diastolic": rng.normal(82, 8, n).round(),
+        "pulse": rng.normal(72, 8, n).round(), "meds": "", "note": "",
+    })
+
+
+def upload(hist: pd.DataFrame, m: int) -> pd.DataFrame:
+    """後半段 m/2 筆與既有重疊（其中 10% 備註不同）+ m/2 筆新紀錄 + 1% 檔內重複。"""
+    old = hist.iloc[-(m // 2):].copy()
+    old.loc[old.index[::10], "note"] = "re-imported"
+    new = history(m // 2)
+    new["datetime"] += pd.Timedelta(days=365 * 30)
+    out = pd.concat([old, new], ignore_index=True)
+    return pd.concat([out, out.iloc[:: 100]], ignore_index=True)
+
+
+def pandas_import(uid: int, up: pd.DataFrame) -> dict:
+    total = len(up)
+    up = up.drop_duplicates(KEY, keep="last")
+    cur = db.list_bp(uid)
+    merged = up.merge(cur, on=KEY, how="left", suffixes=("", "_db"), indicator=True)
+    new = merged[merged["_merge"] == "left_only"]
+    both = merged[merged["_merge"] == "both"]
+    changed = both[(both["meds"] != both["meds_db"]) | (both["note"] != both["note_db"])]
+    db.add_bp_many(uid, new[up.columns])
+    if not changed.empty:
+        db.update_bp_many(uid, pd.DataFrame({"id": changed["id"].astype(int),
+                                             "meds": changed["meds"], "note": changed["note"]}))
+    return {"inserted": len(new), "updated": len(changed), "skipped": total - len(new) - len(changed)}
+
+
+def run(mode: str, rows: int, m: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure_pool(Path(tmp) / "healthhub.db")
+        db.init_db()
+        uid = db.create_user("imp@example.com", "imp", "Import-bench-1")
+        hist = history(rows)
+        db.add_bp_many(uid, hist)
+        up = upload(hist, m)
+        fn = db.import_bp if mode == "import_bp" else pandas_import
+        for attempt in ("first", "repeat"):
+            t0 = time.perf_counter()
+            res = fn(uid, up)
+            dt = time.perf_counter() - t0
+            print(f"{mode:<9} {attempt:<6} {dt * 1000:8.1f} ms  {res}")
+        with db.connection() as conn:
+            n = conn.execute("SELECT COUNT(*) FROM blood_pressure WHERE user_id = ?", (uid,)).fetchone()[0]
+            m_daily = conn.execute("SELECT SUM(n) FROM bp_daily WHERE user_id = ?", (uid,)).fetchone()[0]
+        print(f"{'':<9} table {n:,} rows  (expected {rows + m // 2:,})  rollups {'ok' if n == m_daily else 'MISMATCH'}")
+        db.configure_pool(Path("healthhub.db"))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--file", type=int, default=100_000)
+    args = ap.parse_args()
+    for mode in ("pandas", "import_bp"):
+        run(mode, args.rows, args.file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# bench/bench_page_memory.py
+"""
+血壓頁每個 session 的記憶體：一次 rerun 的資料管線（不含 Streamlit 繪製），比較
+- before：float64 / 字串 / object 分類欄的 enrich，.dt.date 遮罩 + view.copy()，整段 melt 後才降採樣
+- after ：目前的 enrich_bp（float32 / int8 / category）與頁面寫法（二分切片、逐序列降採樣）
+回報：
+- cached   ：快取中的 enriched frame（同一使用者所有 session 共用一份）深度大小
+- rerun    ：單次 rerun 的 RSS 峰值增量（預設篩選 = 全部期間）
+- sessions ：同時有 N 個 session 在 rerun（各自持有 rerun 內的中間物件）時，平均每個 session 常駐增量
+
+    python bench/bench_page_memory.py                    # 100k 筆、4 個 session
+    python bench/bench_page_memory.py 1000000 --sessions 8
+
+每種寫法在獨立子行程執行；資料寫在暫存目錄的 healthhub.db。
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bench_export_memory import PeakRSS, _rss_mb, populate  # noqa: E402
+
+MODES = ("before", "after")
+
+
+def legacy_enrich(df):
+    """本次調整前的 enrich_bp：整份複製、float64、object 分類欄、文字欄保留原型別。"""
+    import pandas as pd
+    from utils import classify_bp
+    out = df.copy()
+    for col in ("systolic", "diastolic", "pulse"):
+        out[col] = pd.to_numeric(out[col], errors="coerce")
+    out["pp"] = out["systolic"] - out["diastolic"]
+    out["map"] = out["diastolic"] + (out["pp"] / 3.0)
+    out["category"], out["cat_level"] = classify_bp(out["systolic"], out["diastolic"])
+    return out.sort_values("datetime", kind="mergesort").reset_index(drop=True)
+
+
+def rerun_before(df, uid):
+    """調整前頁面的資料管線（篩選 = 全部期間）。"""
+    import pandas as pd
+    import db
+    from utils import TZ, downsample
+    raw_df = df[db.BP_EXPORT_COLUMNS]
+    df_dt = df["datetime"].dt.tz_convert(TZ)
+    start, end = df_dt.dropna().min().date(), df_dt.dropna().max().date()
+    mask = (df_dt.dt.date >= start) & (df_dt.dt.date <= end)
+    view = df.loc[mask].copy()
+    long = downsample(view.melt(id_vars=["datetime", "category"], value_vars=["systolic", "diastolic"],
+                                var_name="type", value_name="mmHg"), "datetime", "mmHg", by="type")
+    pulse_src = downsample(view[["datetime", "pulse"]], "datetime", "pulse")
+    lo = int(pd.Timestamp(start).tz_localize(TZ).timestamp())
+    hi = int(pd.Timestamp(end + timedelta(days=1)).tz_localize(TZ).timestamp()) - 1
+    page, _ = db.list_bp_page(uid, lo, hi, None, False, db.PAGE_SIZE)
+    disp = legacy_enrich(page)
+    return [raw_df, df_dt, mask, view, long, pulse_src, page, disp]
+
+
+def rerun_after(df, uid):
+    """目前頁面的資料管線（同 pages/01_血壓紀錄.py）。"""
+    import pandas as pd
+    import db
+    from utils import TZ, downsample, enrich_bp
+    start = df["datetime"].iat[0].tz_convert(TZ).date()
+    end = df["datetime"].iat[-1].tz_convert(TZ).date()
+    lo = int(pd.Timestamp(start).tz_localize(TZ).timestamp())
+    hi = int(pd.Timestamp(end + timedelta(days=1)).tz_localize(TZ).timestamp()) - 1
+    i, j = df["datetime"].searchsorted([pd.Timestamp(lo, unit="s", tz="UTC"), pd.Timestamp(hi + 1, unit="s", tz="UTC")])
+    view = df.iloc[i:j]
+    long = pd.concat([
+        downsample(view[["datetime", "category", v]], "datetime", v).rename(columns={v: "mmHg"}).assign(type=v)
+        for v in ("systolic", "diastolic")
+    ], ignore_index=True)
+    pulse_src = downsample(view[["datetime", "pulse"]], "datetime", "pulse")
+    page, _ = db.list_bp_page(uid, lo, hi, None, False, db.PAGE_SIZE)
+    disp = enrich_bp(page)
+    return [view, long, pulse_src, page, disp]
+
+
+def child(mode: str, db_path: str, uid: int, sessions: int) -> None:
+    import db
+    import pandas as pd  # noqa: F401  基準值包含 pandas
+    from utils import enrich_bp
+    db.configure_pool(path=Path(db_path))
+    raw = db.list_bp(uid)
+    enrich, rerun = (legacy_enrich, rerun_before) if mode == "before" else (enrich_bp, rerun_after)
+    rerun(enrich(raw.head(100)), uid)  # 先跑一次小資料，排除延遲載入的模組
+    gc.collect()
+
+    cached = enrich(raw)
+    del raw
+    cached_bytes = int(cached.memory_usage(deep=True).sum())
+
+    gc.collect()
+    base = _rss_mb()
+    t0 = time.perf_counter()
+    with PeakRSS() as peak:
+        held = rerun(cached, uid)
+    dt = time.perf_counter() - t0
+    rerun_peak = peak.peak - base
+    del held
+    gc.collect()
+
+    base = _rss_mb()
+    held = [rerun(cached, uid) for _ in range(sessions)]
+    per_session = (_rss_mb() - base) / sessions
+    print(f"{mode:<7} cached {cached_bytes / 2**20:7.1f} MiB  rerun peak +{rerun_peak:7.1f} MiB ({dt:5.2f}s)"
+          f"  {sessions} sessions: +{per_session:6.1f} MiB each"
+          f"  dtypes {', '.join(f'{c}={t}' for c, t in cached.dtypes.astype(str).items() if c != 'id')}")
+    del held
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("rows", nargs="*", type=int, default=[100_000])
+    ap.add_argument("--sessions", type=int, default=4)
+    ap.add_argument("--child", nargs=3, metavar=("MODE", "DB", "UID"))
+    args = ap.parse_args()
+    if args.child:
+        mode, db_path, uid = args.child
+        child(mode, db_path, int(uid), args.sessions)
+        return
+
+    for n in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "healthhub.db"
+            uid = populate(db_path, n)
+            print(f"--- {n:,} rows")
+            for mode in MODES:
+                subprocess.run(
+                    [sys.executable, __file__, "--child", mode, str(db_path), str(uid), "--sessions", str(args.sessions)],
+                    check=True, cwd=ROOT, env={**os.environ, "PYTHONPATH": str(ROOT)},
+                )
+
+
+if __name__ == "__main__":
+    main()
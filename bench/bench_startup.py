@@ -0,0 +1,120 @@
+# bench/bench_startup.py
+"""
+冷啟動基準：
+1) python -X importtime 量測各入口（首頁 / 血壓頁 / 資料頁）匯入的模組耗時
+2) streamlit.testing AppTest 量測首次渲染（首頁未登入；血壓頁以測試帳號登入並含資料）
+
+    python bench/bench_startup.py
+    python bench/bench_startup.py --json startup.json    # 存成 JSON 以便比對回歸
+
+每項量測都在全新子行程、暫存目錄（獨立 healthhub.db）中執行，避免快取干擾。
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ("pandas", "numpy", "altair", "passlib", "yaml", "pyarrow")
+
+# 入口 → 該頁面頂層 import 的本專案模組
+ENTRIES = {
+    "app": "import streamlit, i18n, utils, db, hashing",
+    "01_bp": "import streamlit, pandas, altair, i18n, utils, analytics, db, cache, export, writer",
+    "90_data": "import streamlit, i18n, db, export, writer",
+}
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def importtime(stmt: str) -> dict:
+    """回傳 {"total_ms", "top": [(模組, 累計 ms)], "heavy": [...]}；只計頂層（縮排最少）模組。"""
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", stmt],
+                          capture_output=True, text=True, cwd=tempfile.gettempdir(), env=env, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((len(m.group(3)), m.group(4), int(m.group(2)) / 1000.0))
+    top_level = min(r[0] for r in rows)
+    roots = [(name, ms) for depth, name, ms in rows if depth == top_level]
+    loaded = {name.split(".")[0] for _, name, _ in rows}
+    return {
+        "total_ms": round(sum(ms for _, ms in roots), 1),
+        "top": sorted(roots, key=lambda r: -r[1])[:8],
+        "heavy": sorted(loaded & set(HEAVY)),
+    }
+
+
+_RENDER = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+page, rows = sys.argv[1], int(sys.argv[2])
+from streamlit.testing.v1 import AppTest
+user = None
+if rows:
+    import db
+    db.init_db()
+    uid = db.create_user("bench@example.com", "bench", "Bench-password-1")
+    db.add_bp_many(uid, [{{"datetime": f"2025-{{1 + i % 12:02d}}-{{1 + i % 28:02d}}T{{i % 24:02d}}:00:00Z",
+                          "systolic": 110 + i % 40, "diastolic": 70 + i % 25, "pulse": 60 + i % 30}}
+                         for i in range(rows)])
+    user = {{"id": uid, "email": "bench@example.com", "name": "bench"}}
+    for m in {heavy!r}:
+        sys.modules.pop(m, None)
+before = set(sys.modules)
+at = AppTest.from_file(page, default_timeout=120)
+at.secrets["DEBUG"] = False
+if user:
+    at.session_state["user"] = user
+t0 = time.perf_counter()
+at.run()
+dt = time.perf_counter() - t0
+heavy = sorted({{m.split(".")[0] for m in set(sys.modules) - before}} & set({heavy!r}))
+print(json.dumps({{"ms": round(dt * 1000, 1), "heavy": heavy, "errors": [e.value for e in at.exception]}}))
+"""
+
+
+def first_render(page: str, rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        code = _RENDER.format(root=str(ROOT), heavy=HEAVY)
+        proc = subprocess.run([sys.executable, "-c", code, str(ROOT / page), str(rows)],
+                              capture_output=True, text=True, cwd=tmp, check=True)
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--json", type=Path, help="把結果寫成 JSON")
+    ap.add_argument("--rows", type=int, default=2000, help="血壓頁首次渲染的測試資料筆數")
+    args = ap.parse_args()
+
+    result = {"importtime": {}, "first_render": {}}
+    for name, stmt in ENTRIES.items():
+        r = importtime(stmt)
+        result["importtime"][name] = r
+        print(f"[import] {name:<8} {r['total_ms']:8.1f} ms  heavy={r['heavy']}")
+        for mod, ms in r["top"]:
+            print(f"           {mod:<24} {ms:8.1f} ms")
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        print("[render] streamlit.testing 不可用，略過首次渲染量測")
+    else:
+        for page, rows in (("app.py", 0), ("pages/01_血壓紀錄.py", args.rows)):
+            r = first_render(page, rows)
+            result["first_render"][page] = r
+            print(f"[render] {page:<22} {r['ms']:8.1f} ms  heavy={r['heavy']}  errors={len(r['errors'])}")
+
+    if args.json:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench/bench_storage.py
+"""
+儲存後端讀取基準：各後端第一次讀取（鏡像需整份建立）、全部、30 日區間的 db.list_bp 耗時，
+以及 Parquet 鏡像在持續小量寫入下的增量同步耗時（只追加 delta 檔，定期合併）。
+一致性檢查見 tests/test_storage.py。
+
+    python bench/bench_storage.py                        # 100k 筆
+    python bench/bench_storage.py 100000 1000000
+
+在暫存目錄（獨立 healthhub.db 與鏡像目錄）執行。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import db  # noqa: E402
+import storage  # noqa: E402
+
+def bench(backends: dict, sizes: list) -> None:
+    for n in sizes:
+        uid = db.create_user(f"bench{n}@example.com", "bench", "Conformance-1")
+        start = pd.Timestamp("2015-01-01", tz="UTC")
+        ts = start + pd.to_timedelta(np.sort(np.random.default_rng(n).integers(0, 3650 * 86400, n)), unit="s")
+        db.add_bp_many(uid, pd.DataFrame({"datetime": ts, "systolic": 120.0, "diastolic": 80.0, "pulse": 70.0,
+                                          "meds": "", "note": "bench"}))
+        lo, hi = "2024-06-01T00:00:00Z", "2024-06-30T23:59:59Z"
+        for name, be in backends.items():
+            storage._backend = be
+            t0 = time.perf_counter()
+            db.list_bp(uid)                      # 第一次讀取（鏡像需整份建立）
+            t_first = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            full = db.list_bp(uid)
+            t_full = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            db.list_bp(uid, lo, hi)
+            t_range = time.perf_counter() - t0
+            print(f"{n:>9,} rows  {name:<8} first {t_first * 1000:8.1f} ms  full {t_full * 1000:8.1f} ms"
+                  f"  30d range {t_range * 1000:7.1f} ms  ({len(full):,} rows)")
+
+
+def bench_sync(n: int, writes: int = 50) -> None:
+    """n 筆的鏡像上連續 writes 次「新增一筆 → 讀取」：每次同步的成本應與變更量而非總筆數成正比。"""
+    uid = db.create_user(f"sync{n}@example.com", "bench", "Conformance-1")
+    ts = pd.Timestamp("2015-01-01", tz="UTC") + pd.to_timedelta(np.arange(n) * 600, unit="s")
+    db.add_bp_many(uid, pd.DataFrame({"datetime": ts, "systolic": 120.0, "diastolic": 80.0, "pulse": 70.0,
+                                      "meds": "", "note": "bench"}))
+    mirror = storage.ParquetMirror()
+    mirror.scan_bp(uid)
+    lat = []
+    for k in range(writes):
+        db.add_bp(uid, {"datetime": ts[-1] + pd.Timedelta(seconds=k + 1), "systolic": 130.0, "diastolic": 85.0,
+                        "pulse": 72.0})
+        t0 = time.perf_counter()
+        mirror.sync(uid)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+    lat.sort()
+    print(f"{n:>9,} rows  parquet  sync after 1 write: p50 {lat[len(lat) // 2]:6.1f} ms  max {lat[-1]:7.1f} ms"
+          f"  ({writes} writes, {len(list(mirror.path(uid).glob('*.parquet')))} file(s) now)")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("rows", nargs="*", type=int, default=[100_000])
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        db.DB_PATH = Path(tmp) / "healthhub.db"
+        db.init_db()
+        backends = {name: storage.BACKENDS[name]() for name in storage.available_backends()}
+        bench(backends, args.rows)
+        if "parquet" in backends:
+            for n in args.rows:
+                bench_sync(n)
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
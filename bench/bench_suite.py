@@ -0,0 +1,291 @@
+# bench/bench_suite.py
+"""
+db.py / utils.py 熱路徑基準套件（合成資料）：
+- 決定性產生器：固定亂數種子，產生多位使用者、每日早晚量測的血壓歷史（含趨勢、用藥、備註）
+- 每種資料量在獨立子行程與暫存目錄（獨立 healthhub.db）執行，不影響正式資料庫
+- 量測 add_bp / add_bp_many / list_bp（全部、區間）/ update_bp / delete_bp / enrich_bp /
+  add_bp + 快取增量同步 /
+  export_csv / export 串流 / CSV 匯入（首次與重複匯入），記錄耗時、吞吐量與峰值記憶體增量
+
+    python bench/bench_suite.py                              # 1k、100k、1M 筆
+    python bench/bench_suite.py --sizes 1000 100000 --json baseline.json
+    python bench/bench_suite.py --compare baseline.json      # 重新量測並與基準比對
+    python bench/bench_suite.py --compare baseline.json --current new.json   # 只比對兩份結果
+
+比對模式：耗時或峰值記憶體超過基準的 (1 + 門檻) 倍即標示 REGRESSION，並以結束碼 1 離開，
+可直接放進 CI。極短的量測（< --min-ms）與極小的記憶體增量（< --min-mib）不列入判斷，避免雜訊。
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_export_memory import PeakRSS, _rss_mb  # noqa: E402
+
+SEED = 20250101
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+SINGLE_OPS = 200          # add_bp / update_bp 逐筆呼叫次數
+DELETE_IDS = 5_000        # delete_bp 一次刪除的 ID 數（會走分批）
+RANGE_DAYS = 30           # list_bp 區間查詢的天數
+
+
+# ---------- 決定性資料產生器 ----------
+def n_users_for(n: int) -> int:
+    """資料量 → 使用者數（至少 3 位，最多 50 位）。"""
+    return max(3, min(50, n // 20_000))
+
+
+def generate(n: int, seed: int = SEED):
+    """
+    產生 n 筆血壓紀錄，回傳 {使用者序號: DataFrame}（欄位同 add_bp_many 的輸入）。
+    每位使用者：個人基準值 + 緩慢趨勢 + 早晚差 + 隨機雜訊；早上約 07 時、晚上約 21 時（本地時間）量測。
+    """
+    import numpy as np
+    import pandas as pd
+    from utils import TZ
+
+    rng = np.random.default_rng(seed)
+    users = n_users_for(n)
+    sizes = np.full(users, n // users)
+    sizes[: n % users] += 1
+    end = pd.Timestamp("2025-12-31", tz=TZ)
+    out = {}
+    for u, m in enumerate(sizes):
+        days = (m + 1) // 2
+        day_idx = np.arange(m) // 2
+        evening = np.arange(m) % 2 == 1
+        base_sys, base_dia, base_pulse = rng.normal(128, 10), rng.normal(82, 6), rng.normal(72, 6)
+        trend = rng.normal(0, 4) * day_idx / max(days, 1)      # 整段期間的漂移（mmHg）
+        minutes = np.where(evening, 21 * 60, 7 * 60) + rng.integers(-45, 45, m)
+        local = end - pd.to_timedelta(days - day_idx, unit="D") + pd.to_timedelta(minutes, unit="m")
+        on_meds = rng.random() < 0.4
+        out[u] = pd.DataFrame({
+            "datetime": local.tz_convert("UTC"),
+            "systolic": (base_sys + trend + np.where(evening, 4, 0) + rng.normal(0, 9, m)).round(),
+            "diastolic": (base_dia + trend / 2 + np.where(evening, 2, 0) + rng.normal(0, 6, m)).round(),
+            "pulse": (base_pulse + rng.normal(0, 7, m)).round(),
+            "meds": np.where(on_meds & (rng.random(m) < 0.9), "amlodipine 5mg", ""),
+            "note": np.where(rng.random(m) < 0.05, "after coffee", ""),
+        })
+    return out
+
+
+def populate(frames) -> dict:
+    """寫入暫存 DB，回傳 {使用者序號: user_id}。"""
+    import db
+    uids = {}
+    with db.connection() as conn:
+        for u in frames:
+            uids[u] = conn.execute(
+                "INSERT INTO users (email, name, password_hash) VALUES (?, ?, 'x')",
+                (f"bench{u}@example.com", f"bench{u}"),
+            ).lastrowid
+    for u, frame in frames.items():
+        db.add_bp_many(uids[u], frame)
+    return uids
+
+
+# ---------- 量測 ----------
+def measure(results: dict, name: str, fn, items: int, unit: str = "rows"):
+    """執行 fn 一次，記錄耗時、每秒處理量與峰值 RSS 增量；回傳 fn 的結果。"""
+    gc.collect()
+    base = _rss_mb()
+    with PeakRSS() as peak:
+        t0 = time.perf_counter()
+        value = fn()
+        dt = time.perf_counter() - t0
+    results[name] = {
+        "seconds": round(dt, 6),
+        "items": items,
+        "unit": unit,
+        "per_s": round(items / dt, 1) if dt > 0 else None,
+        "peak_mib": round(max(0.0, peak.peak - base), 2),
+    }
+    r = results[name]
+    print(f"  {name:<16} {dt * 1000:10.1f} ms  {r['per_s'] or 0:>12,.0f} {unit}/s  peak +{r['peak_mib']:7.1f} MiB",
+          flush=True)
+    return value
+
+
+def run_size(n: int, seed: int) -> dict:
+    """單一資料量的完整量測（在子行程內執行）。"""
+    import numpy as np
+    import pandas as pd
+    import cache
+    import db
+    import export
+    from utils import enrich_bp, export_csv, normalize_bp_csv
+
+    results: dict = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure_pool(path=Path(tmp) / "healthhub.db")
+        db.init_db()
+        frames = generate(n, seed)
+        uids = measure(results, "add_bp_many", lambda: populate(frames), n)
+        uid = uids[0]
+        rng = np.random.default_rng(seed + 1)
+
+        df = measure(results, "list_bp_full", lambda: db.list_bp(uid), len(frames[0]))
+        end = pd.Timestamp(df["datetime"].iloc[-1])
+        start = end - pd.Timedelta(days=RANGE_DAYS)
+        start_iso, end_iso = start.strftime("%Y-%m-%dT%H:%M:%SZ"), end.strftime("%Y-%m-%dT%H:%M:%SZ")
+        ranged = db.list_bp(uid, start_iso, end_iso)
+        measure(results, "list_bp_range", lambda: db.list_bp(uid, start_iso, end_iso), len(ranged))
+
+        enriched = measure(results, "enrich_bp", lambda: enrich_bp(df), len(df))
+        del enriched
+
+        # 每次呼叫用不同秒數：相同時間 + 讀值會命中自然鍵而變成更新
+        def add_single():
+            for i in range(SINGLE_OPS):
+                db.add_bp(uid, {"datetime": end + pd.Timedelta(seconds=i + 1), "systolic": 120.0 + i % 20, "diastolic": 80.0,
+                                "pulse": 70.0, "meds": "", "note": "bench"})
+        measure(results, "add_bp", add_single, SINGLE_OPS, "calls")
+
+        ids = df["id"].to_numpy()
+        picks = rng.choice(ids, size=min(SINGLE_OPS, len(ids)), replace=False).tolist()
+        def update_single():
+            for i, rid in enumerate(picks):
+                db.update_bp(uid, int(rid), {"systolic": 110.0 + i % 30, "note": "edited"})
+        measure(results, "update_bp", update_single, len(picks), "calls")
+
+        # 頁面新增一筆後的 rerun：寫入 + 快取增量同步（只取新列、enrich 後併入）
+        cache.enriched_bp(uid)
+        def add_and_sync():
+            for i in range(SINGLE_OPS):
+                db.add_bp(uid, {"datetime": end + pd.Timedelta(seconds=SINGLE_OPS + i + 1), "systolic": 120.0 + i % 20,
+                                "diastolic": 80.0, "pulse": 70.0, "meds": "", "note": "bench"})
+                cache.enriched_bp(uid)
+        measure(results, "add_bp_sync", add_and_sync, SINGLE_OPS, "calls")
+
+        victims = rng.choice(ids, size=min(DELETE_IDS, len(ids) // 2), replace=False).tolist()
+        measure(results, "delete_bp", lambda: db.delete_bp(uid, [int(v) for v in victims]), len(victims))
+
+        df = db.list_bp(uid)
+        measure(results, "export_csv", lambda: export_csv(df), len(df))
+        with tempfile.TemporaryFile() as f:
+            measure(results, "export_stream", lambda: export.write_export(uid, "csv", f), len(df))
+
+        # 匯入：CSV bytes → read_csv → normalize_bp_csv → import_bp（匯入到另一位使用者）；
+        # 再匯入同一份檔案一次：全部以自然鍵比對後略過
+        src = frames[1].copy()
+        src["datetime"] = src["datetime"].dt.tz_convert(None).dt.strftime("%Y-%m-%d %H:%M:%S")
+        payload = src.to_csv(index=False).encode("utf-8")
+        del src
+        target = uids[2]
+        for name in ("import_csv", "import_csv_repeat"):
+            measure(results, name,
+                    lambda: db.import_bp(target, normalize_bp_csv(pd.read_csv(io.BytesIO(payload)))),
+                    len(frames[1]))
+        db.configure_pool(path=Path(tmp) / "closed.db")  # 釋放暫存 DB 的連線
+    return results
+
+
+def run_child(n: int, seed: int) -> dict:
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    with tempfile.TemporaryDirectory() as out_dir:
+        out = Path(out_dir) / "result.json"
+        subprocess.run([sys.executable, __file__, "--child", str(n), str(seed), str(out)],
+                       check=True, cwd=tempfile.gettempdir(), env=env)
+        return json.loads(out.read_text(encoding="utf-8"))
+
+
+def environment() -> dict:
+    import numpy
+    import pandas
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "pandas": pandas.__version__,
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# ---------- 比對 ----------
+def compare(baseline: dict, current: dict, threshold: float, mem_threshold: float,
+            min_ms: float, min_mib: float) -> list:
+    """回傳回歸清單（字串）；同時印出每項的變化百分比。"""
+    regressions = []
+    for size, ops in current["results"].items():
+        base_ops = baseline.get("results", {}).get(size)
+        if not base_ops:
+            print(f"--- {size} rows: 基準中沒有此資料量，略過")
+            continue
+        print(f"--- {int(size):,} rows")
+        for op, cur in ops.items():
+            base = base_ops.get(op)
+            if not base:
+                print(f"  {op:<16} （新項目）")
+                continue
+            dt_ratio = cur["seconds"] / base["seconds"] if base["seconds"] else 1.0
+            mem_ratio = cur["peak_mib"] / base["peak_mib"] if base["peak_mib"] else 1.0
+            flags = []
+            if dt_ratio > 1 + threshold and (cur["seconds"] - base["seconds"]) * 1000 >= min_ms:
+                flags.append("time")
+            if mem_ratio > 1 + mem_threshold and cur["peak_mib"] - base["peak_mib"] >= min_mib:
+                flags.append("memory")
+            mark = f"REGRESSION ({', '.join(flags)})" if flags else "ok"
+            print(f"  {op:<16} time {dt_ratio - 1:+8.1%}  memory {mem_ratio - 1:+8.1%}  {mark}")
+            if flags:
+                regressions.append(f"{size}/{op}: {', '.join(flags)} "
+                                   f"({base['seconds']:.4f}s → {cur['seconds']:.4f}s, "
+                                   f"{base['peak_mib']:.1f} → {cur['peak_mib']:.1f} MiB)")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--json", type=Path, help="把結果寫成 JSON（可作為之後的基準）")
+    ap.add_argument("--compare", type=Path, help="與此基準 JSON 比對，有回歸時結束碼為 1")
+    ap.add_argument("--current", type=Path, help="搭配 --compare：直接比對這份結果，不重新量測")
+    ap.add_argument("--threshold", type=float, default=0.20, help="耗時回歸門檻（0.20 = 慢 20%%）")
+    ap.add_argument("--mem-threshold", type=float, default=0.25, help="峰值記憶體回歸門檻")
+    ap.add_argument("--min-ms", type=float, default=5.0, help="耗時差小於此毫秒數不算回歸")
+    ap.add_argument("--min-mib", type=float, default=8.0, help="記憶體差小於此 MiB 不算回歸")
+    ap.add_argument("--child", nargs=3, metavar=("ROWS", "SEED", "OUT"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        n, seed, out = int(args.child[0]), int(args.child[1]), Path(args.child[2])
+        out.write_text(json.dumps(run_size(n, seed)), encoding="utf-8")
+        return
+
+    if args.current:
+        current = json.loads(args.current.read_text(encoding="utf-8"))
+    else:
+        current = {"env": environment(), "seed": args.seed, "results": {}}
+        for n in args.sizes:
+            print(f"--- {n:,} rows ({n_users_for(n)} users)", flush=True)
+            current["results"][str(n)] = run_child(n, args.seed)
+        if args.json:
+            args.json.write_text(json.dumps(current, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        if baseline.get("env") != current.get("env"):
+            print("注意：基準與本次量測的執行環境不同，比對結果僅供參考")
+        regressions = compare(baseline, current, args.threshold, args.mem_threshold, args.min_ms, args.min_mib)
+        if regressions:
+            print("\n".join(["", "回歸："] + regressions))
+            sys.exit(1)
+        print("\n未發現回歸")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bench/bench_writer.py
+"""
+併發寫入基準：多個執行緒同時 add_bp（模擬多個 session 各自新增一筆），比較
+- direct：各執行緒直接呼叫 db.add_bp（各自借連線、各自 commit，靠 busy_timeout 等 WAL 寫入鎖）
+- writer：經 writer.call 排進單一寫入執行緒，合併成批次交易 commit
+記錄吞吐量、單筆延遲（p50 / p95 / p99 / max）、錯誤數，以及 writer 的批次大小與佇列深度。
+
+    python bench/bench_writer.py                       # 32 執行緒 × 50 筆
+    python bench/bench_writer.py --threads 64 --ops 100 --busy-timeout 200
+
+--busy-timeout 調低可重現 direct 模式下的 database is locked。每種模式使用獨立暫存資料庫。
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import db  # noqa: E402
+import writer  # noqa: E402
+
+
+def _pct(xs, q):
+    return xs[min(len(xs) - 1, int(len(xs) * q))] if xs else 0.0
+
+
+def run(mode: str, threads: int, ops: int, busy_timeout: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure_pool(Path(tmp) / "healthhub.db", size=threads + 1,
+                          pragmas={"busy_timeout": busy_timeout})
+        db.init_db()
+        uids = [db.create_user(f"w{i}@example.com", "w", "Writer-bench-1") for i in range(threads)]
+        if mode == "writer":
+            writer.configure()
+        lat, errors = [], {}
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker(i: int) -> None:
+            mine = []
+            barrier.wait()
+            for k in range(ops):
+                rec = {"datetime": f"2025-01-01T{k // 3600 % 24:02d}:{k // 60 % 60:02d}:{k % 60:02d}Z",  # 每筆時間不同
+                       "systolic": 120.0, "diastolic": 80.0, "pulse": 70.0, "meds": "", "note": "bench"}
+                t0 = time.perf_counter()
+                try:
+                    if mode == "writer":
+                        writer.call(db.add_bp, uids[i], rec)
+                    else:
+                        db.add_bp(uids[i], rec)
+                except (sqlite3.OperationalError, writer.WriterBusy) as e:
+                    with lock:
+                        errors[str(e)] = errors.get(str(e), 0) + 1
+                    continue
+                mine.append((time.perf_counter() - t0) * 1000.0)
+            with lock:
+                lat.extend(mine)
+
+        ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        t0 = time.perf_counter()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        lat.sort()
+        print(f"{mode:<7} {len(lat):>6,} ok  {len(lat) / elapsed:>8,.0f} writes/s"
+              f"  p50 {_pct(lat, .5):7.1f}  p95 {_pct(lat, .95):7.1f}  p99 {_pct(lat, .99):7.1f}"
+              f"  max {lat[-1] if lat else 0:7.1f} ms  errors {sum(errors.values())}")
+        for msg, n in errors.items():
+            print(f"          {n} × {msg}")
+        if mode == "writer":
+            s = writer.stats()
+            print(f"          batches {s['batches']}  batch size p50 {s['batch_size_p50']}  p95 {s['batch_size_p95']}"
+                  f"  max {s['batch_size_max']}  depth now {s['depth']}  rejected {s['rejected']}")
+            writer.get_writer().shutdown()
+        db.configure_pool(Path("healthhub.db"))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--ops", type=int, default=50, help="每個執行緒寫入筆數")
+    ap.add_argument("--busy-timeout", type=int, default=5000, help="PRAGMA busy_timeout（毫秒）")
+    args = ap.parse_args()
+    for mode in ("direct", "writer"):
+        run(mode, args.threads, args.ops, args.busy_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# cache.py
+"""
+血壓資料快取：每位使用者一份已 enrich 的完整紀錄，依同步序號（bp_sync.seq）維護。
+- 每次讀取先以主鍵查詢 db.bp_sync_state 取目前序號（其他行程 / worker 的寫入也看得到）
+- 序號未變 → 直接命中
+- 序號前進 → db.bp_changes 只取序號之後新增 / 修改的列與 tombstone，enrich 後併入（不重查、不重算全部歷史）
+- 快取水位早於 floor_seq（tombstone 已清除或整批刪除）→ 全量重載
+- 跨使用者 LRU，依 DataFrame 佔用 bytes 與筆數設上限
+- analytics.rolling_daily 的結果另依 (user_id, 目標值) 快取，同樣以同步序號判斷是否過期
+回傳的 DataFrame 為多個 session 共用，呼叫端請勿就地修改（需要時先 .copy()）。
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import analytics
+import db
+import instrument
+from utils import enrich_bp
+
+MAX_BYTES = 256 * 1024 * 1024   # 全部快取合計上限
+MAX_ENTRIES = 1024              # 最多快取幾位使用者
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def apply_changes(enriched: pd.DataFrame, changed: pd.DataFrame, deleted: List[int]) -> pd.DataFrame:
+    """
+    把 db.bp_changes 的結果併入已 enrich 的 frame，維持 (datetime, id) 排序。
+    只 enrich 變更的列；常見情況（新增的列 id 較大、時間在最後）不需 isin 過濾也不需重排，
+    只剩一次 concat 的區塊複製。
+    """
+    base = enriched
+    if deleted or (not changed.empty and not base.empty and changed["id"].min() <= base["id"].max()):
+        drop = set(deleted).union(changed["id"].tolist())
+        base = base.loc[~base["id"].isin(drop)]
+    if changed.empty:
+        return base.reset_index(drop=True) if base is not enriched else enriched
+    new = enrich_bp(changed)
+    if base.empty:
+        return new
+    # meds / note 為 category：兩邊字典不同時 concat 會退回 object，先把類別聯集補齊（新類別附加在後，舊代碼不變）
+    for col in ("meds", "note"):
+        old_cats, new_cats = base[col].cat.categories, new[col].cat.categories
+        if not new_cats.equals(old_cats):
+            union = old_cats.append(new_cats.difference(old_cats))
+            base = base.assign(**{col: base[col].cat.set_categories(union)})
+            new[col] = new[col].cat.set_categories(union)
+    out = pd.concat([base, new], ignore_index=True)
+    last_dt, last_id = base["datetime"].iat[-1], base["id"].iat[-1]
+    first_dt, first_id = new["datetime"].iat[0], new["id"].iat[0]
+    if (first_dt, first_id) < (last_dt, last_id):
+        out = out.sort_values(["datetime", "id"], kind="mergesort", ignore_index=True)
+    return out
+
+
+class FrameCache:
+    """以 user_id 為鍵的 LRU；每位使用者只保留最新版本一份。"""
+
+    def __init__(self, max_bytes: int = MAX_BYTES, max_entries: int = MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # user_id → (同步序號, enriched, bytes)
+        self._data: "OrderedDict[int, Tuple[int, pd.DataFrame, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.deltas = 0
+
+    def get(self, user_id: int) -> Optional[Tuple[int, pd.DataFrame]]:
+        """(同步序號, enriched)；是否過期由呼叫端比對目前序號判斷。"""
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None:
+                return None
+            self._data.move_to_end(user_id)
+            return item[0], item[1]
+
+    def put(self, user_id: int, seq: int, enriched: pd.DataFrame, replace: bool = False) -> None:
+        """存入同步到 seq 的結果；replace=False 時不覆蓋其他執行緒已存入的較新結果。"""
+        size = _frame_bytes(enriched)
+        with self._lock:
+            cur = self._data.get(user_id)
+            if cur is not None and cur[0] > seq and not replace:
+                return  # 其他執行緒已存入較新的同步結果
+            self._drop(user_id)
+            if size > self.max_bytes:
+                return  # 單筆就超過上限：不快取
+            self._data[user_id] = (seq, enriched, size)
+            self._bytes += size
+            while self._data and (self._bytes > self.max_bytes or len(self._data) > self.max_entries):
+                self._drop(next(iter(self._data)))
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+                self._bytes = 0
+            else:
+                self._drop(user_id)
+
+    def _drop(self, user_id: int) -> None:
+        item = self._data.pop(user_id, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes,
+                    "hits": self.hits, "deltas": self.deltas, "misses": self.misses}
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+
+
+_frames = FrameCache()
+
+
+def _sync(user_id: int) -> Tuple[int, pd.DataFrame]:
+    """(同步序號, enriched)：每次都以主鍵查詢目前序號，與快取的序號不同就套用變更。"""
+    seq = db.bp_sync_state(user_id)[0]
+    item = _frames.get(user_id)
+    if item is not None and item[0] == seq:
+        _frames._count("hits")
+        if instrument.is_enabled():
+            instrument.record("cache", "frame_hit", 0.0)
+        return item
+    # 序號倒退（資料庫被還原）或水位早於 floor_seq（bp_changes 回傳 None）→ 全量重載
+    delta = db.bp_changes(user_id, item[0]) if item is not None and seq > item[0] else None
+    if delta is not None:
+        # bp_changes 先讀序號再讀資料：期間若有新寫入，下次讀取會再套用一次（以 id 覆蓋，結果不變）
+        seq, changed, deleted = delta
+        with instrument.span("cache", "frame_delta", rows=len(changed) + len(deleted)):
+            enriched = apply_changes(item[1], changed, deleted)
+        _frames._count("deltas")
+    else:
+        with instrument.span("cache", "frame_full"):
+            enriched = enrich_bp(db.list_bp(user_id))  # 序號在讀取前取得，理由同上
+        _frames._count("misses")
+    _frames.put(user_id, seq, enriched, replace=item is not None and seq < item[0])
+    return seq, enriched
+
+
+def _load(user_id: int) -> pd.DataFrame:
+    return _sync(user_id)[1]
+
+
+def list_bp(user_id: int) -> pd.DataFrame:
+    """db.list_bp(user_id) 的快取版本（全部紀錄、原始欄位；由 enriched 取欄，不另存一份，型別同 enrich_bp 的精簡型別）。"""
+    return _load(user_id)[db.BP_EXPORT_COLUMNS]
+
+
+def enriched_bp(user_id: int) -> pd.DataFrame:
+    """enrich_bp(db.list_bp(user_id)) 的快取版本。"""
+    return _load(user_id)
+
+
+ANALYTICS_MAX_BYTES = 64 * 1024 * 1024   # 逐日滾動表合計上限（多年資料約 1 MB / 人）
+
+# user_id → ((target_sys, target_dia), 同步序號, rolling_daily 結果, bytes)
+# 每位使用者只留一份：目標值改變即取代舊的，不累積過期的鍵；跨使用者 LRU 依 bytes 設上限
+_rolled: "OrderedDict[int, Tuple[Tuple[float, float], int, pd.DataFrame, int]]" = OrderedDict()
+_rolled_bytes = 0
+_rolled_lock = threading.Lock()
+
+
+def analytics_daily(user_id: int, target_sys: float, target_dia: float) -> pd.DataFrame:
+    """analytics.rolling_daily(enriched_bp(user_id), ...) 的快取版本；資料與目標值未變動時不重算。"""
+    global _rolled_bytes
+    targets = (float(target_sys), float(target_dia))
+    seq, enriched = _sync(user_id)
+    with _rolled_lock:
+        item = _rolled.get(user_id)
+        if item is not None and item[0] == targets and item[1] == seq:
+            _rolled.move_to_end(user_id)
+            return item[2]
+    with instrument.span("analytics", "rolling_daily"):
+        rolled = analytics.rolling_daily(enriched, target_sys, target_dia)
+    size = _frame_bytes(rolled)
+    with _rolled_lock:
+        old = _rolled.pop(user_id, None)
+        if old is not None:
+            _rolled_bytes -= old[3]
+        if size <= ANALYTICS_MAX_BYTES:
+            _rolled[user_id] = (targets, seq, rolled, size)
+            _rolled_bytes += size
+        while _rolled and (_rolled_bytes > ANALYTICS_MAX_BYTES or len(_rolled) > MAX_ENTRIES):
+            _rolled_bytes -= _rolled.popitem(last=False)[1][3]
+    return rolled
+
+
+def stats() -> Dict[str, int]:
+    return _frames.stats()
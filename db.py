@@ -1,24 +1,198 @@
 # db.py
+from __future__ import annotations
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, Optional, Dict, Any
-import pandas as pd
-from passlib.hash import argon2 as _argon2, bcrypt, bcrypt_sha256
+from datetime import date, datetime, timedelta, timezone
+from numbers import Real
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Dict, Any, List, Tuple, Union
+from utils import TZ, BP_THRESHOLDS
+import hashing
+import instrument
+import storage
+
+# pandas / passlib 延遲到實際用到時才載入：登入、導覽等路徑不必付出匯入成本
+if TYPE_CHECKING:
+    import pandas as pd
 
 DB_PATH = Path("healthhub.db")
 
-# ── 強化 Argon2 參數（視主機資源可再上調）
-argon2 = _argon2.using(time_cost=3, memory_cost=102400, parallelism=8)
+@lru_cache(maxsize=None)
+def _hashers():
+    from passlib.hash import argon2 as _argon2, bcrypt, bcrypt_sha256
+    # ── 強化 Argon2 參數（視主機資源可再上調）
+    return _argon2.using(time_cost=3, memory_cost=102400, parallelism=8), bcrypt, bcrypt_sha256
+
+def __getattr__(name: str):
+    # 相容既有的 db.argon2 存取
+    if name == "argon2":
+        return _hashers()[0]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ── 連線 PRAGMA（可經 configure_pool() 覆寫）
+#    cache_size 負值代表 KiB；mmap_size 單位為 bytes；busy_timeout 單位為毫秒
+DEFAULT_PRAGMAS: Dict[str, Any] = {
+    "foreign_keys": "ON",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -20000,
+    "mmap_size": 134217728,
+}
+POOL_SIZE = 8             # 同時借出的連線上限
+POOL_TIMEOUT = 30.0       # 等待可用連線的秒數
+HEALTHCHECK_IDLE = 60.0   # 閒置超過此秒數，借出前先做健康檢查
+
+def _apply_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any]) -> None:
+    for k, v in pragmas.items():
+        conn.execute(f"PRAGMA {k} = {v};")
 
 def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode = WAL;")
-    conn.execute("PRAGMA synchronous = NORMAL;")
+    """開一條獨立連線（呼叫端自行 close）；一般查詢請改用 connection()。"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, factory=instrument.TracedConnection)
+    _apply_pragmas(conn, DEFAULT_PRAGMAS)
     return conn
 
-def init_db():
-    conn = get_conn()
+class ConnectionPool:
+    """
+    有上限的 SQLite 連線池：
+    - 同一執行緒巢狀 connection() 共用同一條連線（最外層負責 commit/rollback）
+    - 閒置連線以 LIFO 重用，PRAGMA 只在開連線時執行一次
+    - 借出前對久未使用的連線做 SELECT 1 健康檢查，壞掉就丟棄重開
+    """
+
+    def __init__(self, path: Path, size: int = POOL_SIZE,
+                 pragmas: Optional[Dict[str, Any]] = None, timeout: float = POOL_TIMEOUT):
+        self.path = Path(path)
+        self.size = max(1, int(size))
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: List[tuple] = []  # [(conn, last_used)]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout,
+                               factory=instrument.TracedConnection)
+        _apply_pragmas(conn, self.pragmas)
+        return conn
+
+    @staticmethod
+    def _healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _acquire(self) -> sqlite3.Connection:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("connection pool exhausted")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._open()
+                conn, last_used = item
+                if time.monotonic() - last_used < HEALTHCHECK_IDLE or self._healthy(conn):
+                    return conn
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        try:
+            if broken or self._closed or conn.in_transaction:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            if isinstance(e, sqlite3.DatabaseError) and not isinstance(e, sqlite3.IntegrityError):
+                broken = True
+            raise
+        finally:
+            self._local.conn = None
+            self._release(conn, broken)
+
+    def close_all(self) -> None:
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def configure_pool(path: Optional[Path] = None, size: Optional[int] = None,
+                   pragmas: Optional[Dict[str, Any]] = None) -> ConnectionPool:
+    """重建連線池（例如改 DB_PATH、池大小或 PRAGMA）；pragmas 會覆蓋在預設值之上。"""
+    global _pool, DB_PATH
+    with _pool_lock:
+        if path is not None:
+            DB_PATH = Path(path)
+        merged = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(DB_PATH, size=size or POOL_SIZE, pragmas=merged)
+        return _pool
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+    pool = _pool
+    if pool is None or pool.path != Path(DB_PATH):
+        with _pool_lock:
+            if _pool is None or _pool.path != Path(DB_PATH):
+                if _pool is not None:
+                    _pool.close_all()
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """從連線池借一條連線；正常離開自動 commit，例外時 rollback。"""
+    with _get_pool().connection() as conn:
+        yield conn
+
+# ---------- Schema 版本遷移（以 PRAGMA user_version 記錄版本） ----------
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _m001_base_tables(conn: sqlite3.Connection):
     # 使用者表
     conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -43,21 +217,263 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
     );
     """)
-
     # 舊表升級容錯：若缺欄位就補；不再強制指定 user_id=1（避免外洩）
-    try:
+    # 不自動 UPDATE。未歸戶資料將不會被 list_bp() 查詢到。
+    if "user_id" not in _columns(conn, "blood_pressure"):
         conn.execute("ALTER TABLE blood_pressure ADD COLUMN user_id INTEGER;")
-        # 不自動 UPDATE。未歸戶資料將不會被 list_bp() 查詢到。
-    except Exception:
-        pass
-    conn.commit()
-    conn.close()
+
+def _m002_bp_user_datetime_index(conn: sqlite3.Connection):
+    # list_bp 的 WHERE user_id = ? [AND datetime BETWEEN] ORDER BY datetime 走索引，免全表掃描與排序
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bp_user_datetime ON blood_pressure(user_id, datetime);")
+
+def _m003_rollup_tables(conn: sqlite3.Connection):
+    # 每位使用者「本地日 / 週（週一起算）」彙總；平均值 = *_sum / n
+    for table, key in (("bp_daily", "day"), ("bp_weekly", "week")):
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            user_id INTEGER NOT NULL,
+            {key} TEXT NOT NULL,              -- 本地日期 YYYY-MM-DD（週表為該週週一）
+            n INTEGER NOT NULL,
+            sys_min REAL, sys_max REAL, sys_sum REAL,
+            dia_min REAL, dia_max REAL, dia_sum REAL,
+            pulse_min REAL, pulse_max REAL, pulse_sum REAL,
+            n_hit INTEGER NOT NULL,           -- 達標筆數（預設目標值；_m009 移除）
+            n_normal INTEGER NOT NULL, n_elevated INTEGER NOT NULL,
+            n_stage1 INTEGER NOT NULL, n_stage2 INTEGER NOT NULL, n_unknown INTEGER NOT NULL,
+            PRIMARY KEY (user_id, {key})
+        ) WITHOUT ROWID;
+        """)
+    # 既有資料的回填改在 _m005 時間戳正規化之後進行（_refresh_rollups 讀的是 ts 欄）
+
+def _m004_login_throttle(conn: sqlite3.Connection):
+    # 登入節流（跨 session / 跨執行緒共用）；key 例如 email:xx@yy、client:1.2.3.4
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS login_throttle (
+        key TEXT PRIMARY KEY,
+        fails INTEGER NOT NULL,
+        window_start REAL NOT NULL,       -- epoch 秒
+        locked_until REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """)
+
+def _m005_bp_epoch(conn: sqlite3.Connection):
+    # datetime TEXT（混有 ...T...Z 與 naive 'YYYY-MM-DD HH:MM:SS'）→ ts INTEGER（UTC epoch 秒）
+    # SQLite 不能改欄位型別：重建資料表。naive 沿用舊慣例視為 UTC。
+    # 無法解析時間或未歸戶（user_id 為 NULL）的列原樣移到 blood_pressure_quarantine，不直接丟棄。
+    conn.execute("""
+    CREATE TABLE blood_pressure_v5 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,              -- UTC epoch 秒
+        systolic REAL NOT NULL,
+        diastolic REAL NOT NULL,
+        pulse REAL NOT NULL,
+        meds TEXT DEFAULT '',
+        note TEXT DEFAULT '',
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
+    conn.execute("""
+    INSERT INTO blood_pressure_v5 (id, user_id, ts, systolic, diastolic, pulse, meds, note)
+    SELECT id, user_id, CAST(strftime('%s', datetime) AS INTEGER), systolic, diastolic, pulse, meds, note
+    FROM blood_pressure
+    WHERE user_id IS NOT NULL AND strftime('%s', datetime) IS NOT NULL
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS blood_pressure_quarantine AS
+    SELECT * FROM blood_pressure WHERE 0
+    """)
+    conn.execute("""
+    INSERT INTO blood_pressure_quarantine
+    SELECT * FROM blood_pressure WHERE user_id IS NULL OR strftime('%s', datetime) IS NULL
+    """)
+    conn.execute("DROP TABLE blood_pressure")
+    conn.execute("ALTER TABLE blood_pressure_v5 RENAME TO blood_pressure")
+    # 取代 idx_bp_user_datetime（隨舊表刪除）；rowid 隱含在索引尾端，ORDER BY ts, id 不需排序
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bp_user_ts ON blood_pressure(user_id, ts);")
+    # 彙總表的回填交給 _m009（以目前的彙總欄位與 TZ 全量重建）
+
+def _m006_bp_change_log(conn: sqlite3.Connection):
+    # 增量同步：每位使用者一個遞增序號；寫入時新增 / 修改的列記下 seq，刪除留 tombstone
+    # floor_seq：tombstone 已清到此序號（含），快取水位低於它就必須全量重載
+    conn.execute("ALTER TABLE blood_pressure ADD COLUMN seq INTEGER NOT NULL DEFAULT 0;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bp_user_seq ON blood_pressure(user_id, seq);")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bp_sync (
+        user_id INTEGER PRIMARY KEY,
+        seq INTEGER NOT NULL DEFAULT 0,
+        floor_seq INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bp_tombstones (
+        user_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, seq, id)
+    ) WITHOUT ROWID;
+    """)
+
+def _m007_bp_unique_reading(conn: sqlite3.Connection):
+    # 自然鍵：同一使用者、同一秒、同一組讀值（收縮 / 舒張 / 心跳）視為同一筆；同秒不同讀值仍可並存。
+    # 既有重複列以集合運算一次找出（每組保留最早的 id），原樣移到 blood_pressure_duplicates，不直接丟棄。
+    dup = """SELECT * FROM blood_pressure WHERE id NOT IN (
+                 SELECT MIN(id) FROM blood_pressure GROUP BY user_id, ts, systolic, diastolic, pulse)"""
+    conn.execute("CREATE TABLE IF NOT EXISTS blood_pressure_duplicates AS SELECT * FROM blood_pressure WHERE 0")
+    conn.execute(f"INSERT INTO blood_pressure_duplicates {dup}")
+    users = [r[0] for r in conn.execute(f"SELECT DISTINCT user_id FROM ({dup})").fetchall()]
+    conn.execute(f"DELETE FROM blood_pressure WHERE id IN (SELECT id FROM ({dup}))")
+    for uid in users:
+        # 不逐列寫 tombstone：抬高 floor_seq，讓快取 / 鏡像全量重載（同 delete_all_bp）
+        seq = _next_seq(conn, uid)
+        conn.execute("UPDATE bp_sync SET floor_seq = ? WHERE user_id = ?", (seq, uid))
+        conn.execute("DELETE FROM bp_tombstones WHERE user_id = ?", (uid,))
+    # 受影響使用者的彙總由 _m009 全量重建
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_bp_user_reading
+                    ON blood_pressure(user_id, ts, systolic, diastolic, pulse);""")
+
+def _m008_throttle_token_bucket(conn: sqlite3.Connection):
+    # 固定視窗計數 → token bucket（剩餘額度 + 上次補充時間）；節流狀態可丟棄，直接重建
+    conn.execute("DROP TABLE IF EXISTS login_throttle")
+    conn.execute("""
+    CREATE TABLE login_throttle (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,             -- 剩餘失敗額度（連續補充）
+        refilled_at REAL NOT NULL,        -- 上次計算額度的時間，epoch 秒
+        locked_until REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """)
+
+def _m009_rollup_tz(conn: sqlite3.Connection):
+    # 移除 n_hit（以預設目標值計算、無人讀取；達標率由 analytics 依使用者目標值計算）；
+    # 彙總表是衍生資料：直接重建，並在 rollup_meta 記下分日所用的 TZ（init_db 發現不同時全量重建）
+    for table, key in (("bp_daily", "day"), ("bp_weekly", "week")):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"""
+        CREATE TABLE {table} (
+            user_id INTEGER NOT NULL,
+            {key} TEXT NOT NULL,              -- 本地日期 YYYY-MM-DD（週表為該週週一）
+            n INTEGER NOT NULL,
+            sys_min REAL, sys_max REAL, sys_sum REAL,
+            dia_min REAL, dia_max REAL, dia_sum REAL,
+            pulse_min REAL, pulse_max REAL, pulse_sum REAL,
+            n_normal INTEGER NOT NULL, n_elevated INTEGER NOT NULL,
+            n_stage1 INTEGER NOT NULL, n_stage2 INTEGER NOT NULL, n_unknown INTEGER NOT NULL,
+            PRIMARY KEY (user_id, {key})
+        ) WITHOUT ROWID;
+        """)
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;")
+    _rebuild_rollups(conn)
+
+# 依序追加；版本號 = 串列索引 + 1，已發布的項目不可改動順序
+MIGRATIONS = [
+    _m001_base_tables,
+    _m002_bp_user_datetime_index,
+    _m003_rollup_tables,
+    _m004_login_throttle,
+    _m005_bp_epoch,
+    _m006_bp_change_log,
+    _m007_bp_unique_reading,
+    _m008_throttle_token_bucket,
+    _m009_rollup_tz,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_migrated_paths: set = set()  # 本行程已確認為最新版本的 DB 檔
+_schema_lock = threading.Lock()
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """把資料庫升級到 SCHEMA_VERSION；每個版本一個交易，回傳升級後版本。"""
+    while True:
+        # BEGIN IMMEDIATE 先取得寫鎖，再讀版本，避免多個行程重複執行同一個遷移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = _schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                return version
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+def init_db():
+    """確保 schema 為最新版本；每個行程只實際檢查一次，之後的 rerun 直接返回。"""
+    key = Path(DB_PATH).resolve()
+    if key in _migrated_paths:
+        return
+    with _schema_lock:
+        if key in _migrated_paths:
+            return
+        with connection() as conn:
+            migrate(conn)
+            _check_rollup_tz(conn)
+        _migrated_paths.add(key)
+
+# 熱門查詢：(名稱, SQL, 參數)；check_query_plans() 會確認它們都走索引
+HOT_QUERIES = [
+    ("list_bp",
+     "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure "
+     "WHERE user_id = ? ORDER BY ts, id", (1,)),
+    ("list_bp_range",
+     "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure "
+     "WHERE user_id = ? AND ts BETWEEN ? AND ? ORDER BY ts, id",
+     (1, 1735689600, 1767225599)),
+    ("list_bp_page",
+     "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure "
+     "WHERE user_id = ? AND ts BETWEEN ? AND ? AND (ts, id) > (?, ?) ORDER BY ts, id LIMIT ?",
+     (1, 1735689600, 1767225599, 1735689600, 0, 51)),
+    ("list_bp_page_back",
+     "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure "
+     "WHERE user_id = ? AND (ts, id) < (?, ?) ORDER BY ts DESC, id DESC LIMIT ?",
+     (1, 1767225599, 0, 51)),
+    ("bp_changes",
+     "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure "
+     "WHERE user_id = ? AND seq > ?", (1, 0)),
+    ("bp_tombstones", "SELECT id FROM bp_tombstones WHERE user_id = ? AND seq > ?", (1, 0)),
+    ("import_bp_match",   # import_bp 的 JOIN 對每一列做的查找（自然鍵唯一索引）
+     "SELECT id, meds, note FROM blood_pressure "
+     "WHERE user_id = ? AND ts = ? AND systolic = ? AND diastolic = ? AND pulse = ?",
+     (1, 1735689600, 120.0, 80.0, 70.0)),
+    ("delete_all_bp", "DELETE FROM blood_pressure WHERE user_id = ?", (1,)),
+    ("delete_bp_range",
+     "DELETE FROM blood_pressure WHERE user_id = ? AND ts BETWEEN ? AND ?",
+     (1, 1735689600, 1767225599)),
+]
+
+def explain(conn: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> List[str]:
+    """回傳 EXPLAIN QUERY PLAN 的 detail 欄位。"""
+    return [r[-1] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", tuple(params)).fetchall()]
+
+def check_query_plans() -> Dict[str, List[str]]:
+    """
+    檢查 HOT_QUERIES 的查詢計畫；回傳「有問題的查詢 → 計畫」。
+    問題定義：出現全表 SCAN（未走索引）或需要 TEMP B-TREE 排序。空 dict 代表全部通過。
+    """
+    init_db()
+    bad: Dict[str, List[str]] = {}
+    with connection() as conn:
+        for name, sql, params in HOT_QUERIES:
+            plan = explain(conn, sql, params)
+            full_scan = any(p.startswith("SCAN") and "INDEX" not in p for p in plan)
+            temp_sort = any("TEMP B-TREE" in p for p in plan)
+            if full_scan or temp_sort:
+                bad[name] = plan
+    return bad
 
 # ---------- 密碼雜湊：新帳號一律 Argon2；相容舊 bcrypt / bcrypt_sha256 ----------
+# 雜湊 / 驗證一律交給 hashing 執行緒池（限制同時執行數）；滿載時丟 hashing.HashingBusy
+@instrument.timed("hash", "hash_password")
 def _hash_password(password: str) -> str:
-    return argon2.hash(password)
+    return hashing.run(_hashers()[0].hash, password)
 
 def _identify_scheme(ph: str) -> str:
+    argon2, bcrypt, bcrypt_sha256 = _hashers()
     try:
         if argon2.identify(ph): return "argon2"
     except Exception: pass
@@ -69,7 +485,12 @@ def _identify_scheme(ph: str) -> str:
     except Exception: pass
     return "unknown"
 
+@instrument.timed("hash", "verify_password")
 def _verify_password(password: str, password_hash: str) -> bool:
+    return hashing.run(_verify_password_sync, password, password_hash)
+
+def _verify_password_sync(password: str, password_hash: str) -> bool:
+    argon2, bcrypt, bcrypt_sha256 = _hashers()
     scheme = _identify_scheme(password_hash)
     try:
         if scheme == "argon2":
@@ -87,10 +508,8 @@ def maybe_upgrade_password(user_id: int, password: str, password_hash: str):
     if _identify_scheme(password_hash) != "argon2":
         try:
             new_hash = _hash_password(password)
-            conn = get_conn()
-            conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user_id))
-            conn.commit()
-            conn.close()
+            with connection() as conn:
+                conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user_id))
         except Exception:
             pass  # 升級失敗不阻斷登入流程
 
@@ -101,26 +520,20 @@ def create_user(email: str, name: str, password: str) -> int:
     if len(password) < 10:
         raise ValueError("Password too short")
     ph = _hash_password(password)  # Argon2
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (email, name, password_hash) VALUES (?, ?, ?)",
-        (email, name, ph)
-    )
-    conn.commit()
-    uid = cur.lastrowid
-    conn.close()
+    with connection() as conn:
+        cur = conn.execute(
+            "INSERT INTO users (email, name, password_hash) VALUES (?, ?, ?)",
+            (email, name, ph)
+        )
+        uid = cur.lastrowid
     return uid
 
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, email, name, password_hash FROM users WHERE email = ?",
-        ((email or "").strip().lower(),)
-    )
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT id, email, name, password_hash FROM users WHERE email = ?",
+            ((email or "").strip().lower(),)
+        ).fetchone()
     if not row:
         return None
     return {"id": row[0], "email": row[1], "name": row[2], "password_hash": row[3]}
@@ -128,52 +541,563 @@ def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
 def verify_password(password: str, password_hash: str) -> bool:
     return _verify_password(password, password_hash)
 
+# ---------- 登入節流（在任何雜湊運算之前檢查） ----------
+THROTTLE_CLEANUP_EVERY = 600.0   # 秒；順便清掉過期列
+THROTTLE_RETENTION = 86400.0     # 超過此秒數未再失敗且未鎖定的列會被清除
+_next_cleanup = 0.0
+
+def throttle_allowed(keys: Iterable[str], now: Optional[float] = None) -> bool:
+    """所有 key 都未被鎖定才回傳 True（主鍵查詢，O(1)）。"""
+    now = time.time() if now is None else now
+    keys = list(keys)
+    if not keys:
+        return True
+    q = ",".join("?" for _ in keys)
+    with connection() as conn:
+        row = conn.execute(
+            f"SELECT 1 FROM login_throttle WHERE key IN ({q}) AND locked_until > ? LIMIT 1", (*keys, now)
+        ).fetchone()
+    return row is None
+
+def throttle_fail(key: str, max_fail: int, window_s: float, lock_s: float, now: Optional[float] = None) -> None:
+    """
+    記一次失敗（token bucket）：每個 key 最多 max_fail 額度，每秒連續補充 max_fail / window_s；
+    每次失敗扣 1，額度不足 1 即鎖定 lock_s 秒，解鎖後額度補滿。沒有視窗邊界，跨邊界的連續嘗試
+    也不會拿到兩倍額度。鎖定中的 key 不扣額度。單列 UPSERT，於同一交易內完成。
+    """
+    global _next_cleanup
+    now = time.time() if now is None else now
+    params = {"key": key, "now": now, "cap": float(max_fail), "rate": max_fail / window_s}
+    with connection() as conn:
+        conn.execute("""
+            INSERT INTO login_throttle (key, tokens, refilled_at, locked_until) VALUES (:key, :cap - 1, :now, 0)
+            ON CONFLICT(key) DO UPDATE SET
+                tokens = CASE WHEN locked_until > :now THEN tokens
+                              WHEN locked_until > 0 THEN :cap - 1
+                              ELSE MIN(:cap, tokens + (:now - refilled_at) * :rate) - 1 END,
+                refilled_at = CASE WHEN locked_until > :now THEN refilled_at ELSE :now END,
+                locked_until = CASE WHEN locked_until <= :now THEN 0 ELSE locked_until END
+        """, params)
+        conn.execute("""
+            UPDATE login_throttle SET locked_until = :now + :lock, tokens = :cap, refilled_at = :now
+            WHERE key = :key AND locked_until = 0 AND tokens < 1
+        """, {**params, "lock": lock_s})
+        if now >= _next_cleanup:
+            _next_cleanup = now + THROTTLE_CLEANUP_EVERY
+            conn.execute("DELETE FROM login_throttle WHERE locked_until <= ? AND refilled_at < ?",
+                         (now, now - THROTTLE_RETENTION))
+
+def reset_after_restore() -> None:
+    """整份資料庫被還原後呼叫：重新檢查 schema（備份可能是舊版本）。快取 / 鏡像由還原時推進的 bp_sync 序號失效。"""
+    _migrated_paths.discard(Path(DB_PATH).resolve())
+    init_db()
+
+# ---------- 增量同步（跨行程）：bp_sync.seq + blood_pressure.seq + bp_tombstones ----------
+TOMBSTONE_KEEP = 10000   # 每位使用者保留的 tombstone 上限；更舊的清掉並抬高 floor_seq
+
+def _next_seq(conn: sqlite3.Connection, user_id: int) -> int:
+    """在目前寫入交易內取得此使用者的下一個序號（同一交易的所有變更共用一個序號）。"""
+    conn.execute("""
+        INSERT INTO bp_sync (user_id, seq) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1
+    """, (user_id,))
+    return conn.execute("SELECT seq FROM bp_sync WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def _tombstone(conn: sqlite3.Connection, user_id: int, seq: int, where: str, params: Tuple) -> None:
+    """把即將刪除的列（WHERE user_id = ? AND {where}）記成 tombstone；超過上限時清掉最舊的。"""
+    conn.execute(f"INSERT OR IGNORE INTO bp_tombstones (user_id, seq, id) "
+                 f"SELECT user_id, ?, id FROM blood_pressure WHERE user_id = ? AND {where}",
+                 (seq, user_id, *params))
+    cut = conn.execute("SELECT seq FROM bp_tombstones WHERE user_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                       (user_id, TOMBSTONE_KEEP)).fetchone()
+    if cut is not None:
+        conn.execute("DELETE FROM bp_tombstones WHERE user_id = ? AND seq <= ?", (user_id, cut[0]))
+        conn.execute("UPDATE bp_sync SET floor_seq = MAX(floor_seq, ?) WHERE user_id = ?", (cut[0], user_id))
+
+def bp_sync_state(user_id: int) -> Tuple[int, int]:
+    """(目前序號, floor_seq)；主鍵查詢，供快取每次 rerun 判斷是否有變更。"""
+    with connection() as conn:
+        row = conn.execute("SELECT seq, floor_seq FROM bp_sync WHERE user_id = ?", (user_id,)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+def bp_changes(user_id: int, since_seq: int) -> Optional[Tuple[int, pd.DataFrame, List[int]]]:
+    """
+    自 since_seq 之後的變更：(目前序號, 新增或修改的列（欄位同 list_bp）, 已刪除的 id)。
+    since_seq 早於 floor_seq（tombstone 已清除）時回傳 None，呼叫端需改用 list_bp 全量重載。
+    先讀序號再讀資料：期間若有新寫入，下次同步會再套用一次（以 id 覆蓋，結果不變）。
+    """
+    import pandas as pd
+    with connection() as conn:
+        row = conn.execute("SELECT seq, floor_seq FROM bp_sync WHERE user_id = ?", (user_id,)).fetchone()
+        seq, floor = (row[0], row[1]) if row else (0, 0)
+        if since_seq < floor:
+            return None
+        changed = pd.read_sql_query(
+            "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure "
+            "WHERE user_id = ? AND seq > ? ORDER BY ts, id", conn, params=[user_id, since_seq])
+        deleted = [r[0] for r in conn.execute(
+            "SELECT id FROM bp_tombstones WHERE user_id = ? AND seq > ?", (user_id, since_seq)).fetchall()]
+    return seq, _ts_frame(changed), deleted
+
+# ---------- 彙總表：bp_daily / bp_weekly（由下方寫入函式在同一交易內維護） ----------
+_ROLLUP_CATS = ["n_normal", "n_elevated", "n_stage1", "n_stage2", "n_unknown"]
+_ROLLUP_COLS = ["n", "sys_min", "sys_max", "sys_sum", "dia_min", "dia_max", "dia_sum",
+                "pulse_min", "pulse_max", "pulse_sum", *_ROLLUP_CATS]
+
+def _local_days(epochs: Iterable[int]) -> set:
+    """epoch 秒 → 所屬本地日集合。時區位移皆為 15 分鐘的倍數，先以 15 分鐘分桶去重再換算。"""
+    import numpy as np
+    arr = np.fromiter((int(e) for e in epochs), dtype=np.int64)
+    return {datetime.fromtimestamp(int(b), TZ).date().isoformat() for b in np.unique(arr // 900) * 900}
+
+def _week_of(day: str) -> str:
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+def _day_bounds(day: str) -> Tuple[int, int]:
+    """本地日 → [00:00, 隔日 00:00) 的 epoch 秒區間（依 TZ，含日光節約時間的 23 / 25 小時日）。"""
+    d = date.fromisoformat(day)
+    nxt = d + timedelta(days=1)
+    return (int(datetime(d.year, d.month, d.day, tzinfo=TZ).timestamp()),
+            int(datetime(nxt.year, nxt.month, nxt.day, tzinfo=TZ).timestamp()))
+
+def _level_sql() -> str:
+    # 與 utils.classify_bp 相同的條件與判斷順序（先符合者勝出）；門檻為數值常數，直接內嵌
+    th = {k: float(v) for k, v in BP_THRESHOLDS.items()}
+    return f"""CASE
+        WHEN systolic IS NULL OR diastolic IS NULL THEN 99
+        WHEN systolic < {th['elevated_sys']} AND diastolic < {th['stage1_dia']} THEN 0
+        WHEN systolic >= {th['elevated_sys']} AND systolic < {th['stage1_sys']} AND diastolic < {th['stage1_dia']} THEN 1
+        WHEN (systolic >= {th['stage1_sys']} AND systolic < {th['stage2_sys']})
+          OR (diastolic >= {th['stage1_dia']} AND diastolic < {th['stage2_dia']}) THEN 2
+        WHEN systolic >= {th['stage2_sys']} OR diastolic >= {th['stage2_dia']} THEN 3
+        ELSE 99 END"""
+
+@lru_cache(maxsize=None)
+def _daily_rollup_sql() -> str:
+    cats = ", ".join(f"SUM(lvl = {lvl})" for lvl in (0, 1, 2, 3, 99))
+    return f"""
+        INSERT INTO bp_daily (user_id, day, {', '.join(_ROLLUP_COLS)})
+        SELECT ?, ?, COUNT(*),
+               MIN(systolic), MAX(systolic), SUM(systolic),
+               MIN(diastolic), MAX(diastolic), SUM(diastolic),
+               MIN(pulse), MAX(pulse), SUM(pulse),
+               {cats}
+        FROM (SELECT systolic, diastolic, pulse, {_level_sql()} AS lvl
+              FROM blood_pressure WHERE user_id = ? AND ts >= ? AND ts < ?)
+        HAVING COUNT(*) > 0
+    """
+
+def _refresh_rollups(conn: sqlite3.Connection, user_id: int, days: Optional[set] = None) -> None:
+    """
+    重算指定本地日（None = 該使用者全部）的日彙總，再由日彙總重算所屬週。
+    每個本地日是一段 ts 整數區間：在 SQLite 內以 (user_id, ts) 索引範圍掃描彙總，不經 pandas。
+    """
+    if days is None:
+        conn.execute("DELETE FROM bp_daily WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM bp_weekly WHERE user_id = ?", (user_id,))
+        days = _local_days(r[0] for r in conn.execute(
+            "SELECT ts FROM blood_pressure WHERE user_id = ?", (user_id,)).fetchall())
+    else:
+        conn.executemany("DELETE FROM bp_daily WHERE user_id = ? AND day = ?", [(user_id, d) for d in days])
+    if not days:
+        return
+    conn.executemany(_daily_rollup_sql(),
+                     [(user_id, d, user_id, *_day_bounds(d)) for d in sorted(days)])
+
+    weeks = sorted({_week_of(d) for d in days})
+    conn.executemany("DELETE FROM bp_weekly WHERE user_id = ? AND week = ?", [(user_id, w) for w in weeks])
+    conn.executemany(f"""
+        INSERT INTO bp_weekly (user_id, week, {', '.join(_ROLLUP_COLS)})
+        SELECT ?, ?, SUM(n),
+               MIN(sys_min), MAX(sys_max), SUM(sys_sum),
+               MIN(dia_min), MAX(dia_max), SUM(dia_sum),
+               MIN(pulse_min), MAX(pulse_max), SUM(pulse_sum),
+               {', '.join(f"SUM({c})" for c in _ROLLUP_CATS)}
+        FROM bp_daily WHERE user_id = ? AND day >= ? AND day < ?
+        HAVING COUNT(*) > 0
+    """, [(user_id, w, user_id, w, (date.fromisoformat(w) + timedelta(days=7)).isoformat()) for w in weeks])
+
+def _rollup_tz() -> str:
+    return str(TZ)
+
+def _rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """以目前 TZ 重建所有使用者的日 / 週彙總，並記下 TZ。呼叫端負責交易。"""
+    conn.execute("DELETE FROM bp_daily")
+    conn.execute("DELETE FROM bp_weekly")
+    for (uid,) in conn.execute("SELECT DISTINCT user_id FROM blood_pressure").fetchall():
+        _refresh_rollups(conn, uid)
+    conn.execute("INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('tz', ?)", (_rollup_tz(),))
+
+def _check_rollup_tz(conn: sqlite3.Connection) -> None:
+    """彙總表的本地日以寫入當時的 TZ 切分；TZ 設定改變（或尚未記錄）時全量重建。"""
+    row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'tz'").fetchone()
+    if row is not None and row[0] == _rollup_tz():
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'tz'").fetchone()
+        if row is None or row[0] != _rollup_tz():
+            _rebuild_rollups(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _rollup_frame(table: str, key: str, user_id: int,
+                  start_day: Optional[str], end_day: Optional[str]) -> pd.DataFrame:
+    import pandas as pd
+    sql = f"SELECT {key}, {', '.join(_ROLLUP_COLS)} FROM {table} WHERE user_id = ?"
+    params: List[Any] = [user_id]
+    if start_day:
+        sql += f" AND {key} >= ?"; params.append(start_day)
+    if end_day:
+        sql += f" AND {key} <= ?"; params.append(end_day)
+    sql += f" ORDER BY {key}"
+    with connection() as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+    for v in ("sys", "dia", "pulse"):
+        df[f"{v}_mean"] = df[f"{v}_sum"] / df["n"]
+    return df
+
+def bp_daily(user_id: int, start_day: Optional[str] = None, end_day: Optional[str] = None) -> pd.DataFrame:
+    """每本地日彙總（day 為 YYYY-MM-DD，含 start_day / end_day）。"""
+    return _rollup_frame("bp_daily", "day", user_id, start_day, end_day)
+
+def bp_weekly(user_id: int, start_week: Optional[str] = None, end_week: Optional[str] = None) -> pd.DataFrame:
+    """每週彙總（week 為該週週一 YYYY-MM-DD）。"""
+    return _rollup_frame("bp_weekly", "week", user_id, start_week, end_week)
+
+# ---------- 時間戳：blood_pressure.ts 一律存 UTC epoch 秒（INTEGER） ----------
+# 輸入可為 ISO8601 字串（...Z / +08:00 / naive）、datetime / pd.Timestamp、date 或 epoch 數值；
+# naive 一律視為 UTC（與 _m005 回填、enrich_bp 的慣例一致）。
+def _epoch(value: Any) -> int:
+    """單一時間值 → UTC epoch 秒；無法解析時丟 ValueError。"""
+    if isinstance(value, Real) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        text = value.strip()
+        value = datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if not isinstance(value, datetime):
+        raise ValueError(f"invalid datetime: {value!r}")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def _epochs(values: Any) -> List[int]:
+    """整欄轉 epoch 秒（向量化）；有任何無法解析的值就丟 ValueError（整批不寫入）。"""
+    import numpy as np
+    import pandas as pd
+    s = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=False) == "integer":
+        s = s.astype(np.int64)
+    if pd.api.types.is_integer_dtype(s):
+        return s.astype(np.int64).tolist()
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        dt = s.dt.tz_convert("UTC").dt.tz_localize(None)
+    elif pd.api.types.is_datetime64_dtype(s):
+        dt = s
+    else:
+        dt = pd.to_datetime(s, utc=True, errors="coerce", format="ISO8601").dt.tz_localize(None)
+    if dt.isna().any():
+        bad = s[dt.isna()].iloc[0]
+        raise ValueError(f"invalid datetime: {bad!r}")
+    return dt.to_numpy().astype("datetime64[s]").astype(np.int64).tolist()
+
+def _ts_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # 讀取端：ts（int64）→ tz-aware UTC datetime，整欄型別轉換、不經字串解析
+    import pandas as pd
+    df.insert(1, "datetime", pd.to_datetime(df.pop("ts"), unit="s", utc=True))
+    return df
+
 # ---------- 血壓 ----------
+# 自然鍵（idx_bp_user_reading）：同一使用者、同一秒、同一組讀值只能有一筆
+_BP_KEY = "user_id, ts, systolic, diastolic, pulse"
+_BP_INSERT_SQL = f"""
+    INSERT INTO blood_pressure (user_id, ts, systolic, diastolic, pulse, meds, note, seq)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT({_BP_KEY}) DO NOTHING
+"""
+
 def add_bp(user_id: int, rec: Dict[str, Any]) -> int:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO blood_pressure (user_id, datetime, systolic, diastolic, pulse, meds, note)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, rec["datetime"], rec["systolic"], rec["diastolic"], rec["pulse"],
-          rec.get("meds",""), rec.get("note","")))
-    conn.commit()
-    rid = cur.lastrowid
-    conn.close()
+    """
+    新增一筆並回傳 id。與既有紀錄自然鍵（時間 + 三個讀值）相同時丟 sqlite3.IntegrityError、不寫入，
+    由呼叫端告知使用者該筆已存在；以檔案內容覆寫既有列的語意只屬於 import_bp。
+    """
+    ts = _epoch(rec["datetime"])
+    with connection() as conn:
+        rid = conn.execute("""
+            INSERT INTO blood_pressure (user_id, ts, systolic, diastolic, pulse, meds, note, seq)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+        """, (user_id, ts, rec["systolic"], rec["diastolic"], rec["pulse"],
+              rec.get("meds",""), rec.get("note",""), _next_seq(conn, user_id))).fetchone()[0]
+        _refresh_rollups(conn, user_id, _local_days([ts]))
     return rid
 
+def _bp_rows_from_frame(user_id: int, df: pd.DataFrame) -> Iterator[Tuple]:
+    n = len(df)
+    def text(col: str) -> List[str]:
+        if col not in df.columns:
+            return [""] * n
+        return df[col].fillna("").astype(str).tolist()
+    return zip(
+        [user_id] * n,
+        _epochs(df["datetime"]),
+        df["systolic"].astype(float).tolist(),
+        df["diastolic"].astype(float).tolist(),
+        df["pulse"].astype(float).tolist(),
+        text("meds"),
+        text("note"),
+    )
+
+def _bp_rows(user_id: int, records: Union[pd.DataFrame, Iterable[Dict[str, Any]]]) -> List[Tuple]:
+    """DataFrame 或 dict 的可迭代物件 → (user_id, ts, systolic, diastolic, pulse, meds, note) 列。"""
+    import pandas as pd
+    if isinstance(records, pd.DataFrame):
+        return list(_bp_rows_from_frame(user_id, records)) if not records.empty else []
+    records = list(records)
+    return [(user_id, ts, r["systolic"], r["diastolic"], r["pulse"], r.get("meds",""), r.get("note",""))
+            for ts, r in zip(_epochs(r["datetime"] for r in records), records)]
+
+def add_bp_many(user_id: int, records: Union[pd.DataFrame, Iterable[Dict[str, Any]]]) -> int:
+    """
+    批次新增血壓紀錄：單一交易 + executemany，回傳新增筆數（與既有紀錄自然鍵相同者略過、不計入）。
+    records 可為 DataFrame（欄位同 add_bp 的 rec）或 dict 的可迭代物件。
+    任一筆失敗（含時間無法解析）則整批不寫入。
+    """
+    rows = _bp_rows(user_id, records)
+    if not rows:
+        return 0
+    with connection() as conn:
+        seq = _next_seq(conn, user_id)
+        before = conn.total_changes
+        conn.executemany(_BP_INSERT_SQL, (r + (seq,) for r in rows))
+        n = conn.total_changes - before
+        _refresh_rollups(conn, user_id, _local_days(r[1] for r in rows))
+    return n
+
+def import_bp(user_id: int, records: Union[pd.DataFrame, Iterable[Dict[str, Any]]]) -> Dict[str, int]:
+    """
+    冪等匯入（同一份 / 重疊的 CSV 重複匯入不會產生重複列），回傳 {"inserted", "updated", "skipped"}。
+    - 全部列先 executemany 寫進暫存表，檔內自然鍵重複者只留最後一筆
+    - 以一次 JOIN（走 idx_bp_user_reading）分類：資料庫沒有 → inserted；已存在但 meds / note 不同 → updated
+      （改成檔案內容）；完全相同或檔內重複 → skipped
+    - 一句 INSERT ... SELECT ... ON CONFLICT DO UPDATE 寫入；未變更的列不改寫、不推進 seq
+    只有新增的列會影響彙總表（meds / note 不在彙總內）。任一列時間無法解析則整批不寫入。
+    """
+    rows = _bp_rows(user_id, records)
+    counts = {"inserted": 0, "updated": 0, "skipped": len(rows)}
+    if not rows:
+        return counts
+    match = """FROM temp.bp_import i LEFT JOIN blood_pressure b
+               ON b.user_id = i.user_id AND b.ts = i.ts AND b.systolic = i.systolic
+              AND b.diastolic = i.diastolic AND b.pulse = i.pulse"""
+    with connection() as conn:
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS bp_import (
+                user_id INTEGER, ts INTEGER, systolic REAL, diastolic REAL, pulse REAL, meds TEXT, note TEXT)
+        """)
+        try:
+            conn.execute("DELETE FROM temp.bp_import")
+            conn.executemany("INSERT INTO temp.bp_import VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("""
+                DELETE FROM temp.bp_import WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM temp.bp_import GROUP BY ts, systolic, diastolic, pulse)
+            """)
+            new, changed = conn.execute(f"""
+                SELECT COALESCE(SUM(b.id IS NULL), 0),
+                       COALESCE(SUM(b.id IS NOT NULL AND (b.meds IS NOT i.meds OR b.note IS NOT i.note)), 0)
+                {match}
+            """).fetchone()
+            counts = {"inserted": new, "updated": changed, "skipped": len(rows) - new - changed}
+            if new or changed:
+                days = _local_days(r[0] for r in conn.execute(
+                    f"SELECT DISTINCT i.ts / 900 * 900 {match} WHERE b.id IS NULL").fetchall())
+                conn.execute(f"""
+                    INSERT INTO blood_pressure (user_id, ts, systolic, diastolic, pulse, meds, note, seq)
+                    SELECT user_id, ts, systolic, diastolic, pulse, meds, note, ? FROM temp.bp_import WHERE true
+                    ON CONFLICT({_BP_KEY}) DO UPDATE SET meds = excluded.meds, note = excluded.note, seq = excluded.seq
+                    WHERE blood_pressure.meds IS NOT excluded.meds OR blood_pressure.note IS NOT excluded.note
+                """, (_next_seq(conn, user_id),))
+                _refresh_rollups(conn, user_id, days)
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.bp_import")
+    return counts
+
 def update_bp(user_id: int, rec_id: int, fields: Dict[str, Any]):
     keys, vals = [], []
     for k, v in fields.items():
+        if k == "datetime":
+            k, v = "ts", _epoch(v)
         keys.append(f"{k} = ?"); vals.append(v)
+    keys.append("seq = ?")
     vals.extend([user_id, rec_id])
     sql = f"UPDATE blood_pressure SET {', '.join(keys)} WHERE user_id = ? AND id = ?"
-    conn = get_conn()
-    conn.execute(sql, tuple(vals))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        vals.insert(-2, _next_seq(conn, user_id))
+        old = conn.execute("SELECT ts FROM blood_pressure WHERE user_id = ? AND id = ?",
+                           (user_id, rec_id)).fetchone()
+        conn.execute(sql, tuple(vals))
+        if old is not None:
+            new_ts = _epoch(fields["datetime"]) if "datetime" in fields else old[0]
+            _refresh_rollups(conn, user_id, _local_days([old[0], new_ts]))
+
+_BP_UPDATABLE = ("datetime", "systolic", "diastolic", "pulse", "meds", "note")
+_BP_COLUMN = {"datetime": "ts"}  # 對外欄名 → 資料表欄名
+
+def update_bp_many(user_id: int, changes: pd.DataFrame) -> int:
+    """
+    批次更新：changes 需含 id 欄，其餘欄位取自 _BP_UPDATABLE 的子集。
+    值為 None / NaN 代表該欄不變。單一交易 + executemany，回傳更新筆數。
+    """
+    cols = [c for c in _BP_UPDATABLE if c in changes.columns]
+    if changes.empty or not cols:
+        return 0
+    ids = changes["id"].astype(int).tolist()
+    values = [changes[c].astype(object).where(changes[c].notna(), None).tolist() for c in cols]
+    new_ts: List[int] = []
+    if "datetime" in cols:
+        i = cols.index("datetime")
+        given = [v for v in values[i] if v is not None]
+        it = iter(_epochs(given) if given else [])
+        values[i] = [None if v is None else next(it) for v in values[i]]
+        new_ts = [v for v in values[i] if v is not None]
+    sets = ", ".join(f"{_BP_COLUMN.get(c, c)} = COALESCE(?, {_BP_COLUMN.get(c, c)})" for c in cols)
+    rows = [(*vals, user_id, rid) for rid, *vals in zip(ids, *values)]
+    with connection() as conn:
+        old_days = _local_days(
+            r[0] for chunk in _chunks(ids) for r in conn.execute(
+                f"SELECT ts FROM blood_pressure WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                (user_id, *chunk)).fetchall())
+        seq = _next_seq(conn, user_id)
+        before = conn.total_changes
+        conn.executemany(f"UPDATE blood_pressure SET {sets}, seq = {seq} WHERE user_id = ? AND id = ?", rows)
+        n = conn.total_changes - before
+        _refresh_rollups(conn, user_id, old_days | _local_days(new_ts))
+    return n
+
+def _chunks(seq: List[Any], size: int = 500) -> Iterator[List[Any]]:
+    # 控制單一語句的 ? 數量，避免超過 SQLite 變數上限
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
 
 def delete_bp(user_id: int, ids: Iterable[int]):
+    """依 ID 刪除；ID 很多時分批送出（同一交易），不受 SQLite 變數上限影響。"""
     ids = list(ids)
     if not ids: return
-    q = ",".join("?" for _ in ids)
-    conn = get_conn()
-    conn.execute(f"DELETE FROM blood_pressure WHERE user_id = ? AND id IN ({q})", (user_id, *ids))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        seq = _next_seq(conn, user_id)
+        days: set = set()
+        for chunk in _chunks(ids):
+            q = ",".join("?" for _ in chunk)
+            days |= _local_days(r[0] for r in conn.execute(
+                f"SELECT ts FROM blood_pressure WHERE user_id = ? AND id IN ({q})", (user_id, *chunk)).fetchall())
+            _tombstone(conn, user_id, seq, f"id IN ({q})", tuple(chunk))
+            conn.execute(f"DELETE FROM blood_pressure WHERE user_id = ? AND id IN ({q})", (user_id, *chunk))
+        _refresh_rollups(conn, user_id, days)
+
+def delete_all_bp(user_id: int) -> int:
+    """刪除此使用者全部血壓紀錄與彙總（單一索引語句），回傳刪除筆數。"""
+    with connection() as conn:
+        # 不逐列寫 tombstone：抬高 floor_seq，讓所有快取全量重載（此時已是空資料）
+        seq = _next_seq(conn, user_id)
+        conn.execute("UPDATE bp_sync SET floor_seq = ? WHERE user_id = ?", (seq, user_id))
+        conn.execute("DELETE FROM bp_tombstones WHERE user_id = ?", (user_id,))
+        n = conn.execute("DELETE FROM blood_pressure WHERE user_id = ?", (user_id,)).rowcount
+        conn.execute("DELETE FROM bp_daily WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM bp_weekly WHERE user_id = ?", (user_id,))
+    return n
 
-def list_bp(user_id: int, start_iso: Optional[str]=None, end_iso: Optional[str]=None) -> pd.DataFrame:
+def delete_bp_range(user_id: int, start_iso: Any, end_iso: Any) -> int:
+    """刪除時間介於 start_iso ~ end_iso（含）的紀錄，條件與 list_bp 的區間查詢相同。"""
+    lo, hi = _epoch(start_iso), _epoch(end_iso)
+    with connection() as conn:
+        _tombstone(conn, user_id, _next_seq(conn, user_id), "ts BETWEEN ? AND ?", (lo, hi))
+        n = conn.execute(
+            "DELETE FROM blood_pressure WHERE user_id = ? AND ts BETWEEN ? AND ?",
+            (user_id, lo, hi)
+        ).rowcount
+        if n:
+            # 受影響的本地日：區間涵蓋的每一天，前後各放寬 1 天涵蓋時區位移
+            d0 = datetime.fromtimestamp(lo, timezone.utc).date() - timedelta(days=1)
+            d1 = datetime.fromtimestamp(hi, timezone.utc).date() + timedelta(days=1)
+            _refresh_rollups(conn, user_id, {(d0 + timedelta(days=i)).isoformat() for i in range((d1 - d0).days + 1)})
+    return n
+
+BP_EXPORT_COLUMNS = ["id", "datetime", "systolic", "diastolic", "pulse", "meds", "note"]
+# 匯出時由 SQLite 直接把 ts 格式化成 ISO8601（UTC）；datetime() + replace 比 strftime(格式字串) 快約一倍
+_BP_EXPORT_SELECT = ("id, replace(datetime(ts, 'unixepoch'), ' ', 'T') || 'Z' AS datetime, "
+                     "systolic, diastolic, pulse, meds, note")
+
+def iter_bp(user_id: int, chunk_rows: int = 5000) -> Iterator[List[Tuple]]:
+    """
+    以 cursor.fetchmany 分批產出此使用者的紀錄（欄位同 BP_EXPORT_COLUMNS，依時間排序；datetime 為 ISO8601 字串）。
+    使用獨立連線（不佔連線池、不與同執行緒的其他寫入共用交易），產生器結束或關閉時釋放。
+    """
     conn = get_conn()
-    base_sql = """
-        SELECT id, datetime, systolic, diastolic, pulse, meds, note
-        FROM blood_pressure
-        WHERE user_id = ?
+    # 一次性循序掃描：不用 mmap（避免整個 DB 檔映射進 RSS），頁快取也不必放大
+    conn.execute("PRAGMA mmap_size = 0;")
+    conn.execute("PRAGMA cache_size = -2000;")
+    try:
+        cur = conn.execute(
+            f"SELECT {_BP_EXPORT_SELECT} FROM blood_pressure WHERE user_id = ? ORDER BY ts, id",
+            (user_id,)
+        )
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def list_bp(user_id: int, start_iso: Optional[Any]=None, end_iso: Optional[Any]=None) -> pd.DataFrame:
+    """
+    此使用者的紀錄（依時間排序）；datetime 欄為 tz-aware UTC（由 ts 整欄轉型，不做字串解析）。
+    start_iso / end_iso 可為 ISO8601 字串、datetime 或 epoch 秒（含兩端）。
+    實際讀取交給 storage.backend()（預設 SQLite，走 (user_id, ts) 索引；可改用 Parquet 欄式鏡像）。
     """
-    params = [user_id]
     if start_iso and end_iso:
-        base_sql += " AND datetime BETWEEN ? AND ?"
-        params += [start_iso, end_iso]
-    base_sql += " ORDER BY datetime"
-    df = pd.read_sql_query(base_sql, conn, params=params)
-    conn.close()
-    return df
+        return _ts_frame(storage.backend().scan_bp(user_id, _epoch(start_iso), _epoch(end_iso)))
+    return _ts_frame(storage.backend().scan_bp(user_id))
+
+# ---------- 分頁（keyset）：游標 = (ts, id)，走 (user_id, ts) 索引，不用 OFFSET ----------
+PAGE_SIZE = 50
+
+def list_bp_page(user_id: int, start_iso: Optional[Any]=None, end_iso: Optional[Any]=None,
+                 cursor: Optional[Tuple[int, int]]=None, backward: bool=False,
+                 limit: int=PAGE_SIZE) -> Tuple[pd.DataFrame, bool]:
+    """
+    取一頁紀錄（欄位同 list_bp，依時間遞增），回傳 (頁面, 行進方向上是否還有下一頁)。
+    - backward=False：cursor 之後的 limit 筆；cursor=None 為第一頁
+    - backward=True ：cursor 之前的 limit 筆；cursor=None 為最後一頁
+    cursor 為 (ts, id)，可由 page_cursor 取得；每頁只讀 limit + 1 筆，與歷史長度無關。
+    """
+    import pandas as pd
+    sql = "SELECT id, ts, systolic, diastolic, pulse, meds, note FROM blood_pressure WHERE user_id = ?"
+    params: List[Any] = [user_id]
+    if start_iso is not None and end_iso is not None:
+        sql += " AND ts BETWEEN ? AND ?"
+        params += [_epoch(start_iso), _epoch(end_iso)]
+    if cursor is not None:
+        sql += " AND (ts, id) < (?, ?)" if backward else " AND (ts, id) > (?, ?)"
+        params += [int(cursor[0]), int(cursor[1])]
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?" if backward else " ORDER BY ts, id LIMIT ?"
+    params.append(limit + 1)
+    with connection() as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+    more = len(df) > limit
+    df = df.iloc[:limit]
+    if backward:
+        df = df.iloc[::-1]
+    return _ts_frame(df.reset_index(drop=True)), more
+
+def page_cursor(page: pd.DataFrame, last: bool=True) -> Optional[Tuple[int, int]]:
+    """頁面最後（last=False 為第一）一筆的 (ts, id) 游標；空頁回傳 None。"""
+    if page.empty:
+        return None
+    i = -1 if last else 0
+    return int(page["datetime"].iat[i].timestamp()), int(page["id"].iat[i])
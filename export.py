@@ -0,0 +1,145 @@
+# export.py
+"""
+串流匯出：由 SQLite cursor 分批讀取（db.iter_bp），逐批寫出，不建立完整 DataFrame / CSV 字串。
+- csv     ：UTF-8 CSV
+- csv.gz  ：gzip 壓縮 CSV
+- parquet ：Parquet（需 pyarrow，逐批寫 row group）
+- arrow   ：Arrow IPC stream（需 pyarrow）
+峰值記憶體約為單批 chunk_rows 筆，與歷史資料長度無關。
+頁面以 deferred_export 交給 st.download_button：只有按下下載時才匯出，一般 rerun 不做任何事。
+"""
+from __future__ import annotations
+import csv
+import io
+import tempfile
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterator, Tuple
+
+import db
+from utils import timestamped_name
+
+CHUNK_ROWS = 5000
+
+# 格式 → (副檔名, MIME)
+FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("csv", "text/csv"),
+    "csv.gz": ("csv.gz", "application/gzip"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.stream"),
+}
+
+
+def iter_csv(user_id: int, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """逐批產出 UTF-8 CSV bytes（第一批含表頭）。"""
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(db.BP_EXPORT_COLUMNS)
+    for rows in db.iter_bp(user_id, chunk_rows):
+        w.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")  # 無資料時仍輸出表頭
+
+
+def iter_csv_gz(user_id: int, chunk_rows: int = CHUNK_ROWS, level: int = 6) -> Iterator[bytes]:
+    """iter_csv 的 gzip 版本（wbits=31 產生標準 gzip 標頭）。"""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in iter_csv(user_id, chunk_rows):
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def _arrow_batches(user_id: int, chunk_rows: int):
+    import pyarrow as pa  # 選用相依：僅 parquet / arrow 匯出時才需要
+    schema = pa.schema([
+        ("id", pa.int64()), ("datetime", pa.string()),
+        ("systolic", pa.float64()), ("diastolic", pa.float64()), ("pulse", pa.float64()),
+        ("meds", pa.string()), ("note", pa.string()),
+    ])
+    def gen():
+        for rows in db.iter_bp(user_id, chunk_rows):
+            cols = list(zip(*rows))
+            yield pa.record_batch([pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema)
+    return schema, gen()
+
+
+def write_parquet(user_id: int, fileobj: BinaryIO, chunk_rows: int = CHUNK_ROWS) -> None:
+    import pyarrow.parquet as pq
+    schema, batches = _arrow_batches(user_id, chunk_rows)
+    with pq.ParquetWriter(fileobj, schema, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_arrow(user_id: int, fileobj: BinaryIO, chunk_rows: int = CHUNK_ROWS) -> None:
+    import pyarrow as pa
+    schema, batches = _arrow_batches(user_id, chunk_rows)
+    with pa.ipc.new_stream(fileobj, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_export(user_id: int, fmt: str, fileobj: BinaryIO, chunk_rows: int = CHUNK_ROWS) -> None:
+    """把此使用者的紀錄以 fmt 格式串流寫入 fileobj。"""
+    if fmt == "csv":
+        for b in iter_csv(user_id, chunk_rows):
+            fileobj.write(b)
+    elif fmt == "csv.gz":
+        for b in iter_csv_gz(user_id, chunk_rows):
+            fileobj.write(b)
+    elif fmt == "parquet":
+        write_parquet(user_id, fileobj, chunk_rows)
+    elif fmt == "arrow":
+        write_arrow(user_id, fileobj, chunk_rows)
+    else:
+        raise ValueError(f"unsupported export format: {fmt}")
+
+
+def open_export(user_id: int, fmt: str = "csv", filename_prefix: str = "blood_pressure") -> Tuple[BinaryIO, str, str]:
+    """
+    匯出到磁碟暫存檔，回傳 (已倒回開頭的檔案物件, 建議檔名, MIME)。
+    可直接交給 st.download_button(data=...)；呼叫端用完請 close()。
+    """
+    ext, mime = FORMATS[fmt]
+    # download_button 只接受 BufferedReader / RawIOBase 等型別：以無緩衝 FileIO 開檔，寫入時再包一層緩衝
+    raw = tempfile.TemporaryFile(buffering=0)
+    try:
+        w = io.BufferedWriter(raw)
+        write_export(user_id, fmt, w)
+        w.flush()
+        w.detach()
+        raw.seek(0)
+    except BaseException:
+        raw.close()
+        raise
+    return raw, timestamped_name(filename_prefix, ext), mime
+
+
+def deferred_export(user_id: int, fmt: str = "csv",
+                    filename_prefix: str = "blood_pressure") -> Tuple[Callable[[], bytes], str, str]:
+    """
+    回傳 (callable, 建議檔名, MIME)，交給 st.download_button(data=callable)。
+    Streamlit 只在使用者按下下載時才呼叫 callable；MediaFileManager 一律把結果存成記憶體中的 bytes
+    （傳路徑也會整檔讀入），因此先串流寫進暫存檔、最後一次讀回，整份資料只在點擊時存在一份。
+    """
+    ext, mime = FORMATS[fmt]
+
+    def run() -> bytes:
+        f, _, _ = open_export(user_id, fmt, filename_prefix)
+        with f:
+            return f.read()
+
+    return run, timestamped_name(filename_prefix, ext), mime
+
+
+def available_formats() -> list:
+    """目前環境可用的格式（未安裝 pyarrow 時不列出 parquet / arrow）。"""
+    try:
+        import pyarrow  # noqa: F401
+        return list(FORMATS)
+    except ImportError:
+        return ["csv", "csv.gz"]
@@ -0,0 +1,144 @@
+# hashing.py
+"""
+密碼雜湊專用執行緒池（Argon2 每次約 100 MB 記憶體）：
+- 同時執行數上限 HASH_WORKERS，排隊上限 HASH_QUEUE；滿了立即丟 HashingBusy，不再堆積
+- 呼叫端等待逾時 HASH_TIMEOUT 秒丟 HashingTimeout（尚未開始的工作會被取消）
+- stats() 回報排隊深度、執行中數量、拒絕 / 逾時次數與延遲統計
+argon2-cffi 計算時會釋放 GIL，因此執行緒池即可平行運算。
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as _FutureTimeout
+from typing import Any, Callable, Dict, Optional
+
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", 2))
+HASH_QUEUE = int(os.environ.get("HASH_QUEUE", 16))
+HASH_TIMEOUT = float(os.environ.get("HASH_TIMEOUT", 10.0))
+
+
+class HashingBusy(RuntimeError):
+    """雜湊佇列已滿，請求被拒絕（應回應「系統忙碌」）。"""
+
+
+class HashingTimeout(RuntimeError):
+    """等待雜湊結果逾時。"""
+
+
+class HashPool:
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE,
+                 timeout: float = HASH_TIMEOUT, samples: int = 512):
+        self.workers = max(1, int(workers))
+        self.queue_limit = max(0, int(queue_limit))
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+        self._lock = threading.Lock()
+        self._pending = 0      # 排隊 + 執行中
+        self._running = 0
+        self._counters = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+        self._wait_ms: deque = deque(maxlen=samples)   # 排隊時間
+        self._run_ms: deque = deque(maxlen=samples)    # 實際雜湊時間
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self._counters["rejected"] += 1
+                raise HashingBusy("password hashing queue is full")
+            self._pending += 1
+            self._counters["submitted"] += 1
+
+    def _task(self, fn: Callable[..., Any], args: tuple, enqueued: float) -> Any:
+        start = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._wait_ms.append((start - enqueued) * 1000.0)
+        try:
+            return fn(*args)
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._counters["completed"] += 1
+                self._run_ms.append((end - start) * 1000.0)
+
+    def run(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """在池中執行 fn(*args) 並等待結果；滿載丟 HashingBusy，逾時丟 HashingTimeout。"""
+        self._admit()
+        try:
+            fut = self._executor.submit(self._task, fn, args, time.perf_counter())
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        try:
+            return fut.result(timeout=self.timeout if timeout is None else timeout)
+        except _FutureTimeout:
+            if fut.cancel():  # 尚未開始：釋放名額
+                with self._lock:
+                    self._pending -= 1
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise HashingTimeout("password hashing timed out") from None
+        except Exception:
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            wait, run = sorted(self._wait_ms), sorted(self._run_ms)
+            out: Dict[str, Any] = {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                **self._counters,
+            }
+        for name, xs in (("wait_ms", wait), ("run_ms", run)):
+            out[f"{name}_p50"] = xs[len(xs) // 2] if xs else 0.0
+            out[f"{name}_p95"] = xs[min(len(xs) - 1, int(len(xs) * 0.95))] if xs else 0.0
+            out[f"{name}_max"] = xs[-1] if xs else 0.0
+        return out
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[HashPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> HashPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashPool()
+    return _pool
+
+
+def configure(workers: Optional[int] = None, queue_limit: Optional[int] = None,
+              timeout: Optional[float] = None) -> HashPool:
+    """重建雜湊池（例如依主機記憶體調整同時執行數）。"""
+    global _pool
+    with _pool_lock:
+        old = _pool
+        _pool = HashPool(
+            workers=HASH_WORKERS if workers is None else workers,
+            queue_limit=HASH_QUEUE if queue_limit is None else queue_limit,
+            timeout=HASH_TIMEOUT if timeout is None else timeout,
+        )
+    if old is not None:
+        old.shutdown()
+    return _pool
+
+
+def run(fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+    return get_pool().run(fn, *args, timeout=timeout)
+
+
+def stats() -> Dict[str, Any]:
+    return get_pool().stats()
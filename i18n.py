@@ -1,42 +1,206 @@
 # i18n.py
-import streamlit as st
-import yaml
+import json
+import re
+import string
+import sys
+import threading
+import time
 from pathlib import Path
 
+import streamlit as st
+
 DEFAULT_LANG = "zh-TW"
 SUPPORTED = ["zh-TW", "en"]
 
+# 以模組位置定位，不受啟動時 CWD 影響
+LOCALES_DIR = Path(__file__).resolve().parent / "locales"
+CACHE_DIR = LOCALES_DIR / "__pycache__"
+RELOAD_CHECK_INTERVAL = 2.0  # 秒；檢查 YAML mtime 的最短間隔
+CATALOG_FORMAT = 2           # 磁碟快取格式版本；結構改變時遞增
+
+# lang → {"table": {key: (text, parts) | list}, "stamp": (mtime_ns, size), "checked": 監看時間}
+# parts：編譯時以 string.Formatter().parse 拆好的模板；無欄位為 None。欄位都沒有格式規格時轉成
+#        "%(name)s" 字串（查詢時一次 % 運算），否則為 ((literal, field, spec, conversion), ...)
 _cache = {}
+_lock = threading.Lock()
+
+
+def _flatten(data, prefix=""):
+    """巢狀 dict 攤平成 "a.b.c" → 值；list 視為葉節點。"""
+    for k, v in (data or {}).items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            yield from _flatten(v, key + ".")
+        else:
+            yield key, v
+
+
+def _parse(text: str):
+    """
+    編譯 format 模板：沒有欄位或大括號不合法（當純文字）時回傳 None；
+    欄位皆為單純名稱（無 spec / 轉換）時回傳等價的 "%(name)s" 模板，否則回傳拆好的 parts。
+    """
+    try:
+        parts = tuple(string.Formatter().parse(text))
+    except ValueError:
+        return None
+    if all(field is None for _, field, _, _ in parts):
+        return None
+    if all(field is None or (field.isidentifier() and not spec and conv is None) for _, field, spec, conv in parts):
+        return "".join(literal.replace("%", "%%") + (f"%({field})s" if field is not None else "")
+                       for literal, field, spec, conv in parts)
+    return parts
+
+
+_CONVERT = {"r": repr, "s": str, "a": ascii}
+
+
+def _render(parts, kwargs) -> str:
+    out = []
+    for literal, field, spec, conv in parts:
+        out.append(literal)
+        if field is not None:
+            v = kwargs[field]
+            if conv:
+                v = _CONVERT[conv](v)
+            out.append(format(v, spec or ""))
+    return "".join(out)
+
+
+def _compile(data) -> dict:
+    table = {}
+    for key, v in _flatten(data):
+        if isinstance(v, list):
+            table[key] = v
+        else:
+            text = v if isinstance(v, str) else str(v)
+            table[key] = (text, _parse(text))
+    return table
+
+
+def _stamp(p: Path):
+    st_ = p.stat()
+    return (st_.st_mtime_ns, st_.st_size)
 
-def _load_lang(lang: str):
+
+def _read_disk_cache(lang: str, stamp):
+    p = CACHE_DIR / f"{lang}.i18n.json"
+    try:
+        blob = json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if blob.get("format") != CATALOG_FORMAT or tuple(blob.get("stamp", ())) != stamp:
+        return None
+    templates = blob["templates"]
+    table = {}
+    for k, v in blob["strings"].items():
+        tmpl = templates.get(k)
+        table[k] = (v, tuple(map(tuple, tmpl)) if isinstance(tmpl, list) else tmpl)
+    table.update(blob["lists"])
+    return table
+
+
+def _write_disk_cache(lang: str, stamp, table: dict) -> None:
+    blob = {
+        "format": CATALOG_FORMAT,
+        "stamp": list(stamp),
+        "strings": {k: v[0] for k, v in table.items() if isinstance(v, tuple)},
+        "templates": {k: v[1] for k, v in table.items() if isinstance(v, tuple) and v[1]},
+        "lists": {k: v for k, v in table.items() if isinstance(v, list)},
+    }
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        tmp = CACHE_DIR / f"{lang}.i18n.json.tmp"
+        tmp.write_text(json.dumps(blob, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(CACHE_DIR / f"{lang}.i18n.json")
+    except OSError:
+        pass  # 唯讀環境：僅用記憶體快取
+
+
+def build_catalog(lang: str) -> dict:
+    """由 YAML 編譯攤平後的查表（不經快取）。"""
+    import yaml  # 只有快取失效時才需要
+    with (LOCALES_DIR / f"{lang}.yaml").open("r", encoding="utf-8") as f:
+        return _compile(yaml.safe_load(f) or {})
+
+
+def _load_lang(lang: str) -> dict:
     lang = lang if lang in SUPPORTED else DEFAULT_LANG
-    if lang in _cache:
-        return _cache[lang]
-    p = Path("locales") / f"{lang}.yaml"
-    with p.open("r", encoding="utf-8") as f:
-        data = yaml.safe_load(f) or {}
-    _cache[lang] = data
-    return data
+    entry = _cache.get(lang)
+    now = time.monotonic()
+    if entry is not None and now - entry["checked"] < RELOAD_CHECK_INTERVAL:
+        return entry["table"]
+    with _lock:
+        entry = _cache.get(lang)
+        stamp = _stamp(LOCALES_DIR / f"{lang}.yaml")
+        if entry is None or entry["stamp"] != stamp:
+            table = _read_disk_cache(lang, stamp)
+            if table is None:
+                table = build_catalog(lang)
+                _write_disk_cache(lang, stamp, table)
+            entry = {"table": table, "stamp": stamp}
+        entry["checked"] = now
+        _cache[lang] = entry
+        return entry["table"]
+
 
 def set_lang(lang: str):
     st.session_state["lang"] = lang if lang in SUPPORTED else DEFAULT_LANG
 
+
 def get_lang() -> str:
     return st.session_state.get("lang", DEFAULT_LANG)
 
+
 def t(key: str, **kwargs):
-    data = _load_lang(get_lang())
-    cur = data
-    for part in key.split("."):
-        if isinstance(cur, dict) and part in cur:
-            cur = cur[part]
-        else:
-            return key
-    if isinstance(cur, list):
-        return cur
-    if isinstance(cur, str) and kwargs:
+    v = _load_lang(get_lang()).get(key)
+    if v is None:
+        return key
+    if isinstance(v, list):
+        return v
+    text, parts = v
+    if kwargs and parts:
         try:
-            return cur.format(**kwargs)
+            return parts % kwargs if isinstance(parts, str) else _render(parts, kwargs)
         except Exception:
-            return cur
-    return cur if isinstance(cur, str) else str(cur)
+            return text
+    return text
+
+
+# ---------- 建置期檢查：python i18n.py ----------
+_T_CALL = re.compile(r"""\bt\(\s*["']([A-Za-z0-9_.\-]+)["']""")
+
+
+def check(root: Path = None) -> list:
+    """
+    回傳問題清單：
+    - 各語系之間缺少的 key
+    - 程式碼中 t("...") 使用、但某語系沒有的 key
+    同時重建各語系的磁碟快取。
+    """
+    root = root or Path(__file__).resolve().parent
+    tables = {}
+    for lang in SUPPORTED:
+        stamp = _stamp(LOCALES_DIR / f"{lang}.yaml")
+        tables[lang] = build_catalog(lang)
+        _write_disk_cache(lang, stamp, tables[lang])
+    problems = []
+    all_keys = set().union(*tables.values())
+    for lang, table in tables.items():
+        for key in sorted(all_keys - set(table)):
+            problems.append(f"{lang}: missing key {key}")
+    for py in sorted(root.rglob("*.py")):
+        if "__pycache__" in py.parts or py.resolve() == Path(__file__).resolve():
+            continue
+        for key in sorted(set(_T_CALL.findall(py.read_text(encoding="utf-8")))):
+            for lang, table in tables.items():
+                if key not in table:
+                    problems.append(f"{py.relative_to(root)}: t({key!r}) not in {lang}")
+    return problems
+
+
+if __name__ == "__main__":
+    issues = check()
+    for line in issues:
+        print(line)
+    sys.exit(1 if issues else 0)
@@ -0,0 +1,346 @@
+# instrument.py
+"""
+熱路徑量測（選用，預設關閉）：
+- db.py 每個查詢：連線以 TracedConnection 建立，於 cursor 層記錄 SQL、筆數、耗時（含 fetch）
+- enrich_bp、圖表建立、密碼雜湊：timed() 裝飾器 / span() 區塊
+- 每次 rerun 彙總成一份 trace：頁面呼叫 begin_rerun() / sidebar_panel()；
+  結束時輸出一行 JSON 結構化 log（logger "healthhub.trace"），並累加到行程內計數器，
+  prometheus_text() 可輸出 Prometheus 文字格式（設定 HEALTHHUB_METRICS_FILE 時每次 rerun 寫檔，
+  供 node_exporter textfile collector 收集）
+關閉時每個量測點只多一次全域旗標檢查。
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_ENV_TRACE = os.environ.get("HEALTHHUB_TRACE", "") not in ("", "0", "false", "False")
+_enabled = _ENV_TRACE
+METRICS_FILE = os.environ.get("HEALTHHUB_METRICS_FILE", "")
+SQL_LABEL_MAX = 160
+
+log = logging.getLogger("healthhub.trace")
+if not log.handlers:
+    _h = logging.StreamHandler()
+    _h.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_h)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = bool(on)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+# ---------- 每次 rerun 的 trace（以執行緒區分：Streamlit 每個 session 在自己的執行緒跑腳本） ----------
+class Trace:
+    def __init__(self, page: str):
+        self.page = page
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.items: Dict[Tuple[str, str], List[float]] = {}  # (kind, name) → [次數, 筆數, 總 ms, 最大 ms]
+
+    def add(self, kind: str, name: str, ms: float, rows: Optional[int]) -> None:
+        it = self.items.get((kind, name))
+        if it is None:
+            self.items[(kind, name)] = [1, rows or 0, ms, ms]
+        else:
+            it[0] += 1
+            it[1] += rows or 0
+            it[2] += ms
+            it[3] = max(it[3], ms)
+
+    def summary(self) -> Dict[str, Any]:
+        rows = sorted(self.items.items(), key=lambda kv: -kv[1][2])
+        by_kind: Dict[str, float] = {}
+        for (kind, _), it in rows:
+            by_kind[kind] = by_kind.get(kind, 0.0) + it[2]
+        return {
+            "event": "rerun",
+            "page": self.page,
+            "ts": round(self.started_at, 3),
+            "rerun_ms": round((time.perf_counter() - self._t0) * 1000.0, 2),
+            "by_kind_ms": {k: round(v, 2) for k, v in by_kind.items()},
+            "items": [
+                {"kind": kind, "name": name, "count": int(it[0]), "rows": int(it[1]),
+                 "total_ms": round(it[2], 3), "max_ms": round(it[3], 3)}
+                for (kind, name), it in rows
+            ],
+        }
+
+
+_local = threading.local()
+
+# 行程累計：(kind, name) → [次數, 筆數, 秒]；page → [rerun 次數, 秒]
+_counters: Dict[Tuple[str, str], List[float]] = {}
+_reruns: Dict[str, List[float]] = {}
+_counters_lock = threading.Lock()
+
+
+def current() -> Optional[Trace]:
+    return getattr(_local, "trace", None)
+
+
+def record(kind: str, name: str, ms: float, rows: Optional[int] = None) -> None:
+    """記一筆量測：加入目前 rerun 的 trace 與行程累計計數器。"""
+    tr = getattr(_local, "trace", None)
+    if tr is not None:
+        tr.add(kind, name, ms, rows)
+    with _counters_lock:
+        c = _counters.setdefault((kind, name), [0, 0, 0.0])
+        c[0] += 1
+        c[1] += rows or 0
+        c[2] += ms / 1000.0
+
+
+def begin_rerun(page: str, enabled: Optional[bool] = None) -> None:
+    """
+    每頁最上方呼叫。enabled 不為 None 時順便切換開關（頁面傳入 DEBUG）；
+    HEALTHHUB_TRACE=1 時一律開啟，DEBUG 未設定不會把它關掉。
+    上一次 rerun 若因 st.stop() / st.rerun() 未走到 sidebar_panel()，在此補結算。
+    """
+    if enabled is not None:
+        enable(enabled or _ENV_TRACE)
+    end_rerun()
+    if _enabled:
+        _local.trace = Trace(page)
+
+
+def end_rerun() -> Optional[Dict[str, Any]]:
+    """結算目前 rerun：寫結構化 log、累加計數器；回傳摘要（沒有進行中的 trace 時回傳 None）。"""
+    tr = getattr(_local, "trace", None)
+    if tr is None:
+        return None
+    _local.trace = None
+    summary = tr.summary()
+    with _counters_lock:
+        r = _reruns.setdefault(tr.page, [0, 0.0])
+        r[0] += 1
+        r[1] += summary["rerun_ms"] / 1000.0
+    log.info(json.dumps(summary, ensure_ascii=False))
+    if METRICS_FILE:
+        write_textfile(METRICS_FILE)
+    return summary
+
+
+class _Span:
+    __slots__ = ("kind", "name", "rows", "_t0")
+
+    def __init__(self, kind: str, name: str, rows: Optional[int] = None):
+        self.kind, self.name, self.rows = kind, name, rows
+
+    def __enter__(self) -> "_Span":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        record(self.kind, self.name, (time.perf_counter() - self._t0) * 1000.0, self.rows)
+
+
+class _NullSpan:
+    __slots__ = ("rows",)
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL = _NullSpan()
+
+
+def span(kind: str, name: str, rows: Optional[int] = None):
+    """with span("chart", "timeseries") as s: ...；可在區塊內設定 s.rows。"""
+    return _Span(kind, name, rows) if _enabled else _NULL
+
+
+def timed(kind: str, name: Optional[str] = None, rows: Optional[Callable[[Any], int]] = None):
+    """函式裝飾器；rows 由回傳值計算筆數（例如 len）。"""
+    def deco(fn):
+        label = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            record(kind, label, (time.perf_counter() - t0) * 1000.0, rows(result) if rows else None)
+            return result
+        return wrapper
+    return deco
+
+
+# ---------- SQLite：cursor 層計時 ----------
+_WS = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def sql_label(sql: str) -> str:
+    """SQL 正規化成標籤：壓縮空白、IN (?, ?, …) 收成 (?…)，避免標籤數量爆增。"""
+    s = _IN_LIST.sub("(?…)", _WS.sub(" ", sql).strip())
+    return s if len(s) <= SQL_LABEL_MAX else s[:SQL_LABEL_MAX - 1] + "…"
+
+
+class TracedCursor(sqlite3.Cursor):
+    """
+    execute 與後續 fetch 的耗時、筆數合併記成同一筆查詢（fetch 完、close 或下一次 execute 時送出）。
+    直接迭代 cursor 不經過 fetch*，筆數無法計入；db.py 一律用 fetchone / fetchmany / fetchall。
+    """
+
+    _pending: Optional[list] = None  # [sql, 累計 ms, 筆數]
+
+    def _flush(self) -> None:
+        p = self._pending
+        if p is not None:
+            self._pending = None
+            record("sql", p[0], p[1], p[2])
+
+    def _run(self, method, sql, params):
+        self._flush()
+        t0 = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000.0
+            rows = self.rowcount if self.rowcount >= 0 else 0
+            self._pending = [sql_label(sql), ms, rows]
+            if self.description is None:  # 非 SELECT：沒有後續 fetch
+                self._flush()
+
+    def execute(self, sql, parameters=()):
+        if not _enabled:
+            return super().execute(sql, parameters)
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _enabled:
+            return super().executemany(sql, seq_of_parameters)
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def _fetch(self, method, *args):
+        t0 = time.perf_counter()
+        result = method(*args)
+        p = self._pending
+        if p is not None:
+            p[1] += (time.perf_counter() - t0) * 1000.0
+            if isinstance(result, list):
+                p[2] += len(result)
+                if not result or method.__name__ == "fetchall":
+                    self._flush()
+            else:  # fetchone 多半是單列查詢：立即送出，之後的 fetchone 不再計
+                p[2] += result is not None
+                self._flush()
+        return result
+
+    def fetchone(self):
+        if self._pending is None:
+            return super().fetchone()
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        sup = super().fetchmany
+        if self._pending is None:
+            return sup() if size is None else sup(size)
+        return self._fetch(sup) if size is None else self._fetch(sup, size)
+
+    def fetchall(self):
+        if self._pending is None:
+            return super().fetchall()
+        return self._fetch(super().fetchall)
+
+    def close(self):
+        self._flush()
+        super().close()
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.connect(..., factory=TracedConnection)：所有 execute 都經過 TracedCursor。"""
+
+    # 關閉時直接走原生 cursor / execute，不經 Python 層
+    def cursor(self, factory=None):
+        if factory is None:
+            return super().cursor(TracedCursor) if _enabled else super().cursor()
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if not _enabled:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _enabled:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ---------- 輸出 ----------
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    """行程累計計數器（Prometheus 文字格式）。"""
+    with _counters_lock:
+        ops = sorted(_counters.items())
+        reruns = sorted(_reruns.items())
+    lines = [
+        "# HELP healthhub_ops_total Instrumented operations (sql / enrich / chart / hash).",
+        "# TYPE healthhub_ops_total counter",
+    ]
+    lines += [f'healthhub_ops_total{{kind="{k}",name="{_esc(n)}"}} {int(c[0])}' for (k, n), c in ops]
+    lines += ["# HELP healthhub_op_rows_total Rows returned or affected.",
+              "# TYPE healthhub_op_rows_total counter"]
+    lines += [f'healthhub_op_rows_total{{kind="{k}",name="{_esc(n)}"}} {int(c[1])}' for (k, n), c in ops]
+    lines += ["# HELP healthhub_op_seconds_total Wall time spent.",
+              "# TYPE healthhub_op_seconds_total counter"]
+    lines += [f'healthhub_op_seconds_total{{kind="{k}",name="{_esc(n)}"}} {c[2]:.6f}' for (k, n), c in ops]
+    lines += ["# HELP healthhub_reruns_total Script reruns per page.",
+              "# TYPE healthhub_reruns_total counter"]
+    lines += [f'healthhub_reruns_total{{page="{_esc(p)}"}} {int(r[0])}' for p, r in reruns]
+    lines += ["# HELP healthhub_rerun_seconds_total Script rerun wall time per page.",
+              "# TYPE healthhub_rerun_seconds_total counter"]
+    lines += [f'healthhub_rerun_seconds_total{{page="{_esc(p)}"}} {r[1]:.6f}' for p, r in reruns]
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, path)
+    except OSError:
+        log.warning("cannot write metrics file %s", path)
+
+
+def sidebar_panel(top: int = 15) -> None:
+    """結算本次 rerun，並在側欄顯示 trace（只在啟用時顯示；頁面最下方呼叫）。"""
+    summary = end_rerun()
+    if summary is None:
+        return
+    import streamlit as st
+    with st.sidebar.expander(f"⏱ Rerun trace — {summary['rerun_ms']:.0f} ms", expanded=False):
+        st.caption(" · ".join(f"{k} {v:.1f} ms" for k, v in summary["by_kind_ms"].items()) or "—")
+        lines = ["| kind | name | n | rows | total ms | max ms |", "|---|---|---:|---:|---:|---:|"]
+        for it in summary["items"][:top]:
+            name = it["name"].replace("|", "\\|")
+            lines.append(f"| {it['kind']} | `{name}` | {it['count']} | {it['rows']} | "
+                         f"{it['total_ms']:.2f} | {it['max_ms']:.2f} |")
+        st.markdown("\n".join(lines))
+        if len(summary["items"]) > top:
+            st.caption(f"… {len(summary['items']) - top} more")
+        if st.toggle("Prometheus counters", key="_trace_prom"):
+            st.code(prometheus_text(), language="text")
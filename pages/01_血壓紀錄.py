@@ -1,15 +1,24 @@
 # pages/01_血壓紀錄.py
+import re
+import sqlite3
 import streamlit as st
 import pandas as pd
 import altair as alt
-from datetime import datetime
+from datetime import datetime, timedelta
 from utils import (
-    init_state, TZ, export_csv, default_cfg_bp, enrich_bp
+    init_state, TZ, default_cfg_bp, BP_CATEGORIES,
+    CHART_MAX_POINTS, downsample, enrich_bp
 )
 from i18n import t, get_lang
+import analytics
 import db
+import cache
+import export
+import instrument
+import writer
 
 st.set_page_config(page_title=t("bp.page_title"), page_icon="🩺", layout="wide")
+instrument.begin_rerun("01_bp", enabled=bool(st.secrets.get("DEBUG", False)))
 init_state()
 db.init_db()
 
@@ -21,15 +30,22 @@ require_login()
 USER_ID = st.session_state["user"]["id"]
 
 # ── 安全：文字淨化與長度限制
+BANNED = ["<script", "</", "javascript:", "data:", "vbscript:", "onerror", "onload", "http://", "https://"]
+
 def sanitize_text(s: str | None, max_len=120) -> str:
     if not s: return ""
     s = str(s).strip()[:max_len]
     low = s.lower()
-    banned = ["<script", "</", "javascript:", "data:", "vbscript:", "onerror", "onload", "http://", "https://"]
-    if any(b in low for b in banned):
+    if any(b in low for b in BANNED):
         return "[redacted]"
     return s
 
+def sanitize_series(s: pd.Series, max_len=120) -> pd.Series:
+    """sanitize_text 的整欄版本。"""
+    s = s.fillna("").astype(str).str.strip().str[:max_len]
+    hit = s.str.lower().str.contains("|".join(re.escape(b) for b in BANNED), regex=True)
+    return s.mask(hit, "[redacted]")
+
 # 側欄：設定/匯出
 with st.sidebar:
     st.header("⚙️ 設定")
@@ -43,15 +59,16 @@ with st.sidebar:
 
     st.divider()
     st.subheader(t("bp.export_csv"))
-    # 直接提供下載按鈕（不經 st.button），檔名包含時間戳
-    df_all = db.list_bp(USER_ID)
-    if not df_all.empty:
-        ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    # 直接提供下載按鈕（不經 st.button），檔名包含時間戳；按下時才由 SQLite 分批串流匯出
+    if not cache.list_bp(USER_ID).empty:
+        fmt = st.selectbox("Format", export.available_formats(), key="export_fmt")
+        data, name, mime = export.deferred_export(USER_ID, fmt)
         st.download_button(
             label=t("bp.export_csv"),
-            data=df_all.to_csv(index=False).encode("utf-8"),
-            file_name=f"blood_pressure_{ts}.csv",
-            mime="text/csv",
+            data=data,
+            file_name=name,
+            mime=mime,
+            on_click="ignore",
             use_container_width=True
         )
 
@@ -78,30 +95,34 @@ with st.expander(t("bp.add_panel"), expanded=True):
             local_dt = TZ.localize(datetime.combine(d, tv)) if getattr(TZ, 'localize', None) else datetime.combine(d, tv).astimezone(TZ)
             utc_dt = local_dt.astimezone(pd.Timestamp.utcnow().tz)
             dt_iso = utc_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-            db.add_bp(USER_ID, {
-                "datetime": dt_iso,
-                "systolic": float(sys), "diastolic": float(dia), "pulse": float(pulse),
-                "meds": meds, "note": note
-            })
-            st.success("Added!")
-            st.rerun()  # 立刻刷新
+            # 經由單一寫入執行緒（與其他 session 的寫入合併 commit），等待 commit 完成再刷新
+            try:
+                writer.call(db.add_bp, USER_ID, {
+                    "datetime": dt_iso,
+                    "systolic": float(sys), "diastolic": float(dia), "pulse": float(pulse),
+                    "meds": meds, "note": note
+                })
+            except sqlite3.IntegrityError as e:
+                if "UNIQUE" not in str(e):
+                    raise
+                # 同一時間、同一組讀值已存在（例如重送表單）：不新增、不改動既有備註
+                st.warning(t("common.already_exists"))
+            else:
+                st.success(t("common.added"))
+                st.rerun()  # 立刻刷新
 
-# 取資料（僅此用戶）
-raw_df = db.list_bp(USER_ID)
-if raw_df.empty:
+# 取資料（僅此用戶）；資料未變動時直接命中快取，不重查、不重算。
+# datetime 已解析為 UTC Timestamp 並依時間排序，含衍生欄位（pp、map、category 等）；
+# 同一位使用者的所有 session 共用這一份物件，勿就地修改，也不另做整份複本
+df = cache.enriched_bp(USER_ID)
+if df.empty:
     st.info(t("bp.no_data"))
     st.stop()
 
-# 將 datetime 解析為帶時區的 Timestamp（UTC → 本地顯示時再轉）
-df = raw_df.copy()
-df["datetime"] = pd.to_datetime(df["datetime"], utc=True, errors="coerce")
-df = enrich_bp(df)  # 你原有的衍生欄位（pp、map、category 等）
-
 # —— 篩選（允許任意日期；預設起日 = 資料最早日期） ——
 st.subheader(t("bp.filter"))
-df_dt = df["datetime"].dt.tz_convert(TZ)
-min_date = df_dt.dropna().min().date()
-max_date = df_dt.dropna().max().date()
+min_date = df["datetime"].iat[0].tz_convert(TZ).date()
+max_date = df["datetime"].iat[-1].tz_convert(TZ).date()
 default_start = min_date
 
 c1, c2 = st.columns(2)
@@ -113,89 +134,180 @@ with c2:
 if start > end:
     start, end = end, start
 
-mask = (df_dt.dt.date >= start) & (df_dt.dt.date <= end)
-view = df.loc[mask].copy()
+# 本地日區間 → UTC 秒邊界；df 依時間排序，以二分搜尋取連續切片（不建遮罩、不複製）
+lo_ts = int(pd.Timestamp(start).tz_localize(TZ).timestamp())
+hi_ts = int(pd.Timestamp(end + timedelta(days=1)).tz_localize(TZ).timestamp()) - 1
+i, j = df["datetime"].searchsorted([pd.Timestamp(lo_ts, unit="s", tz="UTC"),
+                                    pd.Timestamp(hi_ts + 1, unit="s", tz="UTC")])
+view = df.iloc[i:j]
 if view.empty:
     st.warning(t("bp.no_view"))
     st.stop()
 
-# 指標摘要
+# 指標摘要：滾動統計（analytics）依資料版本快取，截止日 = 篩選區間內最新一筆所在的本地日；
+# 類別分布等仍讀 bp_daily 日彙總（本地日），不重掃原始紀錄
 st.subheader(t("bp.summary"))
-last7  = view[view["datetime"] >= (view["datetime"].max() - pd.Timedelta(days=7))]
-last30 = view[view["datetime"] >= (view["datetime"].max() - pd.Timedelta(days=30))]
+cfg = st.session_state.cfg["blood_pressure"]
+daily = db.bp_daily(USER_ID, start.isoformat(), end.isoformat())
+last_day = view["datetime"].iat[-1].tz_convert(TZ).date()
+stats = analytics.summary(cache.analytics_daily(USER_ID, cfg["target_sys"], cfg["target_dia"]), last_day)
+
+
+def hit_rate(days: int) -> float:
+    """篩選區間內、截至 last_day 的最近 days 個本地日的達標率（不跨出起始日）。"""
+    lo = max(last_day - timedelta(days=days - 1), start)
+    k = view["datetime"].searchsorted(pd.Timestamp(lo).tz_localize(TZ))
+    w = view.iloc[k:]
+    return 100.0 * float(((w["systolic"] < cfg["target_sys"]) & (w["diastolic"] < cfg["target_dia"])).mean())
 
-def hit_rate(sub):
-    if len(sub) == 0: return 0.0
-    cfg = st.session_state.cfg["blood_pressure"]
-    return 100.0 * ((sub["systolic"] < cfg["target_sys"]) & (sub["diastolic"] < cfg["target_dia"])).mean()
 
 cA, cB, cC = st.columns(3)
-with cA: st.metric(t("bp.hit7"), f"{hit_rate(last7):.1f}%")
-with cB: st.metric(t("bp.hit30"), f"{hit_rate(last30):.1f}%")
+with cA: st.metric(t("bp.hit7"), f"{hit_rate(7):.1f}%")
+with cB: st.metric(t("bp.hit30"), f"{hit_rate(30):.1f}%")
 with cC:
     latest = view.iloc[-1]
     st.metric(t("bp.latest_reading"), f"{int(latest['systolic'])}/{int(latest['diastolic'])} mmHg", f"Pulse {int(latest['pulse'])} bpm")
 
-# 類別分布
-cat_counts = view["category"].value_counts().reset_index()
-cat_counts.columns = ["category","count"]
-st.altair_chart(
-    alt.Chart(cat_counts).mark_bar().encode(
-        x=alt.X("category:N", title=t("bp.cat_chart_title")),
-        y=alt.Y("count:Q", title="Count"),
-        tooltip=["category","count"]
-    ),
-    use_container_width=True
-)
+with st.expander(t("bp.stats_title")):
+    st.dataframe(
+        stats.rename(index=lambda d: t("bp.stats_days", n=d)).rename(columns={
+            "n": "n",
+            "sys_mean": t("bp.systolic_short"), "dia_mean": t("bp.diastolic_short"), "pulse_mean": t("bp.pulse_short"),
+            "hit_rate": t("bp.stats_hit"),
+            "sys_am": t("bp.stats_sys_am"), "dia_am": t("bp.stats_dia_am"),
+            "sys_pm": t("bp.stats_sys_pm"), "dia_pm": t("bp.stats_dia_pm"),
+            "sys_sd": "SYS SD", "dia_sd": "DIA SD", "sys_arv": "SYS ARV", "dia_arv": "DIA ARV",
+            "sys_slope": t("bp.stats_sys_slope"), "dia_slope": t("bp.stats_dia_slope"),
+        }).round(1),
+        use_container_width=True
+    )
+    st.caption(t("bp.stats_caption"))
+
+# 類別分布（由日彙總加總）
+cat_counts = pd.DataFrame({
+    "category": BP_CATEGORIES,
+    "count": [int(daily[c].sum()) for c in ("n_normal", "n_elevated", "n_stage1", "n_stage2", "n_unknown")],
+})
+cat_counts = cat_counts[cat_counts["count"] > 0].sort_values("count", ascending=False, kind="mergesort")
+with instrument.span("chart", "category_bar", rows=len(cat_counts)):
+    st.altair_chart(
+        alt.Chart(cat_counts).mark_bar().encode(
+            x=alt.X("category:N", title=t("bp.cat_chart_title")),
+            y=alt.Y("count:Q", title="Count"),
+            tooltip=["category","count"]
+        ),
+        use_container_width=True
+    )
+
+# 時間序列解析度依日期區間決定：
+# - ≤ 1 年：原始紀錄，以 LTTB 降採樣到每條序列 max_points 點
+# - 更長：日彙總（超過 max_points 天再改週彙總），畫平均線 + min–max 色帶保留峰值
+LONG_RANGE_DAYS = 366
+max_points = int(st.secrets.get("CHART_MAX_POINTS", CHART_MAX_POINTS))
+aggregated = (end - start).days > LONG_RANGE_DAYS
+if aggregated:
+    agg = daily
+    if len(agg) > max_points:
+        agg = db.bp_weekly(USER_ID, (start - timedelta(days=start.weekday())).isoformat(), end.isoformat())
+        agg = agg.rename(columns={"week": "day"})
+    agg_dt = pd.to_datetime(agg["day"]).dt.tz_localize(TZ)
+    long = pd.concat([
+        pd.DataFrame({"datetime": agg_dt, "type": v, "mmHg": agg[f"{p}_mean"],
+                      "lo": agg[f"{p}_min"], "hi": agg[f"{p}_max"], "n": agg["n"]})
+        for v, p in (("systolic", "sys"), ("diastolic", "dia"))
+    ], ignore_index=True)
+    pulse_src = pd.DataFrame({"datetime": agg_dt, "pulse": agg["pulse_mean"]})
+    extra_tooltip = [alt.Tooltip("lo:Q", title="min"), alt.Tooltip("hi:Q", title="max"), alt.Tooltip("n:Q", title="n")]
+else:
+    # 每條序列各自降採樣後才組成長表，不對整段區間 melt 出兩倍長的中間表
+    long = pd.concat([
+        downsample(view[["datetime", "category", v]], "datetime", v, max_points=max_points)
+        .rename(columns={v: "mmHg"}).assign(type=v)
+        for v in ("systolic", "diastolic")
+    ], ignore_index=True)
+    pulse_src = downsample(view[["datetime", "pulse"]], "datetime", "pulse", max_points=max_points)
+    extra_tooltip = ["category"]
 
 # 收縮/舒張壓時間序列 + 目標線
 st.subheader(t("bp.ts_title"))
-long = view.melt(
-    id_vars=["datetime","category","cat_level"],
-    value_vars=["systolic","diastolic"],
-    var_name="type", value_name="mmHg"
-)
 rules = pd.DataFrame({
     "label": [t("bp.target_sys"), t("bp.target_dia")],
     "type":  ["systolic", "diastolic"],
     "mmHg":  [st.session_state.cfg["blood_pressure"]["target_sys"],
               st.session_state.cfg["blood_pressure"]["target_dia"]],
 })
-line = alt.Chart(long).mark_line(point=True).encode(
+line = alt.Chart(long).mark_line(point=not aggregated).encode(
     x=alt.X("datetime:T", title="Time"),
     y=alt.Y("mmHg:Q", title="mmHg"),
     color=alt.Color("type:N", title="Type"),
     tooltip=[alt.Tooltip("datetime:T", title="Time"),
              alt.Tooltip("type:N", title="Type"),
              alt.Tooltip("mmHg:Q", title="mmHg"),
-             "category"]
+             *extra_tooltip]
 )
 rule = alt.Chart(rules).mark_rule(strokeDash=[4,4]).encode(
     y="mmHg:Q",
     color=alt.Color("type:N", legend=None),
     tooltip=["label","mmHg"]
 )
-st.altair_chart((line + rule).interactive(), use_container_width=True)
+layers = line + rule
+if aggregated:
+    band = alt.Chart(long).mark_area(opacity=0.2).encode(
+        x="datetime:T", y="lo:Q", y2="hi:Q", color=alt.Color("type:N", legend=None)
+    )
+    layers = band + layers
+with instrument.span("chart", "bp_timeseries", rows=len(long)):
+    st.altair_chart(layers.interactive(), use_container_width=True)
 
 # 心跳
 st.subheader(t("bp.hr_title"))
-st.altair_chart(
-    alt.Chart(view).mark_line(point=True).encode(
-        x=alt.X("datetime:T", title="Time"),
-        y=alt.Y("pulse:Q", title="bpm"),
-        tooltip=[alt.Tooltip("datetime:T"), alt.Tooltip("pulse:Q")]
-    ).interactive(),
-    use_container_width=True
-)
+with instrument.span("chart", "pulse_timeseries", rows=len(pulse_src)):
+    st.altair_chart(
+        alt.Chart(pulse_src).mark_line(point=not aggregated).encode(
+            x=alt.X("datetime:T", title="Time"),
+            y=alt.Y("pulse:Q", title="bpm"),
+            tooltip=[alt.Tooltip("datetime:T"), alt.Tooltip("pulse:Q")]
+        ).interactive(),
+        use_container_width=True
+    )
+
+# —— 明細表 / 編輯器：keyset 分頁，只向 DB 取目前這一頁、只格式化這一頁 ——
+# 分頁狀態：(篩選區間, 游標, 方向)；篩選區間改變時回到第一頁
+page_range = (start.isoformat(), end.isoformat())
+pager = st.session_state.get("bp_pager")
+if pager is None or pager["range"] != page_range:
+    pager = st.session_state["bp_pager"] = {"range": page_range, "cursor": None, "backward": False}
+
+def goto_page(cursor, backward: bool) -> None:
+    st.session_state["bp_pager"] = {"range": page_range, "cursor": cursor, "backward": backward}
+
+page_size = st.session_state.get("bp_page_size", db.PAGE_SIZE)
+page, more = db.list_bp_page(USER_ID, lo_ts, hi_ts, pager["cursor"], pager["backward"], page_size)
+if page.empty and pager["cursor"] is not None:
+    # 游標之後的資料已被刪除：往反方向回到頭 / 尾頁
+    goto_page(None, not pager["backward"])
+    pager = st.session_state["bp_pager"]
+    page, more = db.list_bp_page(USER_ID, lo_ts, hi_ts, None, pager["backward"], page_size)
+if pager["backward"]:
+    has_prev, has_next = more, pager["cursor"] is not None
+else:
+    has_prev, has_next = pager["cursor"] is not None, more
 
-# 明細表（本地時區顯示）
 st.subheader(t("bp.table_title"))
-disp = view.copy()
+n1, n2, n3, n4, n5 = st.columns([1, 1, 1, 1, 2])
+n1.button("⏮", on_click=goto_page, args=(None, False), disabled=not has_prev, key="pg_first")
+n2.button("◀", on_click=goto_page, args=(db.page_cursor(page, last=False), True), disabled=not has_prev, key="pg_prev")
+n3.button("▶", on_click=goto_page, args=(db.page_cursor(page), False), disabled=not has_next, key="pg_next")
+n4.button("⏭", on_click=goto_page, args=(None, True), disabled=not has_next, key="pg_last")
+n5.selectbox("Rows / page", [25, 50, 100, 200], key="bp_page_size",
+             index=[25, 50, 100, 200].index(page_size) if page_size in (25, 50, 100, 200) else 1)
+
+# 明細表（本地時區顯示）；pp / map / category 只對這一頁計算
+disp = enrich_bp(page)
 label_dt = "日期時間" if get_lang()=="zh-TW" else "Datetime"
-disp[label_dt] = disp["datetime"].dt.tz_convert(TZ).dt.strftime("%Y-%m-%d %H:%M")
-disp = disp[["id", label_dt, "systolic", "diastolic", "pulse", "pp", "map", "category", "meds", "note"]]
+disp.insert(1, label_dt, disp.pop("datetime").dt.tz_convert(TZ).dt.strftime("%Y-%m-%d %H:%M"))
 st.dataframe(
-    disp.rename(columns={
+    disp[["id", label_dt, "systolic", "diastolic", "pulse", "pp", "map", "category", "meds", "note"]].rename(columns={
         "systolic": t("bp.systolic_short"),
         "diastolic": t("bp.diastolic_short"),
         "pulse": t("bp.pulse_short"),
@@ -208,11 +320,10 @@ st.dataframe(
     use_container_width=True, hide_index=True
 )
 
-# 編輯/刪除
+# 編輯/刪除（僅目前這一頁；每頁各自的編輯狀態，儲存時只寫入這一頁的變更）
 st.subheader("📝 編輯 / 刪除")
-edit_df = view[["id","datetime","systolic","diastolic","pulse","meds","note"]].copy()
-# 編輯用字串（本地時區可視需求轉換；此處維持 ISO UTC 字串以避免混亂）
-edit_df["datetime"] = pd.to_datetime(edit_df["datetime"], utc=True).dt.strftime("%Y-%m-%d %H:%M:%S")
+# 編輯用字串（本地時區可視需求轉換；此處維持 ISO UTC 字串以避免混亂）；assign 產生新 frame，不改動 page
+edit_df = page.assign(datetime=page["datetime"].dt.strftime("%Y-%m-%d %H:%M:%S"))
 edited = st.data_editor(
     edit_df, num_rows="fixed", hide_index=True, use_container_width=True,
     column_config={
@@ -224,7 +335,7 @@ edited = st.data_editor(
         "meds": st.column_config.TextColumn("Medication"),
         "note": st.column_config.TextColumn("Note"),
     },
-    key="editor_bp"
+    key=f"editor_bp_{pager['cursor']}_{pager['backward']}_{page_size}"
 )
 
 c1, c2 = st.columns(2)
@@ -239,27 +350,33 @@ with c1:
             (merged["meds"]      != merged["meds_old"]) |
             (merged["note"]      != merged["note_old"])
         ]
-        for _, r in changed.iterrows():
-            # 重新淨化
-            meds_upd = sanitize_text(r["meds"] or "", max_len=50)
-            note_upd = sanitize_text(r["note"] or "", max_len=120)
-            # 轉回 ISO UTC
+        if not changed.empty:
+            # 整欄淨化 / 轉回 UTC；無法解析的時間為 NaT：列出這些 ID、整批不寫入（不可當成未變更而顯示已儲存）
+            new_dt = pd.to_datetime(changed["datetime"], utc=True, errors="coerce", format="mixed")
+            bad_ids = changed.loc[new_dt.isna().to_numpy(), "id"].astype(int).tolist()
+            if bad_ids:
+                st.error(f"以下 ID 的時間無法解析（格式 YYYY-MM-DD HH:MM:SS），未儲存：{', '.join(map(str, bad_ids))}")
+                st.stop()
+            upd = pd.DataFrame({
+                "id": changed["id"].astype(int),
+                "datetime": new_dt,
+                "systolic": changed["systolic"].astype(float),
+                "diastolic": changed["diastolic"].astype(float),
+                "pulse": changed["pulse"].astype(float),
+                "meds": sanitize_series(changed["meds"], max_len=50),
+                "note": sanitize_series(changed["note"], max_len=120),
+            })
             try:
-                dt_utc = pd.to_datetime(r["datetime"], utc=True, errors="coerce")
-                dt_iso = dt_utc.strftime("%Y-%m-%dT%H:%M:%SZ") if pd.notna(dt_utc) else None
-            except Exception:
-                dt_iso = None
-            fields = {}
-            if dt_iso: fields["datetime"] = dt_iso
-            fields["systolic"]  = float(r["systolic"])
-            fields["diastolic"] = float(r["diastolic"])
-            fields["pulse"]     = float(r["pulse"])
-            fields["meds"]      = meds_upd
-            fields["note"]      = note_upd
-            db.update_bp(USER_ID, int(r["id"]), fields)
+                writer.call(db.update_bp_many, USER_ID, upd)
+            except sqlite3.IntegrityError:
+                # 改完後與另一筆的時間與讀值完全相同（自然鍵重複）：整批不寫入
+                st.error("變更後與既有紀錄重複（同一時間、同一組讀值），未儲存。")
+                st.stop()
         st.success("已儲存變更。")
 with c2:
     to_del = st.multiselect("勾選欲刪除的列（ID）", options=edited["id"].tolist())
     if st.button("刪除勾選列") and to_del:
-        db.delete_bp(USER_ID, [int(x) for x in to_del])
+        writer.call(db.delete_bp, USER_ID, [int(x) for x in to_del])
         st.success(f"已刪除 {len(to_del)} 筆。")
+
+instrument.sidebar_panel()
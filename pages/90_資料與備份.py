@@ -1,10 +1,13 @@
 # pages/90_資料與備份.py
 import streamlit as st
-import pandas as pd
-from utils import export_csv
 import db
+import export
+import instrument
+import writer
+from utils import normalize_bp_csv
 
 st.set_page_config(page_title="📦 Data & Backup", page_icon="📦", layout="wide")
+instrument.begin_rerun("90_data", enabled=bool(st.secrets.get("DEBUG", False)))
 db.init_db()
 
 def require_login():
@@ -17,49 +20,61 @@ USER_ID = st.session_state["user"]["id"]
 st.title("📦 Data & Backup")
 
 st.subheader("Export my data")
-df_all = db.list_bp(USER_ID)
-st.download_button("Download BP CSV", data=export_csv(df_all), file_name="blood_pressure.csv", mime="text/csv")
+fmt = st.selectbox("Format", export.available_formats(), key="export_fmt")
+data, name, mime = export.deferred_export(USER_ID, fmt)  # 按下下載時才匯出
+st.download_button("Download BP data", data=data, file_name=name, mime=mime, on_click="ignore")
 
 st.divider()
 st.subheader("Import CSV (columns: datetime or date+time, systolic, diastolic, pulse, meds, note)")
 up = st.file_uploader("Choose CSV", type=["csv"])
 if up and st.button("Import"):
+    import pandas as pd  # 只有匯入時才需要
     try:
-        raw = pd.read_csv(up)
-        # 自動對應欄位（與 01_頁面相同邏輯）
-        candidate_cols = {c.lower(): c for c in raw.columns}
-        def pick(*names):
-            for n in names:
-                if n in candidate_cols: return candidate_cols[n]
-            return None
-        out = pd.DataFrame()
-        if pick("datetime","日期時間"):
-            out["datetime"] = pd.to_datetime(raw[pick("datetime","日期時間")], errors="coerce")
-        else:
-            dcol, tcol = pick("date","日期"), pick("time","時間")
-            out["datetime"] = pd.to_datetime(raw[dcol] + " " + raw[tcol], errors="coerce") if dcol and tcol else pd.NaT
-        out["systolic"]  = pd.to_numeric(raw.get(pick("systolic","收縮壓","sys"), pd.NA), errors="coerce")
-        out["diastolic"] = pd.to_numeric(raw.get(pick("diastolic","舒張壓","dia"), pd.NA), errors="coerce")
-        out["pulse"]     = pd.to_numeric(raw.get(pick("pulse","心跳","hr","脈搏"), pd.NA), errors="coerce")
-        out["meds"]      = raw.get(pick("meds","服藥"), "")
-        out["note"]      = raw.get(pick("note","備註"), "")
-        out = out.dropna(subset=["datetime","systolic","diastolic","pulse"])
-        for _, r in out.iterrows():
-            db.add_bp(USER_ID, {
-                "datetime": pd.to_datetime(r["datetime"]).strftime("%Y-%m-%d %H:%M:%S"),
-                "systolic": float(r["systolic"]),
-                "diastolic": float(r["diastolic"]),
-                "pulse": float(r["pulse"]),
-                "meds": str(r.get("meds","")) if pd.notna(r.get("meds","")) else "",
-                "note": str(r.get("note","")) if pd.notna(r.get("note","")) else "",
-            })
-        st.success(f"Imported {len(out)} rows.")
+        out = normalize_bp_csv(pd.read_csv(up))
+        # 以自然鍵（時間 + 讀值）批次 upsert：重複匯入同一份檔案不會產生重複紀錄
+        res = writer.call(db.import_bp, USER_ID, out)
+        st.success(f"Imported {len(out)} rows: {res['inserted']} inserted, "
+                   f"{res['updated']} updated, {res['skipped']} skipped (already present).")
     except Exception as e:
         st.error(f"Import failed: {e}")
 
 st.divider()
 st.subheader("Reset my data (irreversible)")
 if st.button("Delete ALL my BP records", type="secondary"):
-    ids = db.list_bp(USER_ID)["id"].tolist()
-    db.delete_bp(USER_ID, ids)
+    writer.call(db.delete_all_bp, USER_ID)
     st.success("Deleted.")
+
+# 整個資料庫的線上備份 / 還原：僅 secrets 的 ADMIN_EMAILS 名單可見
+if st.session_state["user"].get("email") in st.secrets.get("ADMIN_EMAILS", []):
+    import backup  # 只有管理員才需要
+    st.divider()
+    st.subheader("Database backup (admin)")
+    st.caption(f"Directory: {backup.backup_dir()}")
+    if st.button("Back up now"):
+        info = backup.create_backup()
+        st.success(f"{info['file']}  ({info['bytes']:,} bytes, {info['seconds']} s, sha256 {info['sha256'][:12]}…)")
+    if backup.last_result:
+        st.caption(f"Last scheduled backup: {backup.last_result.get('file') or backup.last_result.get('error')}")
+    backups = backup.list_backups()
+    if backups:
+        st.dataframe([{k: b[k] for k in ("file", "created", "bytes", "schema_version")} for b in backups],
+                     use_container_width=True, hide_index=True)
+        chosen = st.selectbox("Backup", [b["path"] for b in backups], format_func=lambda p: p.rsplit("/", 1)[-1])
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button("Verify"):
+                try:
+                    backup.verify_backup(chosen)
+                    st.success("Checksums, integrity_check and row counts OK.")
+                except backup.BackupError as e:
+                    st.error(f"Verification failed: {e}")
+        with c2:
+            confirm = st.checkbox("I understand this replaces the whole database")
+            if st.button("Restore", type="secondary", disabled=not confirm):
+                try:
+                    backup.restore_backup(chosen)
+                    st.success("Restored.")
+                except backup.BackupError as e:
+                    st.error(f"Restore aborted: {e}")
+
+instrument.sidebar_panel()
@@ -0,0 +1,288 @@
+# storage.py
+"""
+讀取端儲存後端：db.list_bp 的區間掃描交給這裡選定的後端，寫入一律走 SQLite（db.py）。
+- sqlite ：預設；pd.read_sql_query 逐列讀取
+- parquet：每位使用者一個 Parquet 鏡像目錄（需 pyarrow）：base 檔 + 依 db 同步序號（bp_sync.seq）追加的
+           delta 檔，定期合併；以 pyarrow 欄式讀取 + ts 篩選（row group 統計略過不相干區段），
+           不經 tuple → DataFrame 轉換
+
+後端由環境變數 HEALTHHUB_READ_BACKEND 選擇（預設 sqlite），或執行期呼叫 set_backend()。
+兩者輸出必須一致（欄位 id, ts, systolic, diastolic, pulse, meds, note，依 (ts, id) 排序），
+一致性檢查見 tests/test_storage.py。
+"""
+from __future__ import annotations
+import os
+import threading
+import warnings
+from pathlib import Path
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+BP_SCAN_COLUMNS = ["id", "ts", "systolic", "diastolic", "pulse", "meds", "note"]
+MIRROR_DIR_ENV = "HEALTHHUB_MIRROR_DIR"
+ROW_GROUP_ROWS = 64 * 1024
+
+
+class SqliteBackend:
+    """預設後端：直接查 SQLite（走 (user_id, ts) 索引）。"""
+    name = "sqlite"
+
+    def scan_bp(self, user_id: int, lo: Optional[int] = None, hi: Optional[int] = None) -> "pd.DataFrame":
+        import pandas as pd
+        import db
+        sql = f"SELECT {', '.join(BP_SCAN_COLUMNS)} FROM blood_pressure WHERE user_id = ?"
+        params: List = [user_id]
+        if lo is not None and hi is not None:
+            sql += " AND ts BETWEEN ? AND ?"
+            params += [lo, hi]
+        sql += " ORDER BY ts, id"
+        with db.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+
+class ParquetMirror:
+    """
+    SQLite 的欄式鏡像：<mirror_dir>/user_<id>/ 下一個 base_<seq>.parquet（依 (ts, id) 排序）
+    加上一串 delta_<from>_<to>.parquet（from → to 之間變更的列與刪除的 id）。
+    讀取前比對 db.bp_sync_state：落後時只把 db.bp_changes 寫成一個新的 delta 檔（成本與變更量成正比），
+    delta 檔數或列數累積過多時才合併回 base（compaction）；tombstone 已清除則整份重建。
+    每個檔案都先寫暫存檔再 os.replace，讀取端只採用從 base 序號起能接成一串的 delta，
+    不會看到寫一半或已併入 base 的檔案。
+    """
+    name = "parquet"
+    COMPACT_FILES = 16        # delta 檔超過此數即合併
+    COMPACT_RATIO = 0.25      # 或 delta 列數超過 base 的這個比例（且至少 ROW_GROUP_ROWS 列）
+
+    def __init__(self, mirror_dir: Optional[Path] = None):
+        self._dir = Path(mirror_dir) if mirror_dir else None
+        self._seq: Dict[int, int] = {}                 # user_id → 鏡像目前的序號（行程內快取）
+        self._locks: Dict[int, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    @property
+    def mirror_dir(self) -> Path:
+        if self._dir is not None:
+            return self._dir
+        import db
+        return Path(os.environ.get(MIRROR_DIR_ENV) or Path(db.DB_PATH).with_suffix(".mirror"))
+
+    def path(self, user_id: int) -> Path:
+        return self.mirror_dir / f"user_{user_id}"
+
+    def _lock(self, user_id: int) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _schema(self, delta: bool = False):
+        import pyarrow as pa
+        fields = [
+            ("id", pa.int64()), ("ts", pa.int64()),
+            ("systolic", pa.float64()), ("diastolic", pa.float64()), ("pulse", pa.float64()),
+            ("meds", pa.string()), ("note", pa.string()),
+        ]
+        return pa.schema(fields + [("deleted", pa.bool_())] if delta else fields)
+
+    def _files(self, user_id: int):
+        """(base 序號, base 路徑, [(from, to, 路徑), ...] 從 base 接續的 delta 鏈)；尚無 base 時為 None。"""
+        d = self.path(user_id)
+        if not d.is_dir():
+            return None
+        bases, deltas = {}, {}
+        for p in d.glob("*.parquet"):
+            parts = p.stem.split("_")
+            try:
+                if parts[0] == "base" and len(parts) == 2:
+                    bases[int(parts[1])] = p
+                elif parts[0] == "delta" and len(parts) == 3:
+                    lo, hi = int(parts[1]), int(parts[2])
+                    if hi > deltas.get(lo, (hi - 1, None))[0]:
+                        deltas[lo] = (hi, p)        # 同一起點取涵蓋最遠的
+            except ValueError:
+                continue
+        if not bases:
+            return None
+        base_seq = max(bases)
+        chain, cur = [], base_seq
+        while cur in deltas:
+            hi, p = deltas[cur]
+            chain.append((cur, hi, p))
+            cur = hi
+        return base_seq, bases[base_seq], chain
+
+    def _stored_seq(self, user_id: int) -> Optional[int]:
+        files = self._files(user_id)
+        if files is None:
+            return None
+        base_seq, _, chain = files
+        return chain[-1][1] if chain else base_seq
+
+    def _put(self, path: Path, table) -> None:
+        import pyarrow.parquet as pq
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_ROWS, compression="zstd")
+        os.replace(tmp, path)
+
+    def _write(self, user_id: int, table, seq: int, wipe: bool = False) -> None:
+        """
+        寫入新的 base 並清掉它已涵蓋的舊 base / delta 檔（序號上限 <= seq）；合併期間其他實例追加的
+        delta（上限 > seq）保留，仍接在新 base 之後。wipe=True 時其餘檔案一律刪除（鏡像領先資料庫時）。
+        """
+        self._put(self.path(user_id) / f"base_{seq}.parquet", table)
+        for p in self.path(user_id).glob("*.parquet"):
+            parts = p.stem.split("_")
+            try:
+                covered = int(parts[-1]) < seq if parts[0] == "base" else int(parts[-1]) <= seq
+            except ValueError:
+                continue
+            if wipe and p.stem != f"base_{seq}" or covered:
+                p.unlink(missing_ok=True)
+        self._seq[user_id] = seq
+
+    def _rebuild(self, user_id: int, wipe: bool = False) -> None:
+        import pyarrow as pa
+        import db
+        # 先取序號再讀資料：期間若有寫入，下次同步會再套用一次（以 id 覆蓋，結果不變）
+        seq = db.bp_sync_state(user_id)[0]
+        df = SqliteBackend().scan_bp(user_id)
+        self._write(user_id, pa.Table.from_pandas(df, schema=self._schema(), preserve_index=False), seq, wipe)
+
+    def _read(self, user_id: int, lo: Optional[int] = None, hi: Optional[int] = None):
+        """base（ts 篩選，row group 統計略過不相干區段）疊上 delta 鏈；依 (ts, id) 排序的 pyarrow Table。"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+        files = self._files(user_id)
+        if files is None:
+            raise FileNotFoundError(self.path(user_id))
+        _, base_path, chain = files
+        flt = None
+        if lo is not None and hi is not None:
+            flt = (ds.field("ts") >= lo) & (ds.field("ts") <= hi)
+        table = ds.dataset(base_path, format="parquet").to_table(columns=BP_SCAN_COLUMNS, filter=flt)
+        if not chain:
+            return table                                # base 已依 (ts, id) 排序，篩選保留順序
+        delta = pa.concat_tables([pq.read_table(p, schema=self._schema(delta=True)) for _, _, p in chain])
+        # 同一 id 以最後一次變更為準（delta 依序號串接，較新的在後）
+        last = delta.to_pandas().drop_duplicates("id", keep="last")
+        table = table.filter(pc.invert(pc.is_in(table["id"], value_set=pa.array(last["id"], type=pa.int64()))))
+        rows = last[~last["deleted"]]
+        if lo is not None and hi is not None:
+            rows = rows[(rows["ts"] >= lo) & (rows["ts"] <= hi)]
+        if rows.empty:
+            return table
+        rows = pa.Table.from_pandas(rows[BP_SCAN_COLUMNS], schema=self._schema(), preserve_index=False)
+        return pa.concat_tables([table, rows]).sort_by([("ts", "ascending"), ("id", "ascending")])
+
+    def _apply(self, user_id: int, since: int) -> bool:
+        """把 since 之後的變更寫成一個 delta 檔；tombstone 已清除（需整份重建）時回傳 False。"""
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import db
+        delta = db.bp_changes(user_id, since)
+        if delta is None:
+            return False
+        seq, changed, deleted = delta
+        if seq == since:
+            self._seq[user_id] = seq
+            return True
+        rows = changed.assign(ts=changed.pop("datetime").dt.as_unit("s").astype("int64"))[BP_SCAN_COLUMNS]
+        gone = sorted(set(deleted) - set(rows["id"].tolist()))
+        rows = pd.concat([rows.assign(deleted=False),
+                          pd.DataFrame({"id": pd.Series(gone, dtype="int64"), "deleted": True})], ignore_index=True)
+        self._put(self.path(user_id) / f"delta_{since}_{seq}.parquet",
+                  pa.Table.from_pandas(rows, schema=self._schema(delta=True), preserve_index=False))
+        self._seq[user_id] = seq
+
+        base_seq, base_path, chain = self._files(user_id)
+        n_delta = sum(pq.read_metadata(p).num_rows for _, _, p in chain)
+        n_base = pq.read_metadata(base_path).num_rows
+        if len(chain) > self.COMPACT_FILES or n_delta > max(ROW_GROUP_ROWS, n_base * self.COMPACT_RATIO):
+            self.compact(user_id)
+        return True
+
+    def compact(self, user_id: int) -> None:
+        """把 delta 鏈合併回 base（整份重寫一次，攤提到多次增量同步）。"""
+        files = self._files(user_id)
+        if files is None or not files[2]:
+            return
+        self._write(user_id, self._read(user_id), files[2][-1][1])
+
+    def sync(self, user_id: int) -> None:
+        """確保鏡像追上 SQLite 目前的序號。"""
+        import db
+        seq = db.bp_sync_state(user_id)[0]
+        # 行程內序號只在磁碟上的 base + delta 鏈仍接得到時才採信（其他實例可能已合併 / 重建）
+        if self._seq.get(user_id) == seq and self._stored_seq(user_id) == seq:
+            return
+        with self._lock(user_id):
+            stored = self._stored_seq(user_id)
+            if stored == seq:
+                self._seq[user_id] = seq
+            elif stored is not None and stored > seq:
+                self._rebuild(user_id, wipe=True)
+            elif stored is None or not self._apply(user_id, stored):
+                self._rebuild(user_id)
+
+    def scan_bp(self, user_id: int, lo: Optional[int] = None, hi: Optional[int] = None) -> "pd.DataFrame":
+        for attempt in range(3):
+            self.sync(user_id)
+            try:
+                return self._read(user_id, lo, hi).to_pandas()
+            except FileNotFoundError:
+                # 其他行程剛好合併 / 重建，讀到一半的檔案已被取代；重新同步後再讀
+                self._seq.pop(user_id, None)
+                if attempt == 2:
+                    raise
+
+    def drop(self, user_id: Optional[int] = None) -> None:
+        """刪除鏡像（下次讀取整份重建）；user_id=None 為全部。"""
+        import shutil
+        targets = [self.path(user_id)] if user_id is not None else list(self.mirror_dir.glob("user_*"))
+        for p in targets:
+            shutil.rmtree(p, ignore_errors=True)
+        if user_id is None:
+            self._seq.clear()
+        else:
+            self._seq.pop(user_id, None)
+
+
+# ---------- 後端選擇 ----------
+BACKENDS = {"sqlite": SqliteBackend, "parquet": ParquetMirror}
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def available_backends() -> list:
+    """目前環境可用的後端（未安裝 pyarrow 時不列出 parquet）。"""
+    try:
+        import pyarrow  # noqa: F401
+        return list(BACKENDS)
+    except ImportError:
+        return ["sqlite"]
+
+
+def set_backend(name: str):
+    """切換讀取後端並回傳實例；未知或目前環境不可用時丟 ValueError。"""
+    global _backend
+    if name not in available_backends():
+        raise ValueError(f"unsupported storage backend: {name}")
+    with _backend_lock:
+        _backend = BACKENDS[name]()
+    return _backend
+
+
+def backend():
+    """目前的讀取後端；第一次呼叫時依 HEALTHHUB_READ_BACKEND 決定（不可用時退回 sqlite）。"""
+    if _backend is None:
+        name = os.environ.get("HEALTHHUB_READ_BACKEND", "sqlite")
+        try:
+            set_backend(name)
+        except ValueError:
+            warnings.warn(f"storage backend {name!r} unavailable; falling back to sqlite")
+            set_backend("sqlite")
+    return _backend
@@ -0,0 +1,26 @@
+# tests/conftest.py
+"""共用 fixture：每個測試一個暫存目錄裡的全新 healthhub.db，結束後還原連線池與模組層快取。"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import cache  # noqa: E402
+import db  # noqa: E402
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old_path = db.DB_PATH
+    db.configure_pool(tmp_path / "healthhub.db")
+    db.init_db()
+    cache._frames.invalidate()
+    monkeypatch.setattr(storage, "_backend", None)
+    yield tmp_path / "healthhub.db"
+    cache._frames.invalidate()
+    db.configure_pool(old_path)
@@ -0,0 +1,165 @@
+# tests/test_backup.py
+"""
+線上備份 / 還原：持續寫入負載下的備份是一致快照且可驗證、竄改會被拒絕、
+還原經單一寫入執行緒（先寫完已排隊的寫入）且快取全量重載、rotate 只留設定份數。
+"""
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import backup
+import cache
+import db
+import writer
+
+ROWS_PER_USER = 5000
+CALL_TIMEOUT = 10            # 寫入卡住時讓測試失敗而不是掛住
+
+
+class Load:
+    """背景寫入負載：每個執行緒不停經 writer 新增 / 刪除，記錄錯誤與完成筆數。"""
+
+    def __init__(self, uids, threads: int = 4):
+        self.uids, self.stop = uids, threading.Event()
+        self.done, self.errors, self.lock = 0, [], threading.Lock()
+        self.threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(threads)]
+
+    def _run(self, i: int) -> None:
+        k = 0
+        while not self.stop.is_set():
+            uid = self.uids[(i + k) % len(self.uids)]
+            try:
+                # 每個執行緒 / 每筆時間都不同（add_bp 遇到相同的時間 + 讀值會丟 IntegrityError）
+                dt = pd.Timestamp("2026-01-01", tz="UTC") + pd.Timedelta(minutes=k, seconds=i)
+                rid = writer.call(db.add_bp, uid, {"datetime": dt,
+                                                   "systolic": 120.0 + k % 30, "diastolic": 80.0, "pulse": 70.0},
+                                  timeout=CALL_TIMEOUT)
+                if k % 5 == 0:
+                    writer.call(db.delete_bp, uid, [rid], timeout=CALL_TIMEOUT)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(e)
+            with self.lock:
+                self.done += 1
+            k += 1
+
+    def __enter__(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+
+
+def _consistent(raw_db: Path) -> bool:
+    """各使用者 bp_daily.n 加總 = blood_pressure 筆數（同一交易內更新的彙總表）。"""
+    with closing(sqlite3.connect(raw_db)) as conn:
+        rows = conn.execute("""
+            SELECT u.user_id, u.n, COALESCE(d.n, 0) FROM
+              (SELECT user_id, COUNT(*) AS n FROM blood_pressure GROUP BY user_id) u
+              LEFT JOIN (SELECT user_id, SUM(n) AS n FROM bp_daily GROUP BY user_id) d USING (user_id)
+        """).fetchall()
+    return bool(rows) and all(n == m for _, n, m in rows)
+
+
+def _bp_count() -> int:
+    with db.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM blood_pressure").fetchone()[0]
+
+
+@pytest.fixture
+def seeded(fresh_db, monkeypatch):
+    # 測試專用的寫入執行緒；結束後關閉並還原模組層的 writer._writer，後續測試不會排到已停止的執行緒
+    w = writer.Writer()
+    monkeypatch.setattr(writer, "_writer", w)
+    uids = [db.create_user(f"b{i}@example.com", "b", "Backup-check-1") for i in range(4)]
+    for uid in uids:
+        ts = pd.Timestamp("2020-01-01", tz="UTC") + pd.to_timedelta(range(0, ROWS_PER_USER * 3600, 3600), unit="s")
+        db.add_bp_many(uid, pd.DataFrame({"datetime": ts, "systolic": 125.0, "diastolic": 82.0, "pulse": 70.0,
+                                          "meds": "", "note": "seed"}))
+    yield uids, fresh_db.parent / "backups"
+    w.shutdown()
+
+
+def test_backups_under_write_load(seeded):
+    uids, dest = seeded
+    with Load(uids) as load:
+        time.sleep(0.2)
+        start = load.done
+        made = [backup.create_backup(dest, rotate_after=False) for _ in range(2)]
+        during = load.done - start
+    assert not load.errors
+    assert during > 0, "writes stalled while backups ran"
+    for m in made:
+        assert backup.verify_backup(m["path"])["raw_sha256"] == m["raw_sha256"]
+        raw = dest / "check.db"
+        backup._unpack_verified(Path(m["path"]), raw)
+        assert _consistent(raw), m["file"]
+        raw.unlink()
+
+
+def test_tampered_backup_rejected(seeded):
+    _, dest = seeded
+    good = Path(backup.create_backup(dest)["path"])
+    tampered = good.with_name("healthhub-tampered.db.gz")
+    data = bytearray(good.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    tampered.write_bytes(bytes(data))
+    Path(str(tampered) + ".json").write_text(Path(str(good) + ".json").read_text(encoding="utf-8"), encoding="utf-8")
+    with pytest.raises(backup.BackupError):
+        backup.verify_backup(tampered)
+    with pytest.raises(backup.BackupError):
+        backup.restore_backup(tampered)
+    assert _bp_count() == 4 * ROWS_PER_USER
+
+
+def test_restore_drains_queued_writes(seeded):
+    """還原前已送出的寫入先 commit、再被還原覆蓋：結果與備份完全一致，寫入執行緒照常運作。"""
+    uids, dest = seeded
+    made = backup.create_backup(dest)
+    before = {uid: cache.enriched_bp(uid)["id"].tolist() for uid in uids}
+    futs = [writer.submit(db.add_bp, uids[k % 4], {"datetime": f"2027-02-01T00:{k // 60:02d}:{k % 60:02d}Z",
+                                                   "systolic": 140.0, "diastolic": 90.0, "pulse": 75.0})
+            for k in range(200)]
+    backup.restore_backup(made["path"])
+    assert all(f.done() and f.exception() is None for f in futs)
+    assert _bp_count() == made["tables"]["blood_pressure"]
+    for uid in uids:
+        assert cache.enriched_bp(uid)["id"].tolist() == before[uid]
+    assert writer.call(db.add_bp, uids[0], {"datetime": "2027-03-01T00:00:00Z",
+                                            "systolic": 120.0, "diastolic": 80.0, "pulse": 70.0},
+                       timeout=CALL_TIMEOUT)
+    assert len(cache.enriched_bp(uids[0])) == ROWS_PER_USER + 1
+
+
+def test_restore_under_write_load(seeded):
+    uids, dest = seeded
+    made = backup.create_backup(dest)
+    with Load(uids) as load:
+        time.sleep(0.2)
+        backup.restore_backup(made["path"])
+        time.sleep(0.2)
+    assert not load.errors
+    with db.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == made["tables"]["users"]
+    for uid in uids:
+        assert len(cache.enriched_bp(uid)) == len(db.list_bp(uid))
+    with closing(db.get_conn()) as conn:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert _consistent(db.DB_PATH)
+
+
+def test_rotate_keeps_newest(seeded):
+    _, dest = seeded
+    made = [backup.create_backup(dest, rotate_after=False) for _ in range(3)]
+    removed = backup.rotate(dest, keep_last=1, keep_daily=0)
+    left = backup.list_backups(dest)
+    assert len(removed) == 2 and [b["file"] for b in left] == [made[-1]["file"]]
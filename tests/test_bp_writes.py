@@ -0,0 +1,35 @@
+# tests/test_bp_writes.py
+"""血壓寫入的自然鍵語意：add_bp 是單純新增（重複即失敗、不動既有列），add_bp_many 略過、import_bp 覆寫 meds / note。"""
+import sqlite3
+
+import pytest
+
+import db
+
+REC = {"datetime": "2025-03-01T08:00:00Z", "systolic": 128.0, "diastolic": 82.0, "pulse": 70.0,
+       "meds": "amlodipine", "note": "first"}
+
+
+def _rows(uid):
+    return db.list_bp(uid)[["meds", "note"]].astype(str).values.tolist()
+
+
+def test_add_bp_duplicate_rejected(fresh_db):
+    uid = db.create_user("w@example.com", "w", "Writes-check-1")
+    db.add_bp(uid, REC)
+    seq = db.bp_sync_state(uid)[0]
+    with pytest.raises(sqlite3.IntegrityError, match="UNIQUE"):
+        db.add_bp(uid, {**REC, "meds": "", "note": "resubmitted"})
+    assert _rows(uid) == [["amlodipine", "first"]]
+    assert db.bp_sync_state(uid)[0] == seq                # 沒有寫入，快取 / 鏡像不需同步
+    assert db.add_bp(uid, {**REC, "pulse": 71.0}) > 0     # 讀值不同即為另一筆
+
+
+def test_bulk_paths_keep_their_semantics(fresh_db):
+    uid = db.create_user("m@example.com", "m", "Writes-check-1")
+    db.add_bp(uid, REC)
+    assert db.add_bp_many(uid, [{**REC, "note": "ignored"}]) == 0
+    assert _rows(uid) == [["amlodipine", "first"]]
+    res = db.import_bp(uid, [{**REC, "note": "from file"}])
+    assert res == {"inserted": 0, "updated": 1, "skipped": 0}
+    assert _rows(uid) == [["amlodipine", "from file"]]
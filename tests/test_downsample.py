@@ -0,0 +1,100 @@
+# tests/test_downsample.py
+"""時間序列圖表降採樣（utils.downsample）：每條序列點數上限、峰值 / 首尾保留、payload 縮小。"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import CHART_MAX_POINTS, downsample, enrich_bp, lttb_indices, minmax_indices
+
+
+def make_view(per_day: int, days: int = 365, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n = per_day * days
+    dt = pd.Timestamp("2025-01-01", tz="UTC") + pd.to_timedelta(np.sort(rng.uniform(0, days * 86400, n)), unit="s")
+    df = pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "datetime": dt,
+        "systolic": rng.normal(128, 12, n).round(),
+        "diastolic": rng.normal(82, 8, n).round(),
+        "pulse": rng.normal(72, 8, n).round(),
+        "meds": "", "note": "",
+    })
+    df.loc[n // 3, "systolic"] = 210   # 峰值
+    df.loc[n // 2, "systolic"] = 70    # 谷值
+    return enrich_bp(df)
+
+
+def melt(view: pd.DataFrame) -> pd.DataFrame:
+    return view.melt(id_vars=["datetime", "category"], value_vars=["systolic", "diastolic"],
+                     var_name="type", value_name="mmHg")
+
+
+def payload_bytes(df: pd.DataFrame) -> int:
+    # 以 Vega 內嵌資料的 JSON records 大小估算
+    return len(df.to_json(orient="records", date_format="iso").encode("utf-8"))
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("per_day", [4, 48])
+@pytest.mark.parametrize("max_points", [CHART_MAX_POINTS, 500, 7])
+def test_points_per_series_capped(method, per_day, max_points):
+    long = melt(make_view(per_day))
+    small = downsample(long, "datetime", "mmHg", max_points=max_points, by="type", method=method)
+    sizes = small.groupby("type").size()
+    assert set(sizes.index) == {"systolic", "diastolic"}
+    assert sizes.max() <= max_points
+    assert payload_bytes(small) < payload_bytes(long)
+    for _, g in small.groupby("type"):
+        assert g["datetime"].is_monotonic_increasing
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_endpoints_kept(method):
+    long = melt(make_view(12))
+    small = downsample(long, "datetime", "mmHg", max_points=200, by="type", method=method)
+    for t, g in long.groupby("type"):
+        kept = small[small["type"] == t]["datetime"]
+        assert kept.iat[0] == g["datetime"].min() and kept.iat[-1] == g["datetime"].max()
+
+
+def test_minmax_keeps_extremes():
+    long = melt(make_view(48))
+    small = downsample(long, "datetime", "mmHg", max_points=100, by="type", method="minmax")
+    for t, g in long.groupby("type"):
+        kept = small[small["type"] == t]["mmHg"]
+        assert kept.max() == g["mmHg"].max() and kept.min() == g["mmHg"].min()
+    assert 210 in small["mmHg"].to_numpy() and 70 in small["mmHg"].to_numpy()
+
+
+def test_small_input_returned_as_is():
+    view = make_view(1, days=30)
+    assert downsample(view, "datetime", "pulse", max_points=100) is view
+
+
+def test_missing_values_dropped():
+    view = make_view(12).copy()
+    view.loc[view.index[::3], "pulse"] = np.nan
+    small = downsample(view, "datetime", "pulse", max_points=300)
+    assert len(small) <= 300 and small["pulse"].notna().all()
+
+
+def test_page_pipeline_payload():
+    """同 pages/01_血壓紀錄.py：逐序列降採樣後合併，每條序列不超過上限。"""
+    view = make_view(48)
+    long = pd.concat([
+        downsample(view[["datetime", "category", v]], "datetime", v).rename(columns={v: "mmHg"}).assign(type=v)
+        for v in ("systolic", "diastolic")
+    ], ignore_index=True)
+    pulse = downsample(view[["datetime", "pulse"]], "datetime", "pulse")
+    assert long.groupby("type").size().max() <= CHART_MAX_POINTS and len(pulse) <= CHART_MAX_POINTS
+    assert payload_bytes(long) * 10 < payload_bytes(melt(view))
+
+
+def test_index_helpers():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 30)
+    idx = lttb_indices(x, y, 50)
+    assert len(idx) == 50 and idx[0] == 0 and idx[-1] == 999 and np.all(np.diff(idx) > 0)
+    assert len(lttb_indices(x, y, 2000)) == 1000
+    idx = minmax_indices(y, 20)
+    assert len(idx) <= 42 and y[idx].max() == y.max() and y[idx].min() == y.min()
@@ -0,0 +1,45 @@
+# tests/test_i18n.py
+"""翻譯查表：編譯時預先拆好的 format 模板與 str.format 結果一致，磁碟快取來回不變，各語系 key 齊全。"""
+import pytest
+
+import i18n
+
+
+@pytest.mark.parametrize("text, kwargs", [
+    ("共 {n} 筆", {"n": 5}),
+    ("100% {msg}", {"msg": "ok"}),
+    ("{a}{b}", {"a": 1.5, "b": "x"}),
+    ("{x!r:>6} / {y:.2f}", {"x": "q", "y": 1 / 3}),
+    ("{{literal}} {n}", {"n": 0}),
+])
+def test_compiled_template_matches_format(text, kwargs):
+    parts = i18n._parse(text)
+    got = parts % kwargs if isinstance(parts, str) else i18n._render(parts, kwargs)
+    assert got == text.format(**kwargs)
+
+
+def test_plain_and_malformed_text_not_templates():
+    assert i18n._parse("沒有欄位") is None
+    assert i18n._parse("{{escaped}}") is None
+    assert i18n._parse("壞掉的 {") is None
+
+
+def test_lookup_and_disk_cache_roundtrip(monkeypatch, tmp_path):
+    monkeypatch.setattr(i18n, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(i18n, "_cache", {})
+    monkeypatch.setattr(i18n, "get_lang", lambda: "en")
+    for lang in i18n.SUPPORTED:
+        stamp = i18n._stamp(i18n.LOCALES_DIR / f"{lang}.yaml")
+        table = i18n.build_catalog(lang)
+        i18n._write_disk_cache(lang, stamp, table)
+        assert i18n._read_disk_cache(lang, stamp) == table
+    key, (text, _) = next((k, v) for k, v in i18n._load_lang("en").items() if isinstance(v, tuple) and v[1])
+    assert i18n.t(key, n=7, msg="m") == text.format(n=7, msg="m")
+    assert i18n.t(key) == text
+    assert i18n.t(key, unrelated=1) == text                  # 缺少欄位：回傳原文
+    missing = "no.such.key"
+    assert i18n.t(missing) == missing
+
+
+def test_catalogs_complete():
+    assert i18n.check() == []
@@ -0,0 +1,29 @@
+# tests/test_instrument.py
+"""量測開關：頁面每次 rerun 傳入的 DEBUG 不會關掉 HEALTHHUB_TRACE 開啟的量測。"""
+import pytest
+
+import instrument
+
+
+@pytest.fixture(autouse=True)
+def _restore():
+    was = instrument.is_enabled()
+    yield
+    instrument.end_rerun()
+    instrument.enable(was)
+
+
+def test_env_trace_survives_debug_off(monkeypatch):
+    monkeypatch.setattr(instrument, "_ENV_TRACE", True)
+    instrument.begin_rerun("t", enabled=False)
+    assert instrument.is_enabled()
+
+
+def test_debug_toggles_without_env(monkeypatch):
+    monkeypatch.setattr(instrument, "_ENV_TRACE", False)
+    instrument.begin_rerun("t", enabled=True)
+    assert instrument.is_enabled()
+    instrument.begin_rerun("t", enabled=False)
+    assert not instrument.is_enabled()
+    instrument.begin_rerun("t")                     # None：不動目前開關
+    assert not instrument.is_enabled()
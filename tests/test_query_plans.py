@@ -0,0 +1,26 @@
+# tests/test_query_plans.py
+"""HOT_QUERIES 的查詢計畫：遷移到最新 schema 後每個熱查詢都走索引、不需暫存排序（db.check_query_plans）。"""
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+import db
+
+
+def test_hot_queries_use_indexes(fresh_db):
+    with closing(sqlite3.connect(fresh_db)) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    assert db.check_query_plans() == {}
+
+
+def test_hot_queries_use_indexes_with_data(fresh_db):
+    """有資料、跑過 ANALYZE（查詢規劃器依統計選計畫）後仍然通過。"""
+    for i in range(3):
+        uid = db.create_user(f"q{i}@example.com", "q", "Query-plan-1")
+        ts = pd.Timestamp("2024-01-01", tz="UTC") + pd.to_timedelta(range(0, 2000 * 3600, 3600), unit="s")
+        db.add_bp_many(uid, pd.DataFrame({"datetime": ts, "systolic": 120.0, "diastolic": 80.0, "pulse": 70.0,
+                                          "meds": "", "note": ""}))
+    with db.connection() as conn:
+        conn.execute("ANALYZE")
+    assert db.check_query_plans() == {}
@@ -0,0 +1,77 @@
+# tests/test_rollups.py
+"""日 / 週彙總：與原始紀錄一致、依目前 TZ 切分本地日（TZ 改變時 init_db 全量重建）、舊版資料庫遷移後回填。"""
+import sqlite3
+from contextlib import closing
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+import db
+
+
+def _seed(n=500):
+    uid = db.create_user("r@example.com", "r", "Rollup-check-1")
+    ts = pd.Timestamp("2025-03-01", tz="UTC") + pd.to_timedelta(range(0, n * 7 * 600, 7 * 600), unit="s")
+    db.add_bp_many(uid, pd.DataFrame({"datetime": ts, "systolic": 118.0 + (pd.RangeIndex(n) % 40),
+                                      "diastolic": 78.0, "pulse": 70.0, "meds": "", "note": ""}))
+    return uid
+
+
+def _expected_days(uid, tz):
+    local = db.list_bp(uid)["datetime"].dt.tz_convert(tz)
+    return local.dt.strftime("%Y-%m-%d").value_counts().sort_index()
+
+
+def _rollup_days(uid):
+    d = db.bp_daily(uid)
+    return d.set_index("day")["n"].rename_axis(None)
+
+
+def test_rollups_match_rows_and_record_tz(fresh_db):
+    uid = _seed()
+    got, want = _rollup_days(uid), _expected_days(uid, db.TZ)
+    assert got.to_dict() == want.to_dict()
+    with db.connection() as conn:
+        assert conn.execute("SELECT value FROM rollup_meta WHERE key = 'tz'").fetchone()[0] == str(db.TZ)
+        assert "n_hit" not in db._columns(conn, "bp_daily") + db._columns(conn, "bp_weekly")
+        assert conn.execute("SELECT SUM(n) FROM bp_weekly WHERE user_id = ?", (uid,)).fetchone()[0] == 500
+
+
+def test_tz_change_rebuilds(fresh_db, monkeypatch):
+    uid = _seed()
+    other = ZoneInfo("Pacific/Auckland" if str(db.TZ) != "Pacific/Auckland" else "America/New_York")
+    monkeypatch.setattr(db, "TZ", other)
+    assert _rollup_days(uid).to_dict() != _expected_days(uid, other).to_dict()   # 舊 TZ 切分的彙總
+    db._migrated_paths.discard(fresh_db.resolve())
+    db.init_db()
+    assert _rollup_days(uid).to_dict() == _expected_days(uid, other).to_dict()
+    with db.connection() as conn:
+        assert conn.execute("SELECT value FROM rollup_meta WHERE key = 'tz'").fetchone()[0] == str(other)
+
+
+def test_migrate_from_v4_backfills_rollups(tmp_path, monkeypatch):
+    """v4（datetime 文字欄、彙總表含 n_hit 且是空的）遷移到最新版：時間戳正規化後彙總全量回填。"""
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "legacy.db"
+    with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        for version, m in enumerate(db.MIGRATIONS[:4]):
+            conn.execute("BEGIN")
+            m(conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.execute("COMMIT")
+        conn.execute("INSERT INTO users (email, name, password_hash) VALUES ('old@example.com', 'old', 'x')")
+        conn.executemany(
+            "INSERT INTO blood_pressure (user_id, datetime, systolic, diastolic, pulse) VALUES (1, ?, ?, 80, 70)",
+            [(f"2025-01-{1 + i % 28:02d}T{i % 24:02d}:00:00Z", 120 + i) for i in range(100)]
+            + [("2025-01-01T00:00:00Z", 120)])                 # 與第一筆自然鍵重複（_m007 移走）
+    old_path = db.DB_PATH
+    db.configure_pool(path)
+    try:
+        db.init_db()
+        with db.connection() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+            assert conn.execute("SELECT COUNT(*) FROM blood_pressure_duplicates").fetchone()[0] == 1
+        assert int(db.bp_daily(1)["n"].sum()) == 100
+        assert _rollup_days(1).to_dict() == _expected_days(1, db.TZ).to_dict()
+    finally:
+        db.configure_pool(old_path)
@@ -0,0 +1,178 @@
+# tests/test_storage.py
+"""
+儲存後端一致性：同一份資料、同一串寫入操作，每一步都比對各後端的 db.list_bp 結果。
+涵蓋：同秒多筆（(ts, id) 排序）、區間兩端（含邊界）、新增 / 批次新增 / 修改時間 / 刪除 / 區間刪除 /
+全部刪除、多位使用者互不影響、tombstone 清除後的整份重建、鏡像遺失後重建；
+Parquet 鏡像另測增量同步只追加 delta 檔、合併（compaction）與多個實例共用同一目錄。
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import db
+import storage
+
+pytest.importorskip("pyarrow")
+
+RANGES = [
+    (None, None),
+    ("2025-01-01T00:00:00Z", "2025-01-01T00:00:00Z"),   # 單一秒（同秒多筆）
+    ("2025-01-01T00:00:01Z", "2025-01-31T23:59:59Z"),
+    ("2025-03-01T00:00:00Z", "2026-12-31T23:59:59Z"),
+    ("2030-01-01T00:00:00Z", "2030-12-31T23:59:59Z"),   # 無資料
+]
+
+
+def _norm(df: pd.DataFrame) -> pd.DataFrame:
+    # 只比對值：數值一律 float、文字缺值一律 ""，避免不同後端的 dtype 表示法差異
+    out = df.copy()
+    for c in ("systolic", "diastolic", "pulse"):
+        out[c] = out[c].astype(float)
+    for c in ("meds", "note"):
+        out[c] = out[c].astype(object).where(out[c].notna(), "").astype(str)
+    out["id"] = out["id"].astype("int64")
+    out["datetime"] = out["datetime"].dt.as_unit("s")
+    return out.reset_index(drop=True)
+
+
+def assert_same(backends: dict, user_ids: list, step: str) -> None:
+    for uid in user_ids:
+        for lo, hi in RANGES:
+            storage._backend = backends["sqlite"]
+            ref = _norm(db.list_bp(uid, lo, hi))
+            for name, be in backends.items():
+                storage._backend = be
+                got = _norm(db.list_bp(uid, lo, hi))
+                try:
+                    pd.testing.assert_frame_equal(got, ref, check_dtype=False)
+                except AssertionError as e:
+                    raise AssertionError(f"[{step}] user={uid} range={lo}..{hi}: {name} != sqlite\n{e}") from None
+
+
+def rec(dt, i, **kw):
+    return {"datetime": dt, "systolic": 110 + i % 50, "diastolic": 70 + i % 30, "pulse": 60 + i % 40,
+            "meds": kw.get("meds", "" if i % 3 else "amlodipine"), "note": kw.get("note", f"n{i}")}
+
+
+@pytest.fixture(params=["append", "compact"])
+def backends(request, fresh_db):
+    """sqlite 對照 parquet；append = 從不合併（只疊 delta），compact = 每次同步都合併回 base。"""
+    mirror = storage.ParquetMirror(fresh_db.with_suffix(".mirror"))
+    if request.param == "append":
+        mirror.COMPACT_FILES, mirror.COMPACT_RATIO = 10**9, float("inf")
+    else:
+        mirror.COMPACT_FILES = -1
+    return {"sqlite": storage.SqliteBackend(), "parquet": mirror}
+
+
+def test_conformance(backends, monkeypatch):
+    a = db.create_user("a@example.com", "a", "Conformance-1")
+    b = db.create_user("b@example.com", "b", "Conformance-1")
+    users = [a, b]
+    rng = np.random.default_rng(7)
+    assert_same(backends, users, "empty")
+
+    db.add_bp_many(a, [rec("2025-01-01T00:00:00Z", i) for i in range(5)])
+    base = pd.Timestamp("2025-01-01", tz="UTC")
+    db.add_bp_many(a, [rec(base + pd.Timedelta(seconds=int(s)), i)
+                       for i, s in enumerate(rng.integers(1, 700 * 86400, 3000))])
+    db.add_bp_many(b, [rec(base + pd.Timedelta(hours=i), i) for i in range(500)])
+    assert_same(backends, users, "bulk insert")
+
+    steps = [
+        ("add_bp", lambda: db.add_bp(a, rec("2025-01-15T08:00:00Z", 1, note=None))),
+        ("update time", lambda: db.update_bp(a, int(db.list_bp(a)["id"].iat[10]), {"datetime": "2024-12-31T23:59:59Z"})),
+        ("update values", lambda: db.update_bp_many(a, pd.DataFrame(
+            {"id": db.list_bp(a)["id"].iloc[::50], "systolic": 150.0, "note": "edited"}))),
+        ("delete", lambda: db.delete_bp(a, db.list_bp(a)["id"].iloc[::7].tolist())),
+        ("delete range", lambda: db.delete_bp_range(a, "2025-02-01T00:00:00Z", "2025-02-28T23:59:59Z")),
+        ("other user", lambda: db.add_bp(b, rec("2025-01-01T00:00:00Z", 2))),
+    ]
+    for name, fn in steps:
+        fn()
+        assert_same(backends, users, name)
+
+    # tombstone 上限 → floor_seq 前進，鏡像需整份重建
+    monkeypatch.setattr(db, "TOMBSTONE_KEEP", 3)
+    for rid in db.list_bp(a)["id"].iloc[:10].tolist():
+        db.delete_bp(a, [int(rid)])
+    monkeypatch.undo()
+    assert_same(backends, users, "tombstone prune")
+
+    backends["parquet"].drop(a)
+    assert_same(backends, users, "mirror dropped")
+
+    db.delete_all_bp(a)
+    db.add_bp_many(a, [rec("2025-06-01T12:00:00Z", i) for i in range(3)])
+    assert_same(backends, users, "delete all + reinsert")
+
+
+def _files(mirror, uid):
+    return sorted(p.name for p in mirror.path(uid).glob("*.parquet"))
+
+
+def test_sync_appends_delta_files(fresh_db):
+    mirror = storage.ParquetMirror(fresh_db.with_suffix(".mirror"))
+    mirror.COMPACT_FILES, mirror.COMPACT_RATIO = 3, float("inf")
+    uid = db.create_user("d@example.com", "d", "Conformance-1")
+    db.add_bp_many(uid, [rec(pd.Timestamp("2025-01-01", tz="UTC") + pd.Timedelta(hours=i), i) for i in range(200)])
+    mirror.scan_bp(uid)
+    (base,) = _files(mirror, uid)
+    base_mtime = (mirror.path(uid) / base).stat().st_mtime_ns
+
+    for k in range(3):
+        db.add_bp(uid, rec(f"2026-01-0{k + 1}T00:00:00Z", k))
+        assert len(mirror.scan_bp(uid)) == 201 + k
+    names = _files(mirror, uid)
+    assert names[0] == base and len(names) == 4, names          # base 未重寫，只多了 3 個 delta
+    assert (mirror.path(uid) / base).stat().st_mtime_ns == base_mtime
+
+    db.delete_bp(uid, [int(db.list_bp(uid)["id"].iat[0])])
+    assert len(mirror.scan_bp(uid)) == 202
+    names = _files(mirror, uid)
+    assert len(names) == 1 and names[0].startswith("base_") and names[0] != base   # 超過檔數上限 → 合併
+    assert mirror.compact(uid) is None and _files(mirror, uid) == names
+
+
+def test_mirrors_share_directory(fresh_db):
+    """兩個實例（模擬兩個行程）共用鏡像目錄：一方追加 / 合併後，另一方讀到的仍與 SQLite 一致。"""
+    d = fresh_db.with_suffix(".mirror")
+    m1, m2 = storage.ParquetMirror(d), storage.ParquetMirror(d)
+    uid = db.create_user("s@example.com", "s", "Conformance-1")
+    db.add_bp_many(uid, [rec(pd.Timestamp("2025-01-01", tz="UTC") + pd.Timedelta(hours=i), i) for i in range(50)])
+    m1.scan_bp(uid)
+    db.delete_bp(uid, db.list_bp(uid)["id"].iloc[:5].tolist())
+    assert len(m2.scan_bp(uid)) == 45
+    m2.compact(uid)
+    db.add_bp(uid, rec("2026-01-01T00:00:00Z", 1))
+    ref = storage.SqliteBackend().scan_bp(uid)
+    for m in (m1, m2):
+        got = m.scan_bp(uid)
+        assert got["id"].tolist() == ref["id"].tolist()
+
+
+def test_compaction_keeps_concurrent_delta(fresh_db):
+    """m1 合併期間 m2 追加了新的 delta：合併不可刪掉它，兩個實例之後讀到的都與 SQLite 一致。"""
+    d = fresh_db.with_suffix(".mirror")
+    m1, m2 = storage.ParquetMirror(d), storage.ParquetMirror(d)
+    uid = db.create_user("c@example.com", "c", "Conformance-1")
+    db.add_bp_many(uid, [rec(f"2025-01-0{i + 1}T00:00:00Z", i) for i in range(2)])
+    m1.scan_bp(uid)
+    db.add_bp(uid, rec("2025-01-05T00:00:00Z", 3))
+    m1.sync(uid)                                             # 追加第一個 delta
+
+    read = m1._read
+
+    def racing(user_id, *args):
+        table = read(user_id, *args)
+        db.add_bp(uid, rec("2025-01-04T00:00:00Z", 4))
+        m2.sync(uid)                                         # 合併讀完、寫回前，另一個實例追加 delta
+        return table
+
+    m1._read = racing
+    m1.compact(uid)
+    del m1._read
+    ref = storage.SqliteBackend().scan_bp(uid)["id"].tolist()
+    assert len(ref) == 4
+    for m in (m2, m1):                                       # m2 的行程內序號已是最新，先讀它
+        assert m.scan_bp(uid)["id"].tolist() == ref
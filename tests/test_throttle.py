@@ -0,0 +1,55 @@
+# tests/test_throttle.py
+"""登入節流（token bucket）：連續失敗達額度即鎖定、額度隨時間連續補充、跨越任何時間點都不會拿到兩倍額度。"""
+import db
+
+MAX_FAIL, WINDOW, LOCK = 5, 300.0, 900.0
+
+
+def fail(key, now):
+    db.throttle_fail(key, MAX_FAIL, WINDOW, LOCK, now=now)
+
+
+def test_burst_locks_after_max_fail(fresh_db):
+    for i in range(MAX_FAIL - 1):
+        fail("email:a", 1000.0 + i)
+        assert db.throttle_allowed(["email:a"], now=1000.0 + i)
+    fail("email:a", 1004.0)
+    assert not db.throttle_allowed(["email:a"], now=1004.0)
+    assert not db.throttle_allowed(["email:a", "client:x"], now=1004.0 + LOCK - 1)
+    assert db.throttle_allowed(["email:a"], now=1004.0 + LOCK)
+    assert db.throttle_allowed(["email:b"], now=1004.0)
+
+
+def test_no_double_allowance_across_boundary(fresh_db):
+    """固定視窗在邊界兩側各給 max_fail 次；bucket 在任何 5 秒內總共只給 max_fail 次。"""
+    t0 = 10_000.0
+    fail("email:a", t0)                                    # 固定視窗的起點
+    for dt in (WINDOW - 3, WINDOW - 2.5, WINDOW - 2):      # 視窗尾端 3 次
+        fail("email:a", t0 + dt)
+    assert db.throttle_allowed(["email:a"], now=t0 + WINDOW - 2)
+    fail("email:a", t0 + WINDOW + 1)                       # 邊界之後：固定視窗會歸零重算
+    fail("email:a", t0 + WINDOW + 1.5)
+    assert not db.throttle_allowed(["email:a"], now=t0 + WINDOW + 1.5)
+
+
+def test_tokens_refill_continuously(fresh_db):
+    per_token = WINDOW / MAX_FAIL                          # 每補回一次額度所需秒數
+    t = 0.0
+    for _ in range(MAX_FAIL - 1):
+        fail("email:a", t)
+    # 之後以補充速率失敗：額度維持在 1 附近，不會被鎖
+    for k in range(20):
+        t += per_token
+        fail("email:a", t)
+        assert db.throttle_allowed(["email:a"], now=t), k
+    fail("email:a", t + 1)                                 # 稍快一點就用完
+    assert not db.throttle_allowed(["email:a"], now=t + 1)
+
+
+def test_lock_expiry_restores_full_bucket(fresh_db):
+    for i in range(MAX_FAIL):
+        fail("email:a", float(i))
+    after = MAX_FAIL + LOCK
+    for i in range(MAX_FAIL - 1):
+        fail("email:a", after + i)
+    assert db.throttle_allowed(["email:a"], now=after + MAX_FAIL)
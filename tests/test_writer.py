@@ -0,0 +1,81 @@
+# tests/test_writer.py
+"""單一寫入執行緒：批次 commit、單筆失敗不影響同批、獨占工作排在已送出寫入之後且單獨執行。"""
+import threading
+import time
+
+import pytest
+
+import db
+import writer
+
+
+@pytest.fixture
+def w(fresh_db):
+    wr = writer.Writer(queue_limit=64, batch_limit=16)
+    yield wr
+    wr.shutdown()
+
+
+def _count() -> int:
+    with db.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM blood_pressure").fetchone()[0]
+
+
+def _block(w):
+    """排入一個擋住寫入執行緒的工作，等它開始執行後回傳放行用的 Event（之後送出的工作都會排隊）。"""
+    started, gate = threading.Event(), threading.Event()
+    w.submit(lambda: (started.set(), gate.wait()))
+    assert started.wait(10)
+    return gate
+
+
+def _rec(k: int) -> dict:
+    return {"datetime": f"2026-01-01T00:{k // 60:02d}:{k % 60:02d}Z", "systolic": 120.0, "diastolic": 80.0,
+            "pulse": 70.0}
+
+
+def test_failed_job_rolls_back_alone(w):
+    uid = db.create_user("w@example.com", "w", "Writer-check-1")
+    gate = _block(w)                                        # 讓後面的工作排成同一批
+    ok = [w.submit(db.add_bp, uid, _rec(k)) for k in range(5)]
+    bad = w.submit(db.add_bp, uid, {"datetime": "not a date"})
+    gate.set()
+    assert all(isinstance(f.result(timeout=10), int) for f in ok)
+    with pytest.raises(Exception):
+        bad.result(timeout=10)
+    assert _count() == 5
+    assert w.stats()["failed"] == 1
+
+
+def test_exclusive_runs_after_queued_writes_and_alone(w):
+    uid = db.create_user("x@example.com", "x", "Writer-check-1")
+    gate = _block(w)
+    before = [w.submit(db.add_bp, uid, _rec(k)) for k in range(10)]
+    seen = {}
+
+    def snapshot():
+        seen["count"] = _count()
+        seen["depth"] = w.stats()["depth"]
+        return "done"
+
+    result = []
+    t = threading.Thread(target=lambda: result.append(w.call_exclusive(snapshot, timeout=10)))
+    t.start()
+    deadline = time.monotonic() + 10
+    while w.stats()["depth"] < 11 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    after = [w.submit(db.add_bp, uid, _rec(100 + k)) for k in range(10)]
+    gate.set()
+    t.join()
+    for f in before + after:
+        f.result(timeout=10)
+    assert result == ["done"]
+    assert seen == {"count": 10, "depth": 10}                # 之前的寫完、之後的仍在排隊
+    assert _count() == 20
+
+
+def test_exclusive_inside_job_rejected(w):
+    def nested():
+        return w.call_exclusive(lambda: None)
+    with pytest.raises(RuntimeError):
+        w.call(nested, timeout=10)
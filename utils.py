@@ -1,9 +1,14 @@
 # utils.py
 from __future__ import annotations
-from typing import Dict, Any, Tuple
-from io import BytesIO
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple, List
 from datetime import datetime
-import pandas as pd
+
+import instrument
+
+# numpy / pandas 只在資料處理函式內載入，讓只需要 init_state / TZ 的頁面保持輕量
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 # Streamlit 僅在需要時導入（避免某些離線工具調用時報錯）
 try:
@@ -28,8 +33,11 @@ def _get_local_tz() -> ZoneInfo:
     """
     default_name = "Asia/Taipei"
     tz_name = None
-    if st and getattr(st, "secrets", None):
-        tz_name = st.secrets.get("TZ", None)
+    try:
+        if st and getattr(st, "secrets", None):
+            tz_name = st.secrets.get("TZ", None)
+    except Exception:  # 無 secrets.toml（離線工具 / benchmark）
+        tz_name = None
     if not tz_name:
         import os
         tz_name = os.environ.get("TZ", None)
@@ -69,17 +77,70 @@ def init_state() -> None:
 # ----------------------------
 # 檔案輸出工具
 # ----------------------------
+def timestamped_name(filename_prefix: str, ext: str) -> str:
+    """建議檔名：{prefix}_{UTC 時間戳}.{ext}，避免覆蓋與混淆。"""
+    ts = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
+    return f"{filename_prefix}_{ts}.{ext}"
+
+
 def export_csv(df: pd.DataFrame, filename_prefix: str = "export") -> Tuple[bytes, str]:
     """
     將 DataFrame 匯出為 UTF-8 CSV bytes 與建議檔名。
     儲存時一律加入 UTC 時間戳，避免覆蓋與混淆。
+    大量資料請改用 export.open_export()（串流、不整份載入記憶體）。
     """
-    ts = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
-    name = f"{filename_prefix}_{ts}.csv"
+    import pandas as pd
+    name = timestamped_name(filename_prefix, "csv")
+    # tz-aware 時間欄先整欄轉成 ISO8601（UTC，Z）字串；to_csv 逐格格式化 datetime 慢得多
+    dt_cols = [c for c in df.columns if isinstance(df[c].dtype, pd.DatetimeTZDtype)]
+    if dt_cols:
+        df = df.assign(**{c: iso_utc_strings(df[c]) for c in dt_cols})
     data = df.to_csv(index=False).encode("utf-8")
     return data, name
 
 
+def iso_utc_strings(s: pd.Series) -> pd.Series:
+    """tz-aware datetime 欄 → 'YYYY-MM-DDTHH:MM:SSZ' 字串（numpy 向量化；NaT → 空字串）。"""
+    import numpy as np
+    import pandas as pd
+    naive = s.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy().astype("datetime64[s]")
+    text = np.char.add(np.datetime_as_string(naive, unit="s"), "Z")
+    return pd.Series(np.where(np.isnat(naive), "", text), index=s.index, dtype=object)
+
+
+# ----------------------------
+# CSV 匯入
+# ----------------------------
+def normalize_bp_csv(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    將使用者上傳的 CSV 自動對應成 add_bp_many 可用的欄位：
+    datetime（或 date + time）、systolic、diastolic、pulse、meds、note（支援中文欄名）。
+    缺少必要值的列會被丟棄；datetime 保留為 datetime64（naive 由 db 視為 UTC），不再轉字串。
+    """
+    import pandas as pd
+    candidate_cols = {str(c).lower(): c for c in raw.columns}
+    def pick(*names):
+        for n in names:
+            if n in candidate_cols: return candidate_cols[n]
+        return None
+    out = pd.DataFrame(index=raw.index)
+    if pick("datetime","日期時間"):
+        out["datetime"] = pd.to_datetime(raw[pick("datetime","日期時間")], errors="coerce")
+    else:
+        dcol, tcol = pick("date","日期"), pick("time","時間")
+        out["datetime"] = pd.to_datetime(raw[dcol].astype(str) + " " + raw[tcol].astype(str), errors="coerce") if dcol and tcol else pd.NaT
+    out["systolic"]  = pd.to_numeric(raw.get(pick("systolic","收縮壓","sys"), pd.NA), errors="coerce")
+    out["diastolic"] = pd.to_numeric(raw.get(pick("diastolic","舒張壓","dia"), pd.NA), errors="coerce")
+    out["pulse"]     = pd.to_numeric(raw.get(pick("pulse","心跳","hr","脈搏"), pd.NA), errors="coerce")
+    out["meds"]      = raw.get(pick("meds","服藥"), "")
+    out["note"]      = raw.get(pick("note","備註"), "")
+    out = out.dropna(subset=["datetime","systolic","diastolic","pulse"])
+    # 整欄轉型（不逐列 apply）
+    for col in ("meds", "note"):
+        out[col] = out[col].where(out[col].notna(), "").astype(str)
+    return out.reset_index(drop=True)
+
+
 # ----------------------------
 # 模組預設設定
 # ----------------------------
@@ -95,10 +156,49 @@ def default_cfg_bp() -> Dict[str, Any]:
     }
 
 
+# ----------------------------
+# 血壓分級門檻（mmHg）
+# ----------------------------
+# 常見分級（可依需求微調，或呼叫 enrich_bp(df, thresholds={...}) 局部覆寫）
+BP_THRESHOLDS: Dict[str, float] = {
+    "elevated_sys": 120,   # 收縮壓 ≥ 此值（且舒張壓正常）→ Elevated
+    "stage1_sys": 130,     # 收縮壓 ≥ 此值 → Stage 1
+    "stage2_sys": 140,     # 收縮壓 ≥ 此值 → Stage 2
+    "stage1_dia": 80,      # 舒張壓 ≥ 此值 → Stage 1
+    "stage2_dia": 90,      # 舒張壓 ≥ 此值 → Stage 2
+}
+
+BP_CATEGORIES = ["Normal", "Elevated", "Hypertension Stage 1", "Hypertension Stage 2", "Unknown"]
+
+
+def classify_bp(systolic: pd.Series, diastolic: pd.Series,
+                thresholds: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    整欄分類血壓，回傳 (category, cat_level) 兩個 ndarray。
+    條件依序判斷、先符合者勝出；收縮或舒張壓缺值 → ("Unknown", 99)。
+    """
+    import numpy as np
+    th = {**BP_THRESHOLDS, **(thresholds or {})}
+    s = systolic.to_numpy(dtype=float, na_value=np.nan)
+    d = diastolic.to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(s) | np.isnan(d)
+    conds = [
+        missing,
+        (s < th["elevated_sys"]) & (d < th["stage1_dia"]),
+        (s >= th["elevated_sys"]) & (s < th["stage1_sys"]) & (d < th["stage1_dia"]),
+        ((s >= th["stage1_sys"]) & (s < th["stage2_sys"])) | ((d >= th["stage1_dia"]) & (d < th["stage2_dia"])),
+        (s >= th["stage2_sys"]) | (d >= th["stage2_dia"]),
+    ]
+    level = np.select(conds, [99, 0, 1, 2, 3], default=99).astype(np.int64)
+    category = np.array(BP_CATEGORIES, dtype=object)[np.where(level == 99, 4, level)]
+    return category, level
+
+
 # ----------------------------
 # 資料增豐：血壓衍生欄位
 # ----------------------------
-def enrich_bp(df: pd.DataFrame) -> pd.DataFrame:
+@instrument.timed("enrich", "enrich_bp", rows=len)
+def enrich_bp(df: pd.DataFrame, thresholds: Optional[Dict[str, float]] = None) -> pd.DataFrame:
     """
     穩健版 enrich：
     1) 將 datetime 欄位統一轉為 tz-aware 的 UTC（無論原本是 naive 或 tz-aware）
@@ -110,53 +210,126 @@ def enrich_bp(df: pd.DataFrame) -> pd.DataFrame:
     2) 轉型數值欄位，計算：
        - pp（脈壓）= systolic - diastolic
        - map（平均動脈壓）= diastolic + pp / 3
-    3) 依常見門檻建立分類 category / cat_level（可自行調整門檻）
+    3) 依 BP_THRESHOLDS 建立分類 category / cat_level（thresholds 可局部覆寫門檻）
     4) 依 datetime 排序，回傳新 DataFrame
+    輸出採精簡型別（快取會常駐記憶體）：血壓 / 心跳 / pp / map 為 float32（整數讀值可精確表示、缺值仍為 NaN），
+    category 為 Categorical（BP_CATEGORIES）、cat_level 為 int8，meds / note 為字典編碼的 category。
     """
+    import numpy as np
+    import pandas as pd
     if df is None or df.empty:
         return pd.DataFrame(columns=[
             "id", "datetime", "systolic", "diastolic", "pulse", "pp", "map", "category", "cat_level", "meds", "note"
         ])
 
-    out = df.copy()
+    out = df.copy(deep=False)  # Copy-on-Write：下面改寫的欄位才會配置新陣列，不先整份複製
 
     # --- 1) 統一時間成 tz-aware 的 UTC ---
-    # 對混雜（naive + tz-aware）也能一次處理
-    out["datetime"] = pd.to_datetime(out["datetime"], utc=True, errors="coerce")
+    # db.list_bp 已回傳 datetime64[UTC]（由 epoch 整欄轉型），此處不需再解析；
+    # 其他來源的字串（...T...Z 與 naive 混雜）以 ISO8601 一次處理
+    if not isinstance(out["datetime"].dtype, pd.DatetimeTZDtype):
+        out["datetime"] = pd.to_datetime(out["datetime"], utc=True, errors="coerce", format="ISO8601")
+    elif str(out["datetime"].dt.tz) != "UTC":
+        out["datetime"] = out["datetime"].dt.tz_convert("UTC")
 
     # --- 2) 數值欄位轉型 ---
     for col in ("systolic", "diastolic", "pulse"):
         if col in out.columns:
-            out[col] = pd.to_numeric(out[col], errors="coerce")
+            out[col] = pd.to_numeric(out[col], errors="coerce").astype(np.float32)
 
     # 衍生欄位
     out["pp"] = out["systolic"] - out["diastolic"]
-    out["map"] = out["diastolic"] + (out["pp"] / 3.0)
-
-    # --- 3) 分類 ---
-    def _bp_category(s: float, d: float) -> tuple[str, int]:
-        if pd.isna(s) or pd.isna(d):
-            return ("Unknown", 99)
-        # 常見分級（可依需求微調）
-        if s < 120 and d < 80:
-            return ("Normal", 0)
-        if 120 <= s < 130 and d < 80:
-            return ("Elevated", 1)
-        if (130 <= s < 140) or (80 <= d < 90):
-            return ("Hypertension Stage 1", 2)
-        if (s >= 140) or (d >= 90):
-            return ("Hypertension Stage 2", 3)
-        return ("Unknown", 99)
-
-    cats = out.apply(lambda r: _bp_category(r.get("systolic"), r.get("diastolic")), axis=1, result_type="expand")
-    out["category"] = cats[0]
-    out["cat_level"] = pd.to_numeric(cats[1], errors="coerce")
+    out["map"] = out["diastolic"] + (out["pp"] / np.float32(3.0))
+
+    # --- 3) 分類（整欄向量化）；category 直接由等級代碼建 Categorical，不產生字串陣列 ---
+    _, level = classify_bp(out["systolic"], out["diastolic"], thresholds)
+    out["category"] = pd.Categorical.from_codes(np.where(level == 99, 4, level), categories=BP_CATEGORIES)
+    out["cat_level"] = level.astype(np.int8)
 
     # 若缺必要欄位，補齊空欄，避免後續 UI 報 KeyError
     for col in ("meds", "note"):
         if col not in out.columns:
             out[col] = ""
+        out[col] = out[col].astype("category")  # 用藥 / 備註重複度高：字典編碼
 
     # --- 4) 依時間排序 ---
     out = out.sort_values("datetime", kind="mergesort").reset_index(drop=True)
     return out
+
+
+# ----------------------------
+# 圖表降採樣（保留峰值，限制每條序列的點數）
+# ----------------------------
+CHART_MAX_POINTS = 1000  # 每條序列預設上限；頁面可用 st.secrets["CHART_MAX_POINTS"] 覆寫
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets：回傳要保留的列索引（已排序，含首尾）。
+    x 需已遞增；n_out >= len(x) 或 n_out < 3 時回傳全部 / 首尾。
+    """
+    import numpy as np
+    n = len(x)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # 中間 n-2 個點切成 n_out-2 桶；edges[i]..edges[i+1] 為第 i 桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        # 下一桶平均點（最後一桶以終點為準）
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        if nlo >= nhi:
+            nlo, nhi = n - 1, n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """等筆數分桶，每桶保留最小與最大值那一列（另含首尾）；回傳排序後索引，至多 2*n_buckets+2 筆。"""
+    import numpy as np
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    bucket = (np.arange(n) * n_buckets) // n
+    order = np.lexsort((y, bucket))
+    starts = np.r_[0, np.flatnonzero(np.diff(bucket[order])) + 1]
+    ends = np.r_[starts[1:], n] - 1
+    return np.unique(np.r_[order[starts], order[ends], 0, n - 1])
+
+
+@instrument.timed("chart", "downsample", rows=len)
+def downsample(df: pd.DataFrame, x: str, y: str, max_points: int = CHART_MAX_POINTS,
+               by: Optional[str] = None, method: str = "lttb") -> pd.DataFrame:
+    """
+    依 x 排序後降採樣到每條序列最多 max_points 點（by 指定分組欄位，如 melt 後的 "type"）。
+    method: "lttb"（形狀最接近）或 "minmax"（每桶保留極值，峰值不漏）。
+    y 為缺值的列先剔除；點數未超過上限時原樣回傳。
+    """
+    import pandas as pd
+    if df.empty:
+        return df
+    groups: List[pd.DataFrame] = [g for _, g in df.groupby(by, sort=False)] if by else [df]
+    if all(len(g) <= max_points for g in groups):
+        return df
+    parts = []
+    for g in groups:
+        g = g[g[y].notna()].sort_values(x, kind="mergesort")
+        if method == "minmax":
+            idx = minmax_indices(g[y].to_numpy(), max(1, (max_points - 2) // 2))
+        else:
+            xs = g[x]
+            xv = (xs.astype("int64") if pd.api.types.is_datetime64_any_dtype(xs) else xs).to_numpy(dtype=float)
+            idx = lttb_indices(xv, g[y].to_numpy(dtype=float), max_points)
+        parts.append(g.iloc[idx])
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,259 @@
+# writer.py
+"""
+單一寫入執行緒（group commit）：所有 session 的血壓寫入排進同一個有上限的佇列，
+由一條背景執行緒取出目前排隊中的工作（最多 WRITE_BATCH 筆），在同一個交易內依序執行後一次 commit。
+- 每筆工作各自包一層 SAVEPOINT：單筆失敗只回滾自己，不影響同批其他寫入
+- BEGIN IMMEDIATE 一開始就取得寫入鎖，交易中途不會因 WAL 寫入競爭而 database is locked
+- submit() 回傳 concurrent.futures.Future，commit 完成後才 set_result（等待即代表已寫入資料庫）
+- 佇列已滿且等候 WRITE_TIMEOUT 秒仍無空位時丟 WriterBusy
+- stats() 回報佇列深度、批次大小與 commit 延遲統計
+- call_exclusive()：排在目前所有寫入之後、不包交易單獨執行（如整份資料庫還原），期間其他寫入在佇列中等候
+"""
+from __future__ import annotations
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import db
+import instrument
+
+WRITE_QUEUE = int(os.environ.get("WRITE_QUEUE", 256))
+WRITE_BATCH = int(os.environ.get("WRITE_BATCH", 64))
+WRITE_TIMEOUT = float(os.environ.get("WRITE_TIMEOUT", 5.0))
+
+
+class WriterBusy(RuntimeError):
+    """寫入佇列已滿，請求被拒絕（應回應「系統忙碌」）。"""
+
+
+_STOP = object()
+_Job = Tuple[Callable[..., Any], tuple, dict, Future, float, bool]   # 最後一欄：是否獨占執行
+
+
+class Writer:
+    def __init__(self, queue_limit: int = WRITE_QUEUE, batch_limit: int = WRITE_BATCH,
+                 timeout: float = WRITE_TIMEOUT, samples: int = 512):
+        self.queue_limit = max(1, int(queue_limit))
+        self.batch_limit = max(1, int(batch_limit))
+        self.timeout = timeout
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.queue_limit)
+        self._held: Optional[_Job] = None                # 組批時遇到的獨占工作，留到下一輪單獨執行
+        self._lock = threading.Lock()
+        self._counters = {"submitted": 0, "committed": 0, "failed": 0, "rejected": 0, "batches": 0}
+        self._batch_sizes: deque = deque(maxlen=samples)
+        self._commit_ms: deque = deque(maxlen=samples)   # 整批執行 + commit
+        self._wait_ms: deque = deque(maxlen=samples)     # 排隊時間
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    # ---------- 呼叫端 ----------
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """排入寫入工作 fn(*args, **kwargs)（例如 db.add_bp）；回傳 Future，結果為 fn 的回傳值。"""
+        return self._enqueue(fn, args, kwargs, False)
+
+    def _enqueue(self, fn: Callable[..., Any], args: tuple, kwargs: dict, exclusive: bool) -> Future:
+        fut: Future = Future()
+        if threading.current_thread() is self._thread:
+            if exclusive:
+                raise RuntimeError("call_exclusive() cannot run inside a write job")
+            # 寫入工作內又提交寫入：已在批次交易中，直接執行（排隊會自己等自己）
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+        try:
+            self._queue.put((fn, args, kwargs, fut, time.perf_counter(), exclusive), timeout=self.timeout)
+        except queue.Full:
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise WriterBusy("database write queue is full") from None
+        with self._lock:
+            self._counters["submitted"] += 1
+        return fut
+
+    def call(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """submit 後等待 commit 完成並回傳結果；fn 的例外原樣拋出。"""
+        with instrument.span("writer", getattr(fn, "__name__", "call")):
+            return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def call_exclusive(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None,
+                       **kwargs: Any) -> Any:
+        """
+        等先前排入的寫入全部 commit 後，由寫入執行緒在交易之外單獨執行 fn；執行期間不處理其他寫入
+        （之後排入的工作在佇列中等候，佇列滿時照常 WriterBusy）。用於需要獨占資料庫的操作，如整份還原。
+        """
+        with instrument.span("writer", getattr(fn, "__name__", "call_exclusive")):
+            return self._enqueue(fn, args, kwargs, True).result(timeout=timeout)
+
+    # ---------- 寫入執行緒 ----------
+    def _take(self) -> Tuple[List[_Job], bool]:
+        """阻塞取第一筆，再不等待地取出其餘排隊中的工作（最多 batch_limit 筆）；獨占工作自成一批。"""
+        first, self._held = self._held, None
+        if first is None:
+            first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        if first[5]:
+            return [first], False
+        batch, stop = [first], False
+        while len(batch) < self.batch_limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            if item[5]:
+                self._held = item
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self) -> None:
+        while True:
+            batch, stop = self._take()
+            if batch and batch[0][5]:
+                self._exclusive(batch[0])
+            elif batch:
+                self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: List[_Job]) -> None:
+        start = time.perf_counter()
+        results: List[Tuple[Future, bool, Any]] = []
+        try:
+            with db.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, args, kwargs, fut, _, _ in batch:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        res = fn(*args, **kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        results.append((fut, False, e))
+                    else:
+                        results.append((fut, True, res))
+                    conn.execute("RELEASE job")
+        except Exception as e:
+            # BEGIN / commit 本身失敗：整批都沒寫入
+            for _, _, _, fut, _, _ in batch:
+                if not fut.done() and (fut.running() or fut.set_running_or_notify_cancel()):
+                    fut.set_exception(e)
+            ok = 0
+        else:
+            for fut, success, value in results:
+                if success:
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+            ok = sum(1 for _, success, _ in results if success)
+        self._record(batch, ok, start, "commit_batch")
+
+    def _exclusive(self, job: _Job) -> None:
+        fn, args, kwargs, fut, _, _ = job
+        start = time.perf_counter()
+        ok = 0
+        if fut.set_running_or_notify_cancel():
+            try:
+                fut.set_result(fn(*args, **kwargs))
+                ok = 1
+            except Exception as e:
+                fut.set_exception(e)
+        self._record([job], ok, start, "exclusive")
+
+    def _record(self, batch: List[_Job], ok: int, start: float, kind: str) -> None:
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["committed"] += ok
+            self._counters["failed"] += len(batch) - ok
+            self._batch_sizes.append(len(batch))
+            self._commit_ms.append(elapsed)
+            self._wait_ms.extend((start - item[4]) * 1000.0 for item in batch)
+        if instrument.is_enabled():
+            instrument.record("writer", kind, elapsed, rows=len(batch))
+
+    # ---------- 監控 / 關閉 ----------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes, commit, wait = sorted(self._batch_sizes), sorted(self._commit_ms), sorted(self._wait_ms)
+            out: Dict[str, Any] = {
+                "depth": self._queue.qsize(),
+                "queue_limit": self.queue_limit,
+                "batch_limit": self.batch_limit,
+                **self._counters,
+                "batch_size_last": self._batch_sizes[-1] if self._batch_sizes else 0,
+            }
+        for name, xs in (("batch_size", sizes), ("commit_ms", commit), ("wait_ms", wait)):
+            out[f"{name}_p50"] = xs[len(xs) // 2] if xs else 0
+            out[f"{name}_p95"] = xs[min(len(xs) - 1, int(len(xs) * 0.95))] if xs else 0
+            out[f"{name}_max"] = xs[-1] if xs else 0
+        return out
+
+    def shutdown(self, wait: bool = True) -> None:
+        """停止接受新工作；已排隊的工作仍會寫完（wait=True 時等待寫入執行緒結束）。"""
+        self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+
+
+_writer: Optional[Writer] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> Writer:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = Writer()
+    return _writer
+
+
+def configure(queue_limit: Optional[int] = None, batch_limit: Optional[int] = None,
+              timeout: Optional[float] = None) -> Writer:
+    """重建寫入執行緒（舊的會先寫完已排隊的工作）。"""
+    global _writer
+    with _writer_lock:
+        old = _writer
+        _writer = Writer(
+            queue_limit=WRITE_QUEUE if queue_limit is None else queue_limit,
+            batch_limit=WRITE_BATCH if batch_limit is None else batch_limit,
+            timeout=WRITE_TIMEOUT if timeout is None else timeout,
+        )
+    if old is not None:
+        old.shutdown()
+    return _writer
+
+
+def submit(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    return get_writer().submit(fn, *args, **kwargs)
+
+
+def call(fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+    return get_writer().call(fn, *args, timeout=timeout, **kwargs)
+
+
+def call_exclusive(fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+    return get_writer().call_exclusive(fn, *args, timeout=timeout, **kwargs)
+
+
+def stats() -> Dict[str, Any]:
+    return get_writer().stats()
+
+
+@atexit.register
+def _drain() -> None:
+    # 行程結束前把已排隊的寫入做完
+    if _writer is not None:
+        _writer.shutdown()